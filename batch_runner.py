@@ -0,0 +1,159 @@
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from extraction_models import ElectionData
+from extraction_cache import ExtractionCache
+from extraction_backends import BACKENDS, HedgedBackend, get_backend
+from extraction_metrics import ExtractionMetrics
+from election_store import DuplicatePolicy, ElectionStore
+from pdf_text import extract_page_texts
+import rate_limiter
+import scrape_election_pdf_structured
+
+
+# runs a whole election's worth of county PDFs: files are spread across worker processes, so the
+# CPU bound pdfplumber stage scales with cores, and every process draws from one shared RPM/TPM
+# budget (rate_limiter.RateLimiter), so the LLM stage scales with the API quota without tripping it.
+# Each PDF gets its own results directory, and all of them are summed into one roll-up.
+
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 30000
+
+
+def find_pdfs(inputs: Sequence[str]) -> List[Path]:
+    "Expands directories (every *.pdf inside) and glob patterns into a sorted, de-duplicated list of PDFs"
+    pdfs = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            pdfs.extend(sorted(path.glob("*.pdf")))
+        elif glob.has_magic(item):
+            pdfs.extend(Path(match) for match in sorted(glob.glob(item, recursive=True)))
+        else:
+            pdfs.append(path)
+    return list(dict.fromkeys(pdf.resolve() for pdf in pdfs))
+
+
+def output_dirs(pdfs: List[Path], output_dir: Path) -> Dict[Path, Path]:
+    # one directory per PDF named after it, with a suffix if two counties' files share a name
+    dirs, used = {}, set()
+    for pdf in pdfs:
+        name, n = pdf.stem, 1
+        while name in used:
+            n += 1
+            name = f"{pdf.stem}-{n}"
+        used.add(name)
+        dirs[pdf] = output_dir / name
+    return dirs
+
+
+def write_rollup(results: Sequence[ElectionData], output_dir: Path) -> ElectionData:
+    "Sums the counties' results into <output_dir>/rollup.json"
+    # the same contest in several counties adds up to the election-wide result
+    rollup = ElectionStore(choice_policy=DuplicatePolicy.SUM, summary_policy=DuplicatePolicy.SUM)
+    for result in results:
+        rollup.merge(result.model_copy(deep=True))
+    rollup_data = rollup.to_election_data()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / "rollup.json", "w") as f:
+        f.write(rollup_data.model_dump_json())
+    return rollup_data
+
+
+# worker: runs one PDF end to end inside a pool process
+def process_pdf(pdf_path: Path, pdf_output_dir: Path, api_key: str, base_url: Optional[str] = None,
+                max_concurrency: int = 4, cache_dir: Optional[Path] = Path(".extraction_cache"),
+                export_formats: Sequence[str] = ("parquet",), resume: bool = False,
+                backend_name: str = "structured", backend_options: Optional[dict] = None,
+                hedge: bool = False, results_db_path: Optional[Path] = None) -> ElectionData:
+    pdf_output_dir.mkdir(parents=True, exist_ok=True)
+    # the pool already gives each PDF its own core, so extract pages in this process - main then reads them from the page cache
+    extract_page_texts(pdf_path, max_workers=1)
+    cache = ExtractionCache(cache_dir) if cache_dir is not None else None
+    # clients can't be pickled, so each worker builds its own backend (and with it its own connection pool)
+    backend = get_backend(backend_name, api_key, base_url, **(backend_options or {}))
+    if hedge:
+        backend = HedgedBackend(backend)
+    with backend:
+        return scrape_election_pdf_structured.main(
+            pdf_path, api_key, max_concurrency, base_url, cache, use_rule_parser=True,
+            journal_path=pdf_output_dir / "election_data.journal.jsonl", resume=resume,
+            export_formats=export_formats, validate=True, output_path=pdf_output_dir / "election_data.json", backend=backend,
+            metrics=ExtractionMetrics(pdf_output_dir / "metrics.jsonl"), compact_prompts=True,
+            ndjson_path=pdf_output_dir / "election_data.ndjson", skip_non_result_pages=True, results_db_path=results_db_path)
+
+
+def main(inputs: Sequence[str], api_key: str, output_dir: Path = Path("results"), processes: Optional[int] = None,
+         max_concurrency: int = 4, base_url: Optional[str] = None,
+         requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute: int = DEFAULT_TOKENS_PER_MINUTE,
+         cache_dir: Optional[Path] = Path(".extraction_cache"), export_formats: Sequence[str] = ("parquet",),
+         resume: bool = False, backend_name: str = "structured", backend_options: Optional[dict] = None,
+         hedge: bool = False, results_db_path: Optional[Path] = None) -> ElectionData:
+
+    # processes PDFs at a time, each with max_concurrency requests in flight, all under one RPM/TPM budget
+    # writes <output_dir>/<pdf name>/election_data.json per PDF and <output_dir>/rollup.json summing every county
+    # with results_db_path, every PDF is also stored in that results database (the workers share the file)
+    pdfs = find_pdfs(inputs)
+    if not pdfs:
+        raise ValueError(f"no PDFs found in {', '.join(inputs)}")
+    dirs = output_dirs(pdfs, Path(output_dir))
+    processes = min(processes or os.cpu_count() or 1, len(pdfs))
+    limiter = rate_limiter.RateLimiter(requests_per_minute, tokens_per_minute)
+    print(f"Processing {len(pdfs)} PDFs with {processes} processes x {max_concurrency} requests, "
+          f"limited to {requests_per_minute} RPM / {tokens_per_minute} TPM")
+
+    start = time.time()
+    results: Dict[Path, ElectionData] = {}
+    with ProcessPoolExecutor(max_workers=processes, initializer=rate_limiter.install, initargs=(limiter,)) as executor:
+        futures = {executor.submit(process_pdf, pdf, dirs[pdf], api_key, base_url, max_concurrency, cache_dir,
+                                   export_formats, resume, backend_name, backend_options, hedge,
+                                   results_db_path): pdf for pdf in pdfs}
+        for future in as_completed(futures):
+            pdf = futures[future]
+            try:
+                results[pdf] = future.result()
+                print(f"Finished {pdf.name}: {len(results[pdf].contests)} contests -> {dirs[pdf]}")
+            except Exception as e:
+                # one bad PDF shouldn't sink the rest of the election; --resume picks up its journal later
+                print(f"FAILED {pdf.name}: {type(e).__name__}: {e}")
+
+    rollup_data = write_rollup([results[pdf] for pdf in pdfs if pdf in results], Path(output_dir))
+    print(f"Finished {len(results)}/{len(pdfs)} PDFs in {time.time() - start:.1f}s, "
+          f"roll-up has {len(rollup_data.contests)} contests")
+    return rollup_data
+
+
+if __name__ == "__main__":
+
+    import argparse
+    from dotenv import load_dotenv
+    load_dotenv() # make sure our environment variables are loaded
+
+    parser = argparse.ArgumentParser(description="Extract election results from many county PDFs at once")
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories of PDFs, or glob patterns")
+    parser.add_argument("--output-dir", type=Path, default=Path("results"))
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--rpm", type=int, default=int(os.getenv("OPENAI_RPM", DEFAULT_REQUESTS_PER_MINUTE)),
+                        help="requests per minute shared by all workers")
+    parser.add_argument("--tpm", type=int, default=int(os.getenv("OPENAI_TPM", DEFAULT_TOKENS_PER_MINUTE)),
+                        help="tokens per minute shared by all workers")
+    parser.add_argument("--resume", action="store_true", help="replay each PDF's batch journal from an interrupted run")
+    parser.add_argument("--backend", choices=[*BACKENDS, "replay"], default="structured",
+                        help="how to call the model; replay answers from recorded responses without the network")
+    parser.add_argument("--hedge", action="store_true",
+                        help="send a request again when it is slower than recent requests, and keep the first answer")
+    parser.add_argument("--db", type=Path, default=None, metavar="PATH",
+                        help="also store every PDF's results in this results database (see results_db)")
+    args = parser.parse_args()
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key and args.backend != "replay":
+        raise ValueError("API key not found")
+    max_concurrency = int(os.getenv("MAX_CONCURRENCY", "4"))
+    main(args.inputs, api_key, args.output_dir, args.processes, max_concurrency, os.getenv("OPENAI_BASE_URL"),
+         args.rpm, args.tpm, resume=args.resume, backend_name=args.backend, hedge=args.hedge,
+         results_db_path=args.db)
@@ -0,0 +1,325 @@
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+from extraction_backends import (BACKENDS, BackendResponse, ExtractionBackend, HedgedBackend, MissingRecordingError,
+                                 RecordingBackend, get_backend)
+from extraction_metrics import ExtractionMetrics, peak_rss_mb
+from extraction_models import ElectionData
+from election_store import ElectionStore
+from page_classifier import PAGE_OVERRIDES
+from pdf_text import extract_page_texts, page_count
+from token_budget import DEFAULT_MAX_OUTPUT_TOKENS, count_tokens, pack_pages
+from scrape_election_pdf_structured import SYSTEM_PROMPT, extraction_prompt, main
+from rule_parser import parse_pages
+from wire_format import encode
+
+
+# end to end benchmark over the bundled PDFs: each one goes through the structured script's main with its CLI's
+# settings (rule parser, page classifier, prompt compaction, validation, ndjson sink, parquet export), with the model
+# answers replayed from recordings so a run costs nothing, needs no network, and gives the same batches and tokens
+# every time. Stage times are the ones main's ExtractionMetrics collects.
+# Each PDF runs in a fresh process (so peak RSS is that PDF's own), repeat times, and the median
+# time of every stage is reported. Save a run with --output and compare later runs against it with --baseline.
+# Without recordings (a fresh checkout) they are built offline first. Only pages the rule parser can't read
+# (all of large-pagesplit-election-spring2020.pdf) reach the model, and offline they get an empty answer,
+# so the cost of merging and serializing the model's results is only measured with answers recorded live.
+#
+#   python benchmark.py --record                 # with OPENAI_API_KEY set: record the model's answers instead
+#   python benchmark.py --record-offline         # rebuild the offline recordings, e.g. after changing the prompt
+#   python benchmark.py --output baseline.json   # replay and save the numbers
+#   python benchmark.py --baseline baseline.json # replay again and flag regressions
+#   python benchmark.py --wire-format [--live]   # completion tokens (and latency) of full vs compact answers
+#   python benchmark.py --hedging                # live: batch latency percentiles with and without hedged requests
+
+BENCHMARK_PDFS = ["test_results.pdf", "Fall-2024-first-post-report.pdf", "large-pagesplit-election-spring2020.pdf"]
+BENCHMARK_RECORDINGS = Path("benchmark_recordings")
+# main's stages - merges run while the model stage does, but nested stages are never counted twice, so they add up
+STAGES = ["pdf_text", "rule_parser", "batching", "model", "merge", "validation", "serialization"]
+# what the structured script's CLI runs main with
+PIPELINE_OPTIONS = {"use_rule_parser": True, "skip_non_result_pages": True, "compact_prompts": True, "validate": True,
+                    "export_formats": ("parquet",)}
+# stage times below this are mostly noise, so they never count as a regression
+MIN_REGRESSION_SECONDS = 0.01
+
+
+class OfflineBackend(ExtractionBackend):
+    "Answers every prompt with no results - what reaches the model is only ever the pages the rule parser can't read"
+    name = "offline"
+
+    def _extract(self, system_prompt: str, prompt: str, max_tokens: int) -> BackendResponse:
+        data = ElectionData(contests=[], summary=[])
+        return BackendResponse(data=data, prompt_tokens=count_tokens(system_prompt + prompt),
+                               completion_tokens=count_tokens(data.model_dump_json()), model=self.model)
+
+
+def record_offline(pdf_paths: Sequence[Path], recordings_dir: Path = BENCHMARK_RECORDINGS) -> int:
+    "Records an answer to every request run_pipeline sends, returns the number of recordings"
+    recordings_dir = Path(recordings_dir)
+    before = len(list(recordings_dir.glob("*.json"))) if recordings_dir.exists() else 0
+    # recorded under the replay backend's model, so replay finds them
+    backend = RecordingBackend(OfflineBackend(get_backend("replay", recordings_dir=recordings_dir).model), recordings_dir)
+    for pdf_path in pdf_paths:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            run_pipeline(pdf_path, backend)
+    return len(list(recordings_dir.glob("*.json"))) - before
+
+
+def run_pipeline(pdf_path: Path, backend: ExtractionBackend, max_concurrency: int = 4) -> dict:
+    "Runs one PDF through the structured script's main, with its CLI's settings, and returns the time of each stage"
+    pdf_path, page_overrides_path = Path(pdf_path).resolve(), PAGE_OVERRIDES.resolve()
+    metrics = ExtractionMetrics()
+    # in an empty directory, so there is no page text cache (we'd be timing a JSON load) and the outputs are thrown away
+    with tempfile.TemporaryDirectory() as output_dir, contextlib.chdir(output_dir):
+        election_data = main(pdf_path, "", max_concurrency, backend=backend, metrics=metrics, journal_path=None,
+                             output_path=Path("election_data_cumulative.json"),
+                             ndjson_path=Path("election_data_cumulative.ndjson"),
+                             page_overrides_path=page_overrides_path, **PIPELINE_OPTIONS)
+    return {
+        "stages": {stage: metrics.stages.get(stage, 0.0) for stage in STAGES},
+        "pages": page_count(pdf_path),
+        "batches": len(metrics.batches),
+        "contests": len(election_data.contests),
+        "choices": sum(len(contest.choices) for contest in election_data.contests),
+    }
+
+
+# worker: one PDF, in its own process
+def benchmark_pdf(pdf_path: Path, recordings_dir: Path, repeat: int = 3, max_concurrency: int = 4,
+                  record_backend: Optional[str] = None, api_key: Optional[str] = None,
+                  base_url: Optional[str] = None) -> dict:
+    # loading the tokenizer is a one-off cost per process, not part of batching
+    count_tokens("")
+    runs = []
+    for _ in range(1 if record_backend else repeat):
+        if record_backend:
+            backend = RecordingBackend(get_backend(record_backend, api_key, base_url), recordings_dir)
+        else:
+            backend = get_backend("replay", recordings_dir=recordings_dir)
+        # the pipeline prints every batch and merge, which we don't want in the report (or the timings)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            run = run_pipeline(pdf_path, backend, max_concurrency)
+        run.update(backend.usage())
+        runs.append(run)
+
+    result = {key: value for key, value in runs[-1].items() if key != "stages"}
+    result["stages"] = {stage: statistics.median(run["stages"][stage] for run in runs) for stage in STAGES}
+    result["total"] = sum(result["stages"].values())
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def run_benchmarks(pdf_paths: Sequence[Path], recordings_dir: Path = BENCHMARK_RECORDINGS, repeat: int = 3,
+                   max_concurrency: int = 4, record_backend: Optional[str] = None,
+                   api_key: Optional[str] = None, base_url: Optional[str] = None) -> dict:
+    results = {"environment": environment(), "repeat": repeat, "pdfs": {}}
+    for pdf_path in pdf_paths:
+        # spawn, so nothing from this process (or the previous PDF) counts towards the peak RSS
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            results["pdfs"][Path(pdf_path).name] = executor.submit(
+                benchmark_pdf, Path(pdf_path), Path(recordings_dir), repeat, max_concurrency, record_backend, api_key, base_url).result()
+    return results
+
+
+def wire_format_benchmark(pdf_paths: Sequence[Path], live: bool = False, api_key: Optional[str] = None,
+                          base_url: Optional[str] = None) -> List[dict]:
+    """Completion tokens per batch for full ElectionData JSON vs the compact wire format.
+    Offline, the answers are the rule parser's (identical to the model's on the layouts it handles) encoded both ways;
+    with live, every batch is sent to the structured and compact backends and the real usage and latency are reported."""
+    rows = []
+    backends = [get_backend("structured", api_key, base_url), get_backend("compact", api_key, base_url)] if live else []
+    for pdf_path in pdf_paths:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            page_texts = extract_page_texts(pdf_path)
+            parsed_pages, _ = parse_pages(page_texts)
+        page_nums = list(range(len(page_texts))) if live else sorted(parsed_pages)
+        if not page_nums:
+            print(f"{Path(pdf_path).name}: the rule parser can't read this layout, only --live can measure it")
+        for batch_num, pages in enumerate(pack_pages(page_nums, page_texts)):
+            row = {"pdf": Path(pdf_path).name, "batch_num": batch_num, "pages": f"{pages[0] + 1}-{pages[-1] + 1}"}
+            if live:
+                prompt = extraction_prompt("".join(page_texts[page_num] for page_num in pages))
+                for backend in backends:
+                    start = time.perf_counter()
+                    response = backend.extract(SYSTEM_PROMPT, prompt, DEFAULT_MAX_OUTPUT_TOKENS)
+                    row[f"{backend.wire_format}_tokens"] = response.completion_tokens
+                    row[f"{backend.wire_format}_latency"] = time.perf_counter() - start
+            else:
+                store = ElectionStore()
+                for page_num in pages:
+                    store.merge(parsed_pages[page_num].model_copy(deep=True))
+                data = store.to_election_data()
+                # structured outputs come back as compact JSON, which is what model_dump_json writes
+                row["full_tokens"] = count_tokens(data.model_dump_json())
+                row["compact_tokens"] = count_tokens(encode(data).model_dump_json())
+            rows.append(row)
+    return rows
+
+
+def print_wire_format(rows: List[dict]):
+    live = any("full_latency" in row for row in rows)
+    print(f"{'pdf':<45}{'batch':>6}{'pages':>8}{'full':>8}{'compact':>9}{'saved':>8}" + (f"{'full s':>9}{'compact s':>10}" if live else ""))
+    for row in rows:
+        saved = 1 - row["compact_tokens"] / row["full_tokens"] if row["full_tokens"] else 0.0
+        print(f"{row['pdf'][:44]:<45}{row['batch_num']:>6}{row['pages']:>8}{row['full_tokens']:>8}{row['compact_tokens']:>9}{saved:>8.1%}"
+              + (f"{row['full_latency']:>9.2f}{row['compact_latency']:>10.2f}" if live else ""))
+    full = sum(row["full_tokens"] for row in rows)
+    compact = sum(row["compact_tokens"] for row in rows)
+    if full:
+        print(f"total completion tokens: {full} full, {compact} compact ({1 - compact / full:.1%} fewer)")
+
+
+def latency_percentile(latencies: Sequence[float], percentile: float) -> float:
+    latencies = sorted(latencies)
+    return latencies[int(percentile * (len(latencies) - 1))] if latencies else 0.0
+
+
+def hedging_benchmark(pdf_paths: Sequence[Path], api_key: str, base_url: Optional[str] = None,
+                      max_concurrency: int = 4, rounds: int = 3) -> List[dict]:
+    """Batch latency of every PDF's batches, extracted rounds times live, without and with HedgedBackend.
+    To see what hedging does to the tail without the API, point OPENAI_BASE_URL at openai_stub with a slow share,
+    e.g. `python openai_stub.py --slow-share 0.1 --slow-delay 5` (tests/test_hedging.py does the same)"""
+    rows = []
+    for pdf_path in pdf_paths:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            page_texts = extract_page_texts(pdf_path)
+        batches = pack_pages(list(range(len(page_texts))), page_texts) * rounds
+        for hedged in (False, True):
+            backend = get_backend("structured", api_key, base_url)
+            if hedged:
+                backend = HedgedBackend(backend)
+            metrics = ExtractionMetrics()
+            start = time.perf_counter()
+            with backend, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                # no cache, so every round calls the model
+                extract_batches_concurrently(batches, page_texts, api_key, max_concurrency, base_url, None,
+                                             DEFAULT_MAX_OUTPUT_TOKENS, backend=backend, metrics=metrics)
+            total = time.perf_counter() - start
+            latencies = [span["latency"] for span in metrics.batches]
+            # after close, so the requests that lost are in the token counts
+            usage = backend.usage()
+            rows.append({"pdf": Path(pdf_path).name, "hedged": hedged, "batches": len(latencies),
+                         "total": total, "p50": latency_percentile(latencies, 0.5),
+                         "p95": latency_percentile(latencies, 0.95), "max": max(latencies, default=0.0),
+                         "extra_requests": usage.get("hedges", 0), "hedge_wins": usage.get("hedge_wins", 0),
+                         "tokens": usage["prompt_tokens"] + usage["completion_tokens"],
+                         "extra_tokens": usage.get("extra_prompt_tokens", 0) + usage.get("extra_completion_tokens", 0)})
+    return rows
+
+
+def print_hedging(rows: List[dict]):
+    print(f"{'pdf':<45}{'hedged':>7}{'batches':>8}{'p50 s':>8}{'p95 s':>8}{'max s':>8}{'total s':>9}{'extra':>7}{'won':>5}"
+          f"{'tokens':>9}{'extra tok':>10}")
+    for row in rows:
+        print(f"{row['pdf'][:44]:<45}{'yes' if row['hedged'] else 'no':>7}{row['batches']:>8}{row['p50']:>8.2f}{row['p95']:>8.2f}"
+              f"{row['max']:>8.2f}{row['total']:>9.2f}{row['extra_requests']:>7}{row['hedge_wins']:>5}"
+              f"{row['tokens']:>9}{row['extra_tokens']:>10}")
+
+
+def print_results(results: dict):
+    header = f"{'pdf':<45}" + "".join(f"{stage:>14}" for stage in STAGES) + f"{'total':>10}{'rss MB':>9}{'prompt':>9}{'compl':>8}"
+    print(header)
+    for name, result in results["pdfs"].items():
+        print(f"{name[:44]:<45}" + "".join(f"{result['stages'][stage] * 1000:>12.1f}ms" for stage in STAGES)
+              + f"{result['total']:>9.2f}s{result['peak_rss_mb']:>9.1f}{result['prompt_tokens']:>9}{result['completion_tokens']:>8}")
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.10) -> List[str]:
+    "Prints the change against a baseline run and returns a description of every regression"
+    regressions = []
+    for name, result in results["pdfs"].items():
+        base = baseline["pdfs"].get(name)
+        if base is None:
+            print(f"{name}: not in the baseline")
+            continue
+        metrics = [(stage, base["stages"][stage], result["stages"][stage]) for stage in STAGES
+                   if stage in base["stages"]]
+        metrics += [("total", base["total"], result["total"]), ("peak_rss_mb", base["peak_rss_mb"], result["peak_rss_mb"])]
+        for metric, before, after in metrics:
+            change = (after - before) / before if before else 0.0
+            print(f"{name[:44]:<45}{metric:>14}{before:>12.4f}{after:>12.4f}{change:>+9.1%}")
+            noise = metric != "peak_rss_mb" and after - before < MIN_REGRESSION_SECONDS
+            if change > threshold and not noise:
+                regressions.append(f"{name} {metric}: {before:.4f} -> {after:.4f} ({change:+.1%})")
+        # replayed answers are fixed, so any change in tokens means the prompts or batching changed
+        for metric in ("prompt_tokens", "completion_tokens", "batches"):
+            if result[metric] != base[metric]:
+                regressions.append(f"{name} {metric}: {base[metric]} -> {result[metric]}")
+    return regressions
+
+
+if __name__ == "__main__":
+
+    import argparse
+    from dotenv import load_dotenv
+    load_dotenv() # make sure our environment variables are loaded
+
+    parser = argparse.ArgumentParser(description="Benchmark the extraction pipeline on the bundled PDFs with replayed model answers")
+    parser.add_argument("pdfs", nargs="*", type=Path, default=[Path(pdf) for pdf in BENCHMARK_PDFS])
+    parser.add_argument("--recordings", type=Path, default=BENCHMARK_RECORDINGS)
+    parser.add_argument("--record", action="store_true", help="call the real model once per PDF and record its answers")
+    parser.add_argument("--record-offline", action="store_true",
+                        help="record offline answers instead, no API key or network needed")
+    parser.add_argument("--backend", choices=list(BACKENDS), default="structured", help="backend to record with")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per PDF, the median time of each stage is reported")
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--output", type=Path, help="save the results as JSON")
+    parser.add_argument("--baseline", type=Path, help="compare against results saved with --output")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown that counts as a regression (0.10 = 10%%)")
+    parser.add_argument("--wire-format", action="store_true", help="compare completion tokens of full and compact answers")
+    parser.add_argument("--live", action="store_true", help="with --wire-format, call the model with both formats")
+    parser.add_argument("--hedging", action="store_true", help="compare batch latency with and without hedged requests (live)")
+    args = parser.parse_args()
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if args.hedging:
+        if not api_key:
+            raise ValueError("API key not found")
+        print_hedging(hedging_benchmark(args.pdfs, api_key, os.getenv("OPENAI_BASE_URL"), args.max_concurrency, args.repeat))
+        sys.exit(0)
+    if args.wire_format:
+        if args.live and not api_key:
+            raise ValueError("API key not found")
+        print_wire_format(wire_format_benchmark(args.pdfs, args.live, api_key, os.getenv("OPENAI_BASE_URL")))
+        sys.exit(0)
+    if args.record and not api_key:
+        raise ValueError("API key not found")
+    if args.record_offline or (not args.record and not args.recordings.exists()):
+        print(f"Recorded {record_offline(args.pdfs, args.recordings)} offline answers in {args.recordings}")
+    try:
+        results = run_benchmarks(args.pdfs, args.recordings, args.repeat, args.max_concurrency,
+                                 args.backend if args.record else None, api_key, os.getenv("OPENAI_BASE_URL"))
+    except MissingRecordingError as e:
+        # the prompts are part of the recording key, so changing the prompt or the batching needs a fresh recording
+        sys.exit(f"{e.args[0]} - run with --record or --record-offline first")
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print("\nREGRESSIONS:\n" + "\n".join(regressions))
+            sys.exit(1)
+        print("\nno regressions")
@@ -0,0 +1,344 @@
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+from extraction_models import ElectionData
+from extraction_backends import DEFAULT_MODEL, get_client
+from extraction_cache import ExtractionCache, cache_key
+from extraction_metrics import estimate_cost
+from election_store import ElectionStore
+from prompt_compaction import compact_pages
+from rule_parser import parse_pages
+from token_budget import DEFAULT_MAX_INPUT_TOKENS, DEFAULT_MAX_OUTPUT_TOKENS, count_tokens, pack_pages
+from page_classifier import PAGE_OVERRIDES, filter_result_pages, load_page_overrides
+from vote_validation import validate_election_data
+from batch_runner import DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE, find_pdfs, output_dirs, write_rollup
+import rate_limiter
+from results_db import ResultsDatabase, ReportIdentity, identify_report
+from scrape_election_pdf_structured import SYSTEM_PROMPT, extraction_prompt, get_page_texts, report_skipped_pages
+
+
+# backfilling past elections, where nobody waits for the results but every token is paid for: instead of calling
+# the model batch by batch, every batch of every PDF goes into a JSONL file for OpenAI's Batch API
+# (answered within 24h, at half the price, and outside the per-minute rate limits), and the answers are merged later.
+#   python bulk_extraction.py prepare past_elections/         # -> batch_requests.jsonl + batch_requests.manifest.json
+#   upload the requests file with purpose "batch", create a batch for /v1/chat/completions, download its output file
+#   python bulk_extraction.py ingest batch_output.jsonl       # -> results/<pdf>/election_data.json + results/rollup.json
+#   python bulk_extraction.py run-local batch_requests.jsonl batch_output.jsonl   # answer the file against OPENAI_BASE_URL
+# run-local is the same round trip without the Batch API, e.g. against openai_stub to try it offline
+# (tests/test_bulk_extraction.py runs prepare -> run-local -> ingest that way).
+# The batches are the ones a live run makes (rule parser, compacted prompts, token budget packing), each request the
+# same one the structured backend sends, with a custom_id of "<pdf>:<first page>-<last page>". Pages the rule parser
+# reads, and batches already in the extraction cache, are never sent - their results go into the manifest.
+# Neither are pages without results (see page_classifier).
+# Ingesting puts every answer in the extraction cache, so a live run of a PDF with failed or truncated batches
+# only pays for those.
+
+BULK_REQUESTS = Path("batch_requests.jsonl")
+BULK_ENDPOINT = "/v1/chat/completions"
+# the Batch API's limits per input file
+MAX_REQUESTS_PER_FILE = 50000
+MAX_BYTES_PER_FILE = 190 * 1024 * 1024  # 200 MB, with room to spare
+BATCH_DISCOUNT = 0.5  # batch requests cost half the regular price
+TEMPERATURE = 0.2  # as StructuredOutputBackend
+
+
+def custom_id(pdf_key: str, pages: Sequence[int]) -> str:
+    return f"{pdf_key}:{pages[0] + 1}-{pages[-1] + 1}"
+
+
+def manifest_path(requests_path: Path) -> Path:
+    return requests_path.with_suffix(".manifest.json")
+
+
+# structured outputs in strict mode only take closed objects whose fields are all required - optional fields
+# stay nullable through their anyOf, and their null defaults are dropped
+def strict_schema(schema):
+    if isinstance(schema, list):
+        return [strict_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    schema = {key: strict_schema(value) for key, value in schema.items() if not (key == "default" and value is None)}
+    if schema.get("type") == "object" and "properties" in schema:
+        schema["additionalProperties"] = False
+        schema["required"] = list(schema["properties"])
+    return schema
+
+
+def response_format(model_class: Type[BaseModel]) -> dict:
+    return {"type": "json_schema",
+            "json_schema": {"name": model_class.__name__, "schema": strict_schema(model_class.model_json_schema()),
+                            "strict": True}}
+
+
+def request_line(request_id: str, prompt: str, model: str = DEFAULT_MODEL,
+                 max_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS) -> dict:
+    # the body parse() would send for response_format=ElectionData, so the answers are the structured backend's
+    return {"custom_id": request_id, "method": "POST", "url": BULK_ENDPOINT,
+            "body": {"model": model,
+                     "messages": [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+                     "max_tokens": max_tokens, "temperature": TEMPERATURE,
+                     "response_format": response_format(ElectionData)}}
+
+
+def write_request_files(lines: Iterable[str], requests_path: Path) -> List[Path]:
+    "Writes the request lines, starting a new file (batch_requests.2.jsonl, ...) whenever one would go over the limits"
+    paths, f, count, size = [], None, 0, 0
+    try:
+        for line in lines:
+            data = (line + "\n").encode("utf-8")
+            if f is None or count == MAX_REQUESTS_PER_FILE or size + len(data) > MAX_BYTES_PER_FILE:
+                if f is not None:
+                    f.close()
+                path = requests_path if not paths else requests_path.with_suffix(f".{len(paths) + 1}.jsonl")
+                paths.append(path)
+                f, count, size = open(path, "wb"), 0, 0
+            f.write(data)
+            count += 1
+            size += len(data)
+    finally:
+        if f is not None:
+            f.close()
+    return paths
+
+
+def prepare(inputs: Sequence[str], requests_path: Path = BULK_REQUESTS, model: str = DEFAULT_MODEL,
+            cache: Optional[ExtractionCache] = None, use_rule_parser: bool = True, compact_prompts: bool = True,
+            skip_non_result_pages: bool = True, page_overrides_path: Optional[Path] = PAGE_OVERRIDES,
+            max_input_tokens: int = DEFAULT_MAX_INPUT_TOKENS, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS) -> List[Path]:
+    "Writes the batch request file(s) for every PDF in inputs, and the manifest ingest() needs; returns the request files"
+    pdfs = find_pdfs(inputs)
+    if not pdfs:
+        raise ValueError(f"no PDFs found in {', '.join(inputs)}")
+    # the same names the PDFs' results directories get
+    pdf_keys = {pdf: directory.name for pdf, directory in output_dirs(pdfs, Path()).items()}
+    manifest = {"model": model, "pdfs": {}}
+
+    def pdf_requests() -> Iterator[str]:
+        for pdf in pdfs:
+            page_texts = get_page_texts(pdf)
+            if use_rule_parser:
+                parsed_pages, llm_pages = parse_pages(page_texts)
+            else:
+                parsed_pages, llm_pages = {}, list(range(len(page_texts)))
+            skipped_pages = {}
+            if skip_non_result_pages:
+                llm_pages, skipped_pages = filter_result_pages(llm_pages, page_texts,
+                                                               load_page_overrides(pdf, page_overrides_path))
+                report_skipped_pages(skipped_pages, sum(count_tokens(page_texts[page_num]) for page_num in skipped_pages))
+            llm_texts = compact_pages(page_texts) if compact_prompts else page_texts
+            entry = {"path": str(pdf), "pages": len(page_texts), "batches": {},
+                     "report": identify_report(pdf, page_texts[0] if page_texts else "").model_dump(),
+                     "skipped": {page_num + 1: reason for page_num, reason in skipped_pages.items()},
+                     "done": [{"pages": [page_num], "data": result.model_dump()} for page_num, result in parsed_pages.items()]}
+            manifest["pdfs"][pdf_keys[pdf]] = entry
+            for pages in pack_pages(llm_pages, llm_texts, max_input_tokens, max_output_tokens):
+                text = "".join(llm_texts[page_num] for page_num in pages)
+                prompt = extraction_prompt(text)
+                # the key extract_election_data uses, so bulk answers and live runs share the cache
+                key = cache_key(text, model, SYSTEM_PROMPT + prompt)
+                cached = cache.get(key) if cache is not None else None
+                if cached is not None:
+                    entry["done"].append({"pages": pages, "data": cached.model_dump()})
+                    continue
+                request_id = custom_id(pdf_keys[pdf], pages)
+                entry["batches"][request_id] = {"pages": pages, "cache_key": key}
+                yield json.dumps(request_line(request_id, prompt, model, max_output_tokens))
+            print(f"{pdf.name}: {len(entry['batches'])} batch requests, {len(parsed_pages)} pages parsed locally, "
+                  f"{len(entry['done']) - len(parsed_pages)} batches from the cache")
+
+    paths = write_request_files(pdf_requests(), requests_path)
+    manifest["request_files"] = [str(path) for path in paths]
+    with open(manifest_path(requests_path), "w") as f:
+        json.dump(manifest, f)
+    requests = sum(len(entry["batches"]) for entry in manifest["pdfs"].values())
+    print(f"{requests} requests for {len(pdfs)} PDFs in {', '.join(str(path) for path in paths) or 'no files'}")
+    return paths
+
+
+def parse_result(record: dict) -> Tuple[Optional[ElectionData], Optional[str]]:
+    "(the answer, None) for a good line of a Batch API output file, (None, what went wrong) for any other"
+    if record.get("error"):
+        return None, f"error: {record['error'].get('message') or record['error'].get('code')}"
+    response = record.get("response") or {}
+    if response.get("status_code") != 200:
+        return None, f"HTTP {response.get('status_code')}"
+    choice = response["body"]["choices"][0]
+    if choice.get("finish_reason") == "length":
+        return None, "truncated"
+    message = choice.get("message") or {}
+    if message.get("refusal"):
+        return None, "refused"
+    if not message.get("content"):
+        return None, "no answer"
+    try:
+        return ElectionData.model_validate_json(message["content"]), None
+    except ValidationError:
+        return None, "invalid answer"
+
+
+def read_results(results_paths: Sequence[Path]) -> Iterator[Tuple[str, Optional[ElectionData], Optional[str], dict]]:
+    "(custom_id, answer, problem, usage) for every line of the output files"
+    for path in results_paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                data, problem = parse_result(record)
+                body = (record.get("response") or {}).get("body") or {}
+                yield record["custom_id"], data, problem, body.get("usage") or {}
+
+
+def ingest(results_paths: Sequence[Path], requests_path: Path = BULK_REQUESTS, output_dir: Path = Path("results"),
+           cache: Optional[ExtractionCache] = None, results_db_path: Optional[Path] = None) -> ElectionData:
+    """Merges the answers in Batch API output file(s) with the manifest's locally parsed pages, per PDF, in page order.
+    Writes <output_dir>/<pdf>/election_data.json for every PDF and the roll-up of the complete ones,
+    and with results_db_path stores the complete ones in the results database, in one transaction"""
+    with open(manifest_path(requests_path)) as f:
+        manifest = json.load(f)
+    batch_pdfs = {request_id: pdf_key for pdf_key, entry in manifest["pdfs"].items() for request_id in entry["batches"]}
+
+    answers: Dict[str, ElectionData] = {}
+    problems: Dict[str, str] = {}
+    prompt_tokens = completion_tokens = 0
+    for request_id, data, problem, usage in read_results(results_paths):
+        prompt_tokens += usage.get("prompt_tokens") or 0
+        completion_tokens += usage.get("completion_tokens") or 0
+        pdf_key = batch_pdfs.get(request_id)
+        if pdf_key is None:
+            print(f"bulk: {request_id} is not in {manifest_path(requests_path)}, skipping it")
+            continue
+        if problem is not None:
+            problems[request_id] = problem
+            continue
+        answers[request_id] = data
+        problems.pop(request_id, None)
+        if cache is not None:
+            cache.put(manifest["pdfs"][pdf_key]["batches"][request_id]["cache_key"], data)
+
+    complete = []
+    for pdf_key, entry in manifest["pdfs"].items():
+        results = [(done["pages"], ElectionData.model_validate(done["data"])) for done in entry["done"]]
+        results += [(batch["pages"], answers[request_id]) for request_id, batch in entry["batches"].items()
+                    if request_id in answers]
+        # batches come back in any order, but contests continue across pages, so merge in page order
+        store = ElectionStore()
+        for pages, result in sorted(results, key=lambda result: result[0][0]):
+            store.merge(result.model_copy(deep=True))
+        data = store.to_election_data()
+        pdf_output_dir = Path(output_dir) / pdf_key
+        pdf_output_dir.mkdir(parents=True, exist_ok=True)
+        with open(pdf_output_dir / "election_data.json", "w") as f:
+            f.write(data.model_dump_json())
+
+        missing = [request_id for request_id in entry["batches"] if request_id not in answers]
+        print(f"{pdf_key}: {len(data.contests)} contests, vote arithmetic: {validate_election_data(data).describe()}")
+        if missing:
+            reasons = ", ".join(f"{request_id} ({problems.get(request_id, 'no result')})" for request_id in missing)
+            print(f"{pdf_key}: INCOMPLETE, {len(missing)} of {len(entry['batches'])} batches have no answer: {reasons}")
+            if cache is not None:
+                print(f"  the other batches are in the extraction cache, so a live run only extracts these: "
+                      f"python scrape_election_pdf_structured.py \"{entry['path']}\"")
+        else:
+            complete.append((ReportIdentity.model_validate(entry["report"]), data, entry["path"]))
+
+    cost = estimate_cost(manifest["model"], prompt_tokens, completion_tokens)
+    print(f"bulk: {len(answers)} answers, {len(problems)} failed, {prompt_tokens} prompt + {completion_tokens} completion tokens"
+          + (f", about ${cost * BATCH_DISCOUNT:.2f} at batch prices" if cost is not None else ""))
+    if results_db_path is not None and complete:
+        with ResultsDatabase(results_db_path) as db:
+            db.upsert_many(complete)
+        print(f"stored {len(complete)} reports in {results_db_path}")
+    rollup_data = write_rollup([data for _, data, _ in complete], Path(output_dir))
+    print(f"{len(complete)}/{len(manifest['pdfs'])} PDFs complete, roll-up has {len(rollup_data.contests)} contests")
+    return rollup_data
+
+
+def run_local(requests_paths: Sequence[Path], results_path: Path, api_key: str, base_url: Optional[str] = None,
+              max_concurrency: int = 4, requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE,
+              tokens_per_minute: int = DEFAULT_TOKENS_PER_MINUTE):
+    """Answers request files against an OpenAI compatible endpoint, max_concurrency requests at a time within the
+    RPM/TPM budget, writing a Batch API output file with the answers in request order"""
+    client = get_client(api_key, base_url)
+    limiter = rate_limiter.RateLimiter(requests_per_minute, tokens_per_minute)
+
+    def answer(line: str) -> dict:
+        request = json.loads(line)
+        body = request["body"]
+        # what a live request is charged against the budget: the whole prompt and all the output it may use
+        limiter.acquire(count_tokens("".join(message["content"] for message in body["messages"]))
+                        + (body.get("max_tokens") or 0))
+        record = {"id": f"local_{request['custom_id']}", "custom_id": request["custom_id"], "response": None, "error": None}
+        try:
+            completion = client.chat.completions.create(**body)
+        except Exception as err:
+            status_code = getattr(err, "status_code", None)
+            if status_code is None:
+                record["error"] = {"code": type(err).__name__, "message": str(err)}
+            else:
+                record["response"] = {"status_code": status_code, "body": {"error": {"message": str(err)}}}
+            return record
+        record["response"] = {"status_code": 200, "body": completion.model_dump()}
+        return record
+
+    def lines() -> Iterator[str]:
+        for path in requests_paths:
+            with open(path, encoding="utf-8") as f:
+                yield from (line for line in f if line.strip())
+
+    # a request file can hold 50,000 requests, so they are read as the answers are written, never more than
+    # 2 * max_concurrency ahead (executor.map would submit - and hold - all of them up front)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor, open(results_path, "w", encoding="utf-8") as f:
+        for line in lines():
+            pending.append(executor.submit(answer, line))
+            while pending and (pending[0].done() or len(pending) >= 2 * max(1, max_concurrency)):
+                f.write(json.dumps(pending.popleft().result()) + "\n")
+        while pending:
+            f.write(json.dumps(pending.popleft().result()) + "\n")
+
+
+if __name__ == "__main__":
+
+    import argparse
+    from dotenv import load_dotenv
+    load_dotenv() # make sure our environment variables are loaded
+
+    parser = argparse.ArgumentParser(description="Extract many PDFs through the Batch API: prepare request files, then ingest the answers")
+    commands = parser.add_subparsers(dest="command", required=True)
+    prepare_parser = commands.add_parser("prepare", help="write the batch request file(s) for the PDFs")
+    prepare_parser.add_argument("inputs", nargs="+", help="PDF files, directories of PDFs, or glob patterns")
+    prepare_parser.add_argument("--requests", type=Path, default=BULK_REQUESTS)
+    prepare_parser.add_argument("--model", default=DEFAULT_MODEL)
+    ingest_parser = commands.add_parser("ingest", help="merge the answers in Batch API output file(s)")
+    ingest_parser.add_argument("results", nargs="+", type=Path)
+    ingest_parser.add_argument("--requests", type=Path, default=BULK_REQUESTS, help="the request file the answers are for")
+    ingest_parser.add_argument("--output-dir", type=Path, default=Path("results"))
+    ingest_parser.add_argument("--db", type=Path, default=None, metavar="PATH",
+                               help="also store the complete PDFs in this results database (see results_db)")
+    local_parser = commands.add_parser("run-local", help="answer request files against OPENAI_BASE_URL, MAX_CONCURRENCY at a time")
+    local_parser.add_argument("requests", nargs="+", type=Path)
+    local_parser.add_argument("output", type=Path)
+    local_parser.add_argument("--rpm", type=int, default=int(os.getenv("OPENAI_RPM", DEFAULT_REQUESTS_PER_MINUTE)),
+                              help="requests per minute")
+    local_parser.add_argument("--tpm", type=int, default=int(os.getenv("OPENAI_TPM", DEFAULT_TOKENS_PER_MINUTE)),
+                              help="tokens per minute")
+    args = parser.parse_args()
+
+    cache = ExtractionCache()
+    if args.command == "prepare":
+        prepare(args.inputs, args.requests, args.model, cache)
+    elif args.command == "ingest":
+        ingest(args.results, args.requests, args.output_dir, cache, args.db)
+    else:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("API key not found")
+        run_local(args.requests, args.output, api_key, os.getenv("OPENAI_BASE_URL"),
+                  int(os.getenv("MAX_CONCURRENCY", "4")), args.rpm, args.tpm)
@@ -0,0 +1,108 @@
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+from extraction_models import Summary, ElectionData
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:  # optional - only needed when exporting
+    pa = None
+
+
+# column-oriented export of ElectionData: one pass over the contests builds plain column lists,
+# which become Arrow arrays in one go - no per-row DataFrame appends, no per-row printing,
+# and no re-validating records that pydantic already validated when the model answered.
+# The repeated strings (contest name, party, choice name) are dictionary encoded.
+
+CONTEST_COLUMNS = ["contest", "name", "party", "writein", "vote_in_center", "vote_by_mail", "vote_total"]
+SUMMARY_COLUMNS = list(Summary.model_fields)
+DICTIONARY_COLUMNS = {"contest", "name", "party"}
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("columnar export needs pyarrow: pip install pyarrow")
+
+
+def election_columns(data: ElectionData) -> Tuple[Dict[str, list], Dict[str, list]]:
+    contest_columns: Dict[str, list] = {column: [] for column in CONTEST_COLUMNS}
+    for contest in data.contests:
+        for choice in contest.choices:
+            contest_columns["contest"].append(contest.name)
+            contest_columns["name"].append(choice.name)
+            contest_columns["party"].append(choice.party)
+            contest_columns["writein"].append(choice.writein)
+            contest_columns["vote_in_center"].append(choice.vote_in_center)
+            contest_columns["vote_by_mail"].append(choice.vote_by_mail)
+            contest_columns["vote_total"].append(choice.vote_total)
+
+    summary_columns: Dict[str, list] = {column: [getattr(summary, column) for summary in data.summary]
+                                        for column in SUMMARY_COLUMNS}
+    return contest_columns, summary_columns
+
+
+def _to_table(columns: Dict[str, list]) -> "pa.Table":
+    arrays = []
+    for column, values in columns.items():
+        array = pa.array(values, type=pa.string() if column in DICTIONARY_COLUMNS else None)
+        arrays.append(array.dictionary_encode() if column in DICTIONARY_COLUMNS else array)
+    return pa.Table.from_arrays(arrays, names=list(columns))
+
+
+def election_tables(data: ElectionData) -> Tuple["pa.Table", "pa.Table"]:
+    _require_pyarrow()
+    contest_columns, summary_columns = election_columns(data)
+    return _to_table(contest_columns), _to_table(summary_columns)
+
+
+def _decode_dictionaries(table: "pa.Table") -> "pa.Table":
+    # CSV has no notion of dictionary columns
+    return pa.Table.from_arrays(
+        [column.cast(column.type.value_type) if pa.types.is_dictionary(column.type) else column for column in table.columns],
+        names=table.column_names)
+
+
+def write_table(table: "pa.Table", path: Path):
+    suffix = path.suffix
+    if suffix == ".parquet":
+        pq.write_table(table, path)
+    elif suffix == ".arrow":
+        with pa_ipc.new_file(path, table.schema) as writer:
+            writer.write_table(table)
+    elif suffix == ".csv":
+        pa_csv.write_csv(_decode_dictionaries(table), path)
+    else:
+        raise ValueError(f"unsupported export format: {path}")
+
+
+def save_results(data: ElectionData, output_dir: Path = Path("."), formats: Sequence[str] = ("parquet",)) -> List[Path]:
+    "Writes contests.<ext> and summaries.<ext> for each format in parquet/arrow/csv"
+    contests_table, summaries_table = election_tables(data)
+    written = []
+    for fmt in formats:
+        if fmt not in FORMATS:
+            raise ValueError(f"unsupported export format: {fmt} (expected one of {', '.join(FORMATS)})")
+        for stem, table in (("contests", contests_table), ("summaries", summaries_table)):
+            path = Path(output_dir) / f"{stem}{FORMATS[fmt]}"
+            write_table(table, path)
+            written.append(path)
+    print(f"Saved {contests_table.num_rows} choices and {summaries_table.num_rows} summaries to {', '.join(map(str, written))}")
+    return written
+
+
+def load_results(path: Path) -> "pa.Table":
+    "Memory-maps an exported table back in; call .to_pandas() on the result for a DataFrame"
+    _require_pyarrow()
+    path = Path(path)
+    if path.suffix == ".parquet":
+        return pq.read_table(path, memory_map=True)
+    if path.suffix == ".arrow":
+        # Arrow IPC files are read zero-copy straight out of the mapped file
+        return pa_ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+    if path.suffix == ".csv":
+        return pa_csv.read_csv(path)
+    raise ValueError(f"unsupported export format: {path}")
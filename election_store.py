@@ -0,0 +1,196 @@
+import re
+import threading
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from extraction_models import Choice, Contest, Summary, ElectionData
+from rule_parser import KNOWN_PARTIES
+
+
+# hash-map index over contests, choices and summaries, so merging a batch costs O(batch size)
+# instead of rebuilding a name -> object dict from the whole master list every time.
+# Names are matched on a normalized key, so "U.S. REPRESENTATIVE DISTRICT 2 - Non-Partisan" and
+# "US Representative District 2" are the same contest, and "Chase Oliver (W)" and "Chase Oliver" the same choice.
+
+class DuplicatePolicy(str, Enum):
+    KEEP = "keep"        # keep the first one we saw and report the duplicate
+    SUM = "sum"          # add the vote counts together
+    REPLACE = "replace"  # the newest one wins
+    REJECT = "reject"    # raise DuplicateEntryError
+
+
+class DuplicateEntryError(ValueError):
+    "Raised by the REJECT policy when a choice or summary is merged in twice"
+
+
+WRITE_IN_MARKER = re.compile(r"\(\s*w\s*\)", re.IGNORECASE)
+# "- Non-Partisan" says nothing about which contest it is, unlike "- Democratic" in a primary, so only that suffix is dropped
+NON_PARTISAN_SUFFIX = re.compile(r"\s*-\s*non-?\s*partisan\s*$", re.IGNORECASE)
+# "U.S." and "US" should match, so periods and apostrophes are dropped while other punctuation separates words
+DROPPED_PUNCTUATION = re.compile(r"[.'’]")
+PUNCTUATION = re.compile(r"[^\w]+")
+
+CHOICE_VOTE_FIELDS = ["vote_in_center", "vote_by_mail", "vote_total"]
+SUMMARY_VOTE_FIELDS = [name for name in Summary.model_fields if name != "contest"]
+
+
+def _key(text: str) -> str:
+    return PUNCTUATION.sub(" ", DROPPED_PUNCTUATION.sub("", text)).strip().lower()
+
+
+def normalize_contest_name(name: str) -> str:
+    return _key(NON_PARTISAN_SUFFIX.sub("", WRITE_IN_MARKER.sub("", name)))
+
+
+def normalize_choice_name(name: str) -> str:
+    words = WRITE_IN_MARKER.sub("", name).split()
+    # the model sometimes leaves the party column glued onto the name
+    if len(words) > 1 and words[-1] in KNOWN_PARTIES:
+        words = words[:-1]
+    return _key(" ".join(words))
+
+
+class ElectionStore:
+    "Indexes contests/choices/summaries by normalized name; the lists passed in are updated in place"
+
+    def __init__(self, contests: Optional[List[Contest]] = None, summaries: Optional[List[Summary]] = None,
+                 choice_policy: DuplicatePolicy = DuplicatePolicy.KEEP,
+                 summary_policy: DuplicatePolicy = DuplicatePolicy.SUM):
+        self.contests: List[Contest] = contests if contests is not None else []
+        self.summaries: List[Summary] = summaries if summaries is not None else []
+        self.choice_policy = DuplicatePolicy(choice_policy)
+        self.summary_policy = DuplicatePolicy(summary_policy)
+
+        self._contests: Dict[str, int] = {}  # contest key -> position in self.contests
+        self._choices: Dict[str, Dict[str, int]] = {}  # contest key -> choice key -> position in contest.choices
+        self._summaries: Dict[str, int] = {}  # contest key -> position in self.summaries
+        for position, contest in enumerate(self.contests):
+            self._index_contest(contest, position)
+        for position, summary in enumerate(self.summaries):
+            self._summaries.setdefault(normalize_contest_name(summary.contest), position)
+
+    @classmethod
+    def from_election_data(cls, data: ElectionData, **policies) -> "ElectionStore":
+        return cls(data.contests, data.summary, **policies)
+
+    def _index_contest(self, contest: Contest, position: int):
+        key = normalize_contest_name(contest.name)
+        self._contests.setdefault(key, position)
+        choice_index = self._choices.setdefault(key, {})
+        for position, choice in enumerate(contest.choices):
+            choice_index.setdefault(normalize_choice_name(choice.name), position)
+
+    def merge(self, data: ElectionData) -> "ElectionStore":
+        self.merge_contests(data.contests)
+        self.merge_summaries(data.summary)
+        return self
+
+    # a contest split across two batches is normal, so contests always merge - the policy applies to their choices
+    def merge_contests(self, new_contests: List[Contest]):
+        for new_contest in new_contests:
+            key = normalize_contest_name(new_contest.name)
+            if key not in self._contests:
+                self.contests.append(new_contest)
+                self._index_contest(new_contest, len(self.contests) - 1)
+            else:
+                self.merge_choices(self.contests[self._contests[key]], new_contest.choices)
+
+    def merge_choices(self, master_contest: Contest, new_choices: List[Choice]):
+        choice_index = self._choices.setdefault(normalize_contest_name(master_contest.name), {})
+        for new_choice in new_choices:
+            key = normalize_choice_name(new_choice.name)
+            if key not in choice_index:
+                print(f"Merging in new choice: {new_choice.name} to Contest: {master_contest.name}")
+                choice_index[key] = len(master_contest.choices)
+                master_contest.choices.append(new_choice)
+                continue
+
+            position = choice_index[key]
+            if self.choice_policy == DuplicatePolicy.KEEP:
+                print(f"OOPS - duplicate choice name found in Contest:{master_contest.name} Choice: {new_choice.name}")
+            elif self.choice_policy == DuplicatePolicy.SUM:
+                master_choice = master_contest.choices[position]
+                for field in CHOICE_VOTE_FIELDS:
+                    setattr(master_choice, field, getattr(master_choice, field) + getattr(new_choice, field))
+            elif self.choice_policy == DuplicatePolicy.REPLACE:
+                master_contest.choices[position] = new_choice
+            else:
+                raise DuplicateEntryError(f"duplicate choice {new_choice.name!r} in contest {master_contest.name!r}")
+
+    def merge_summaries(self, new_summaries: List[Summary]):
+        for new_summary in new_summaries:
+            key = normalize_contest_name(new_summary.contest)
+            if key not in self._summaries:
+                self._summaries[key] = len(self.summaries)
+                self.summaries.append(new_summary)
+                continue
+
+            position = self._summaries[key]
+            if self.summary_policy == DuplicatePolicy.KEEP:
+                print("OOPS - duplicate summary found for contest:", new_summary.contest)
+            elif self.summary_policy == DuplicatePolicy.SUM:
+                master_summary = self.summaries[position]
+                for field in SUMMARY_VOTE_FIELDS:
+                    setattr(master_summary, field, getattr(master_summary, field) + getattr(new_summary, field))
+            elif self.summary_policy == DuplicatePolicy.REPLACE:
+                self.summaries[position] = new_summary
+            else:
+                raise DuplicateEntryError(f"duplicate summary for contest {new_summary.contest!r}")
+
+    # swap in whole contests and summaries (e.g. re-extracted ones), adding any we haven't seen
+    def patch(self, update: ElectionData) -> "ElectionStore":
+        for contest in update.contests:
+            key = normalize_contest_name(contest.name)
+            if key in self._contests:
+                position = self._contests.pop(key)
+                self.contests[position] = contest
+                self._choices.pop(key, None)
+            else:
+                print(f"Adding new contest: {contest.name}")
+                position = len(self.contests)
+                self.contests.append(contest)
+            self._index_contest(contest, position)
+
+        for summary in update.summary:
+            key = normalize_contest_name(summary.contest)
+            if key in self._summaries:
+                self.summaries[self._summaries[key]] = summary
+            else:
+                self._summaries[key] = len(self.summaries)
+                self.summaries.append(summary)
+        return self
+
+    def contest(self, name: str) -> Optional[Contest]:
+        position = self._contests.get(normalize_contest_name(name))
+        return self.contests[position] if position is not None else None
+
+    def summary(self, contest_name: str) -> Optional[Summary]:
+        position = self._summaries.get(normalize_contest_name(contest_name))
+        return self.summaries[position] if position is not None else None
+
+    def to_election_data(self) -> ElectionData:
+        return ElectionData(contests=self.contests, summary=self.summaries)
+
+
+# batches finish in any order, but contests split across pages have to be merged in page order.
+# Instead of waiting for the last batch, each batch is merged as soon as every batch before it has been,
+# so the merged results fill in while later batches are still with the model
+
+class PageOrderedMerge:
+    "Hands batch results to merge_batch in page order, each as soon as all the batches before it are in"
+
+    def __init__(self, batch_pages: Sequence[Sequence[int]],
+                 merge_batch: Callable[[List[int], Optional[ElectionData]], None]):
+        self.order = sorted(tuple(pages) for pages in batch_pages)
+        self.merge_batch = merge_batch
+        self.merged = 0
+        self._ready: Dict[Tuple[int, ...], Optional[ElectionData]] = {}
+        self._lock = threading.Lock()  # batches finish on several threads
+
+    def add(self, pages: Sequence[int], result: Optional[ElectionData]):
+        with self._lock:
+            self._ready[tuple(pages)] = result
+            while self.merged < len(self.order) and self.order[self.merged] in self._ready:
+                next_pages = self.order[self.merged]
+                self.merge_batch(list(next_pages), self._ready.pop(next_pages))
+                self.merged += 1
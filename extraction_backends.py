@@ -0,0 +1,629 @@
+import json
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from openai import OpenAI, LengthFinishReasonError
+from pydantic import BaseModel
+
+from extraction_models import ElectionData
+from streaming_parser import ItemScanner, StreamItem, election_items, parse_item
+from extraction_cache import cache_key
+from extraction_metrics import estimate_cost
+from token_budget import count_tokens
+import rate_limiter
+from vote_validation import check_batch
+from wire_format import CompactContest, CompactElectionData, decode as decode_compact
+
+try:
+    from llama_index.program.openai import OpenAIPydanticProgram
+    from llama_index.llms.openai import OpenAI as LlamaIndexOpenAI
+except ImportError:  # optional - only needed for the llamaindex backend
+    OpenAIPydanticProgram = None
+
+
+# one interface over the different ways the scripts ask the model for ElectionData:
+#   structured - beta.chat.completions.parse with response_format=ElectionData
+#   compact    - the same, but the model answers in the positional CompactElectionData format (see wire_format)
+#   json       - plain chat.completions.create, with the ```json fence stripped and the JSON validated
+#   llamaindex - llama_index's OpenAIPydanticProgram
+#   cascade    - a cheap model first, and a stronger one only for the batches whose answer fails check_batch
+#   HedgedBackend wraps any of them: a request that is slower than recent requests is sent a second time
+#   replay     - answers from recorded responses, no network, for offline throughput/latency measurements
+# Every backend returns ElectionData. OpenAI clients are created once per (api_key, base_url) and shared,
+# so all batches reuse the same keep-alive connection pool instead of opening a new one per request.
+# With on_item, each contest and summary is also handed over as soon as it is complete - the structured backends
+# stream the answer and parse it as it arrives, the others hand everything over once the answer is in.
+
+DEFAULT_MODEL = "gpt-4o-2024-08-06"
+CASCADE_MODELS = ("gpt-4o-mini", DEFAULT_MODEL)
+RECORDINGS_DIR = Path(".recordings")
+
+
+class TruncatedResponseError(Exception):
+    "The model ran out of output tokens before finishing the answer"
+
+    def __init__(self, message: str, response: Optional["BackendResponse"] = None):
+        super().__init__(message)
+        self.response = response  # the truncated response, for its token usage
+
+
+class MissingRecordingError(KeyError):
+    "The replay backend has no recorded response for this prompt"
+
+
+class BackendResponse(BaseModel):
+    data: Optional[ElectionData]
+    finish_reason: str = "stop"
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency: float = 0.0  # seconds the backend took to answer
+    model: Optional[str] = None  # the model that answered
+    cost_usd: Optional[float] = None  # estimated, None if the model's price isn't known
+
+
+_clients: Dict[Tuple[str, Optional[str]], OpenAI] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key: str, base_url: Optional[str] = None) -> OpenAI:
+    "The shared client for this key and endpoint - OpenAI clients are thread safe"
+    with _clients_lock:
+        client = _clients.get((api_key, base_url))
+        if client is None:
+            # retries are handled by extract_with_retry, so turn off the client's own retry loop
+            client = _clients[(api_key, base_url)] = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        return client
+
+
+class ExtractionBackend:
+    "Base class: subclasses implement _extract, callers use extract (which also keeps usage totals)"
+    name = "base"
+    wire_format = "full"  # what the model is asked to answer in, always decoded to ElectionData
+
+    def __init__(self, model: str = DEFAULT_MODEL):
+        self.model = model
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._usage_lock = threading.Lock()
+
+    def _extract(self, system_prompt: str, prompt: str, max_tokens: int) -> BackendResponse:
+        raise NotImplementedError
+
+    def _stream(self, system_prompt: str, prompt: str, max_tokens: int,
+                on_item: Callable[[StreamItem], None]) -> BackendResponse:
+        # backends that can't stream hand over the items once the whole answer is in
+        response = self._extract(system_prompt, prompt, max_tokens)
+        if response.finish_reason != "length":
+            for item in election_items(response.data):
+                on_item(item)
+        return response
+
+    def extract(self, system_prompt: str, prompt: str, max_tokens: int,
+                on_item: Optional[Callable[[StreamItem], None]] = None) -> BackendResponse:
+        "Raises TruncatedResponseError if the answer was cut off at max_tokens; on_item gets each contest/summary as it completes"
+        start = time.perf_counter()
+        if on_item is not None:
+            response = self._stream(system_prompt, prompt, max_tokens, on_item)
+        else:
+            response = self._extract(system_prompt, prompt, max_tokens)
+        if not response.latency:
+            response.latency = time.perf_counter() - start
+        if response.model is None:
+            response.model = self.model
+        if response.cost_usd is None:
+            response.cost_usd = estimate_cost(response.model, response.prompt_tokens, response.completion_tokens)
+        with self._usage_lock:
+            self.requests += 1
+            self.prompt_tokens += response.prompt_tokens
+            self.completion_tokens += response.completion_tokens
+        if response.finish_reason == "length":
+            raise TruncatedResponseError(f"{self.name} response truncated at max_tokens={max_tokens}", response)
+        return response
+
+    @property
+    def cache_id(self) -> str:
+        "The model as far as caches and recordings are concerned - the same model answering in another format is another answer"
+        return self.model if self.wire_format == "full" else f"{self.model}+{self.wire_format}"
+
+    def usage(self) -> dict:
+        return {"requests": self.requests, "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens}
+
+    def close(self):
+        "Releases what the backend holds - the shared clients stay open, so only wrappers with a thread pool have work to do"
+
+    def __enter__(self) -> "ExtractionBackend":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _usage(completion) -> Tuple[int, int]:
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        return 0, 0
+    return usage.prompt_tokens or 0, usage.completion_tokens or 0
+
+
+class StructuredOutputBackend(ExtractionBackend):
+    name = "structured"
+    response_format = ElectionData
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None, model: str = DEFAULT_MODEL, temperature: float = 0.2):
+        super().__init__(model)
+        self.client = get_client(api_key, base_url)
+        self.temperature = temperature
+
+    def _extract(self, system_prompt: str, prompt: str, max_tokens: int) -> BackendResponse:
+        try:
+            completion = self.client.beta.chat.completions.parse(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=max_tokens,
+                temperature=self.temperature,
+                response_format=self.response_format
+            )
+        except LengthFinishReasonError as err:
+            # parse() refuses to return a truncated answer, but it was still paid for
+            prompt_tokens, completion_tokens = _usage(err.completion)
+            return BackendResponse(data=None, finish_reason="length", prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        prompt_tokens, completion_tokens = _usage(completion)
+        parsed = completion.choices[0].message.parsed
+        return BackendResponse(data=self._decode(parsed) if parsed is not None else None,
+                               finish_reason=completion.choices[0].finish_reason,
+                               prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def _stream(self, system_prompt: str, prompt: str, max_tokens: int,
+                on_item: Callable[[StreamItem], None]) -> BackendResponse:
+        scanner = ItemScanner()
+        try:
+            with self.client.beta.chat.completions.stream(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=max_tokens,
+                temperature=self.temperature,
+                response_format=self.response_format,
+                stream_options={"include_usage": True}
+            ) as stream:
+                for event in stream:
+                    if event.type == "content.delta":
+                        for array_name, item_json in scanner.feed(event.delta):
+                            for item in self._decode_item(array_name, item_json):
+                                on_item(item)
+                completion = stream.get_final_completion()
+        except LengthFinishReasonError as err:
+            # the items before the cut were handed over already, the caller decides what to do with the rest
+            prompt_tokens, completion_tokens = _usage(err.completion)
+            return BackendResponse(data=None, finish_reason="length", prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        prompt_tokens, completion_tokens = _usage(completion)
+        parsed = completion.choices[0].message.parsed
+        return BackendResponse(data=self._decode(parsed) if parsed is not None else None,
+                               finish_reason=completion.choices[0].finish_reason,
+                               prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def _decode(self, parsed) -> ElectionData:
+        return parsed
+
+    def _decode_item(self, array_name: str, item_json: str) -> Iterator[StreamItem]:
+        item = parse_item(array_name, item_json)
+        if item is not None:
+            yield item
+
+
+class CompactStructuredBackend(StructuredOutputBackend):
+    "Structured outputs with the positional wire format - about a quarter of the completion tokens"
+    name = "compact"
+    wire_format = "compact"
+    response_format = CompactElectionData
+
+    def _decode(self, parsed: CompactElectionData) -> ElectionData:
+        return decode_compact(parsed)
+
+    def _decode_item(self, array_name: str, item_json: str) -> Iterator[StreamItem]:
+        # a compact contest carries its own summary, so one item decodes to a contest and a summary
+        if array_name == "contests":
+            yield from election_items(decode_compact(CompactElectionData(contests=[CompactContest.model_validate_json(item_json)])))
+
+
+class JsonChatBackend(ExtractionBackend):
+    name = "json"
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None, model: str = "gpt-4o", temperature: float = 0.2):
+        super().__init__(model)
+        self.client = get_client(api_key, base_url)
+        self.temperature = temperature
+
+    def _extract(self, system_prompt: str, prompt: str, max_tokens: int) -> BackendResponse:
+        completion = self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens,
+            temperature=self.temperature
+        )
+        prompt_tokens, completion_tokens = _usage(completion)
+        finish_reason = completion.choices[0].finish_reason
+        res = completion.choices[0].message.content
+        data = None
+        if res is not None and finish_reason != "length":
+            # the answer usually comes wrapped in a ```json fence
+            cleaned_res = res.strip().removeprefix("```json").strip("`").strip("'").strip()
+            data = ElectionData.model_validate_json(cleaned_res)
+        return BackendResponse(data=data, finish_reason=finish_reason,
+                               prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+class LlamaIndexBackend(ExtractionBackend):
+    name = "llamaindex"
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None, model: str = DEFAULT_MODEL):
+        super().__init__(model)
+        if OpenAIPydanticProgram is None:
+            raise ImportError("the llamaindex backend needs llama-index: pip install llama-index-program-openai")
+        llm = LlamaIndexOpenAI(model=model, api_key=api_key, api_base=base_url)
+        # the prompt is passed in as a variable, so braces in the PDF text aren't mistaken for template fields
+        self.program = OpenAIPydanticProgram.from_defaults(output_cls=ElectionData, prompt_template_str="{prompt}", llm=llm)
+
+    def _extract(self, system_prompt: str, prompt: str, max_tokens: int) -> BackendResponse:
+        # llama_index doesn't report the finish reason or token usage
+        return BackendResponse(data=self.program(prompt=prompt))
+
+
+class CascadeBackend(ExtractionBackend):
+    "Asks each tier in turn and keeps the first answer that passes check_batch; the last tier's answer is always kept"
+    name = "cascade"
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 models: Sequence[str] = CASCADE_MODELS, tiers: Optional[List[ExtractionBackend]] = None):
+        # tiers overrides models, e.g. to cascade from a compact-format cheap model or to replay recorded tiers
+        tiers = tiers or [StructuredOutputBackend(api_key, base_url, model) for model in models]
+        super().__init__(tiers[-1].model)
+        self.tiers = tiers
+        self.tier_latencies: List[List[float]] = [[] for _ in tiers]
+        self.tier_accepted = [0] * len(tiers)
+        self.tier_escalated = [0] * len(tiers)
+        self.tier_cost: List[Optional[float]] = [0.0] * len(tiers)
+
+    @property
+    def cache_id(self) -> str:
+        return "cascade:" + ">".join(tier.cache_id for tier in self.tiers)
+
+    def _extract(self, system_prompt: str, prompt: str, max_tokens: int) -> BackendResponse:
+        # the answer returned carries the tokens, latency and cost of every tier that was asked
+        prompt_tokens = completion_tokens = 0
+        latency, cost = 0.0, 0.0
+        for tier_num, tier in enumerate(self.tiers):
+            last = tier_num == len(self.tiers) - 1
+            if tier_num > 0:
+                # the caller acquired the first request; an escalation counts against the shared RPM/TPM budget too
+                rate_limiter.acquire(count_tokens(system_prompt + prompt) + max_tokens)
+            start = time.perf_counter()
+            try:
+                response = tier.extract(system_prompt, prompt, max_tokens)
+            except TruncatedResponseError as err:
+                response = err.response or BackendResponse(data=None, finish_reason="length")
+            except ValueError as err:
+                # an answer that doesn't fit the schema
+                if last:
+                    raise
+                response = BackendResponse(data=None, finish_reason="invalid", model=tier.model)
+            response.latency = response.latency or time.perf_counter() - start
+
+            prompt_tokens += response.prompt_tokens
+            completion_tokens += response.completion_tokens
+            latency += response.latency
+            tier_cost = response.cost_usd
+            if tier_cost is None:
+                tier_cost = estimate_cost(tier.model, response.prompt_tokens, response.completion_tokens)
+            cost = cost + tier_cost if cost is not None and tier_cost is not None else None
+            problems = check_batch(response.data, prompt, response.finish_reason)
+            with self._usage_lock:
+                self.tier_latencies[tier_num].append(response.latency)
+                self.tier_cost[tier_num] = (self.tier_cost[tier_num] + tier_cost
+                                            if self.tier_cost[tier_num] is not None and tier_cost is not None else None)
+                if problems and not last:
+                    self.tier_escalated[tier_num] += 1
+                else:
+                    self.tier_accepted[tier_num] += 1
+
+            if not problems or last:
+                return BackendResponse(data=response.data, finish_reason=response.finish_reason,
+                                       prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                       latency=latency, model=tier.model, cost_usd=cost)
+            print(f"cascade: {tier.model} answer failed ({'; '.join(problems)}), escalating to {self.tiers[tier_num + 1].model}")
+
+    def usage(self) -> dict:
+        tiers = []
+        for tier_num, tier in enumerate(self.tiers):
+            latencies = sorted(self.tier_latencies[tier_num])
+            requests = len(latencies)
+            tiers.append({
+                "model": tier.model,
+                "requests": requests,
+                "accepted": self.tier_accepted[tier_num],
+                "escalated": self.tier_escalated[tier_num],
+                "escalation_rate": round(self.tier_escalated[tier_num] / requests, 4) if requests else None,
+                "median_latency": round(statistics.median(latencies), 4) if latencies else None,
+                "p90_latency": round(latencies[int(0.9 * (requests - 1))], 4) if latencies else None,
+                "cost_usd": self.tier_cost[tier_num],
+            })
+        return {**super().usage(), "tiers": tiers}
+
+    def close(self):
+        for tier in self.tiers:
+            tier.close()
+
+
+class HedgeCancelled(Exception):
+    "Raised inside the request that lost a hedge race, to stop reading its answer"
+
+    def __init__(self, response: Optional[BackendResponse] = None):
+        super().__init__("hedge lost")
+        self.response = response  # what the abandoned request had cost so far, estimated
+
+
+class HedgedBackend(ExtractionBackend):
+    """Sends a request again when it takes longer than the recent latency percentile, and keeps the first good answer.
+    Hedges are capped at max_hedge_share of requests, so the extra spend is bounded (10% by default, not 100%).
+    Owns a thread pool: close it (or use it as a context manager) when done"""
+    name = "hedged"
+
+    def __init__(self, backend: ExtractionBackend, percentile: float = 0.95, max_hedge_share: float = 0.1,
+                 min_samples: int = 5, window: int = 100, min_delay: float = 1.0, max_workers: int = 16):
+        super().__init__(backend.model)
+        self.backend = backend
+        self.wire_format = backend.wire_format
+        self.percentile = percentile
+        self.max_hedge_share = max_hedge_share
+        self.min_samples = min_samples  # no hedging until there is a latency history to compare against
+        self.min_delay = min_delay
+        self.latencies = deque(maxlen=window)  # recent latencies of successful requests, for the threshold
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.cancelled = 0
+        # what the requests that didn't win cost - on top of the winners', so this is what hedging added
+        self.extra_prompt_tokens = 0
+        self.extra_completion_tokens = 0
+        self.extra_cost_usd: Optional[float] = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    @property
+    def cache_id(self) -> str:
+        # a hedged answer is the same backend's answer
+        return self.backend.cache_id
+
+    def hedge_delay(self) -> Optional[float]:
+        "How long to wait before hedging, None while there isn't enough history"
+        with self._usage_lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) < self.min_samples:
+            return None
+        if not latencies:
+            return self.min_delay
+        return max(self.min_delay, latencies[int(self.percentile * (len(latencies) - 1))])
+
+    def _attempt(self, system_prompt: str, prompt: str, max_tokens: int, cancel: threading.Event) -> BackendResponse:
+        # streamed, so a cancelled request stops at its next contest and its connection is closed -
+        # backends that can't stream finish the request and the answer is dropped
+        items = []
+
+        def check_cancelled(item):
+            if cancel.is_set():
+                raise HedgeCancelled()
+            items.append(item)
+
+        try:
+            return self.backend.extract(system_prompt, prompt, max_tokens, check_cancelled)
+        except TruncatedResponseError as err:
+            return err.response or BackendResponse(data=None, finish_reason="length")
+        except HedgeCancelled:
+            # the API never reported usage for the abandoned answer, so estimate what was paid for:
+            # the whole prompt, and the contests and summaries read before it was dropped
+            prompt_tokens = count_tokens(system_prompt + prompt)
+            completion_tokens = sum(count_tokens(item.model_dump_json()) for item in items)
+            raise HedgeCancelled(BackendResponse(
+                data=None, finish_reason="cancelled", prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                model=self.backend.model, cost_usd=estimate_cost(self.backend.model, prompt_tokens, completion_tokens)))
+
+    def _count_extra(self, future: Future):
+        # runs once a request that didn't win has finished or stopped; a request that failed, or was never sent, cost nothing
+        if future.cancelled():
+            return
+        try:
+            response = future.result()
+        except HedgeCancelled as err:
+            response = err.response
+        except Exception:
+            return
+        with self._usage_lock:
+            self.requests += 1
+            self.prompt_tokens += response.prompt_tokens
+            self.completion_tokens += response.completion_tokens
+            self.extra_prompt_tokens += response.prompt_tokens
+            self.extra_completion_tokens += response.completion_tokens
+            self.extra_cost_usd = (self.extra_cost_usd + response.cost_usd
+                                   if self.extra_cost_usd is not None and response.cost_usd is not None else None)
+
+    def _extract(self, system_prompt: str, prompt: str, max_tokens: int) -> BackendResponse:
+        start = time.perf_counter()
+        with self._usage_lock:
+            self.calls += 1
+        cancels = {}
+        primary_cancel = threading.Event()
+        primary = self._executor.submit(self._attempt, system_prompt, prompt, max_tokens, primary_cancel)
+        cancels[primary] = primary_cancel
+
+        delay = self.hedge_delay()
+        if delay is not None:
+            done, _ = wait([primary], timeout=delay)
+            with self._usage_lock:
+                # counting this hedge, hedges stay within max_hedge_share of the calls so far
+                may_hedge = self.hedges + 1 <= self.max_hedge_share * self.calls
+                if not done and may_hedge:
+                    self.hedges += 1
+            if not done and may_hedge:
+                print(f"hedging: no answer after {delay:.1f}s, sending the request again")
+                # the second request counts against the shared RPM/TPM budget like any other
+                rate_limiter.acquire(count_tokens(system_prompt + prompt) + max_tokens)
+                hedge_cancel = threading.Event()
+                cancels[self._executor.submit(self._attempt, system_prompt, prompt, max_tokens, hedge_cancel)] = hedge_cancel
+
+        # the first good answer wins; a truncated answer or an error only counts if nothing better comes
+        pending, fallback, error = set(cancels), None, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as err:
+                    error = error or err
+                    continue
+                if response.finish_reason == "length":
+                    fallback = fallback or (future, response)
+                    continue
+                for loser in pending:
+                    cancels[loser].set()
+                    loser.cancel()
+                with self._usage_lock:
+                    self.latencies.append(response.latency)
+                    self.cancelled += len(pending)
+                    if future is not primary:
+                        self.hedge_wins += 1
+                self._count_losers(cancels, future)
+                # what the caller waited, not what the winning request took
+                response.latency = time.perf_counter() - start
+                return response
+        if fallback is not None:
+            self._count_losers(cancels, fallback[0])
+            return fallback[1]
+        raise error
+
+    def _count_losers(self, futures, winner: Future):
+        # the winner is counted by extract; the others are counted once they have stopped, which for a
+        # cancelled stream is at its next contest - the caller doesn't wait for that
+        for future in futures:
+            if future is not winner:
+                future.add_done_callback(self._count_extra)
+
+    def close(self):
+        "Waits for the requests that lost to stop, so their spend is in usage(), and shuts the thread pool down"
+        self._executor.shutdown(wait=True)
+        self.backend.close()
+
+    def usage(self) -> dict:
+        return {**super().usage(), "calls": self.calls, "hedges": self.hedges, "hedge_wins": self.hedge_wins,
+                "cancelled": self.cancelled, "extra_prompt_tokens": self.extra_prompt_tokens,
+                "extra_completion_tokens": self.extra_completion_tokens, "extra_cost_usd": self.extra_cost_usd,
+                "hedge_delay": self.hedge_delay()}
+
+
+def recording_key(model: str, system_prompt: str, prompt: str) -> str:
+    return cache_key(prompt, model, system_prompt)
+
+
+class RecordingBackend(ExtractionBackend):
+    "Passes requests through to another backend and saves every response for ReplayBackend"
+    name = "record"
+
+    def __init__(self, backend: ExtractionBackend, recordings_dir: Path = RECORDINGS_DIR):
+        super().__init__(backend.model)
+        self.backend = backend
+        self.wire_format = backend.wire_format
+        self.recordings_dir = Path(recordings_dir)
+        self.recordings_dir.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def cache_id(self) -> str:
+        # recorded (and cached) as the wrapped backend's answer - a cascade's answers aren't its last tier's
+        return self.backend.cache_id
+
+    def _extract(self, system_prompt: str, prompt: str, max_tokens: int) -> BackendResponse:
+        # truncated responses are recorded too, so a replay bisects the batch exactly like the real run did
+        start = time.perf_counter()
+        response = self.backend._extract(system_prompt, prompt, max_tokens)
+        response.latency = response.latency or time.perf_counter() - start
+        self._save(system_prompt, prompt, response)
+        return response
+
+    def _stream(self, system_prompt: str, prompt: str, max_tokens: int,
+                on_item: Callable[[StreamItem], None]) -> BackendResponse:
+        # record the streamed answer like any other, replay hands its items over in one go
+        start = time.perf_counter()
+        response = self.backend._stream(system_prompt, prompt, max_tokens, on_item)
+        response.latency = response.latency or time.perf_counter() - start
+        self._save(system_prompt, prompt, response)
+        return response
+
+    def _save(self, system_prompt: str, prompt: str, response: BackendResponse):
+        save_recording(self.recordings_dir, self.cache_id, system_prompt, prompt, response)
+
+    def close(self):
+        self.backend.close()
+
+
+def save_recording(recordings_dir: Path, model: str, system_prompt: str, prompt: str, response: BackendResponse):
+    "Saves the response ReplayBackend(recordings_dir) answers this prompt with; model is the backend's cache_id"
+    path = Path(recordings_dir) / f"{recording_key(model, system_prompt, prompt)}.json"
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(response.model_dump_json())
+    os.replace(tmp_path, path)
+
+
+class ReplayBackend(ExtractionBackend):
+    "Deterministic offline backend: answers each prompt with its recorded response"
+    name = "replay"
+
+    def __init__(self, recordings_dir: Path = RECORDINGS_DIR, model: str = DEFAULT_MODEL, latency_scale: float = 0.0,
+                 wire_format: str = "full"):
+        # latency_scale=1.0 sleeps for as long as the recorded request took, 0.0 answers immediately
+        # wire_format picks which recordings to replay, e.g. "compact" for ones made with the compact backend
+        super().__init__(model)
+        self.wire_format = wire_format
+        self.recordings_dir = Path(recordings_dir)
+        self.latency_scale = latency_scale
+
+    def _extract(self, system_prompt: str, prompt: str, max_tokens: int) -> BackendResponse:
+        key = recording_key(self.cache_id, system_prompt, prompt)
+        path = self.recordings_dir / f"{key}.json"
+        if not path.exists():
+            raise MissingRecordingError(f"no recorded response {key} in {self.recordings_dir}")
+        with open(path, encoding="utf-8") as f:
+            response = BackendResponse.model_validate(json.load(f))
+        if self.latency_scale:
+            time.sleep(response.latency * self.latency_scale)
+        return response
+
+
+BACKENDS = {
+    "structured": StructuredOutputBackend,
+    "compact": CompactStructuredBackend,
+    "json": JsonChatBackend,
+    "llamaindex": LlamaIndexBackend,
+    "cascade": CascadeBackend,
+}
+
+
+def get_backend(name: str, api_key: Optional[str] = None, base_url: Optional[str] = None, **options) -> ExtractionBackend:
+    "Builds a backend by name; replay takes recordings_dir/latency_scale/wire_format options instead of an api key"
+    if name == "replay":
+        return ReplayBackend(**options)
+    if name not in BACKENDS:
+        raise ValueError(f"unknown backend {name!r} (expected one of {', '.join(list(BACKENDS) + ['replay'])})")
+    return BACKENDS[name](api_key, base_url, **options)
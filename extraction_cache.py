@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from extraction_models import ElectionData
+
+
+# content-addressed, on-disk cache of parsed ElectionData results
+# the key covers everything that can change the model's answer: the batch text, the model name,
+# the prompt, and the ElectionData JSON schema (so editing a Field description invalidates old entries)
+# The cache's total size is kept in memory, so a put only scans the directory when the cache has grown past
+# max_bytes - the scan then evicts down to EVICT_TO_SHARE of it, leaving room for many puts before the next one.
+# Entries other processes add (batch_runner's workers share the directory) are counted at this process's next scan.
+
+EVICT_TO_SHARE = 0.9
+
+
+def cache_key(text: str, model: str, prompt: str) -> str:
+    schema = json.dumps(ElectionData.model_json_schema(), sort_keys=True)
+    hasher = hashlib.sha256()
+    for part in (model, prompt, schema, text):
+        hasher.update(part.encode("utf-8"))
+        hasher.update(b"\0")  # separator so ("ab", "c") and ("a", "bc") hash differently
+    return hasher.hexdigest()
+
+
+class ExtractionCache:
+    "Stores one <key>.json file per cached ElectionData, evicting by age and total size"
+
+    def __init__(self, cache_dir: Path = Path(".extraction_cache"), max_bytes: int = 200 * 1024 * 1024,
+                 max_age_seconds: Optional[float] = 30 * 24 * 3600):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._total_bytes: Optional[int] = None  # unknown until the first scan
+        self._lock = threading.Lock()  # batches may be extracted from several threads at once
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> Optional[ElectionData]:
+        path = self._path(key)
+        try:
+            if self.max_age_seconds is not None and time.time() - path.stat().st_mtime > self.max_age_seconds:
+                path.unlink(missing_ok=True)
+                raise FileNotFoundError(path)
+            data = ElectionData.model_validate_json(path.read_text(encoding="utf-8"))
+            try:
+                os.utime(path)  # refresh mtime so size-based eviction drops the least recently used entries first
+            except FileNotFoundError:
+                pass  # evicted by a concurrent put since we read it, what we read is still a hit
+        except (OSError, ValueError):
+            # missing, expired, or unreadable (e.g. the schema changed under a hash collision) all count as a miss
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: ElectionData):
+        # write to a temp file and rename, so a crash or a concurrent reader never sees a half-written entry
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        size = tmp_path.write_bytes(data.model_dump_json().encode("utf-8"))
+        try:
+            replaced = path.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += size - replaced
+            full = self._total_bytes is None or self._total_bytes > self.max_bytes
+        if full:
+            self.evict()
+
+    def evict(self):
+        "Scans the cache, drops expired entries and the least recently used ones until it's back under its limit"
+        now = time.time()
+        entries = []
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if self.max_age_seconds is not None and now - stat.st_mtime > self.max_age_seconds:
+                path.unlink(missing_ok=True)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        if total_bytes > self.max_bytes:
+            for _, size, path in sorted(entries):
+                if total_bytes <= self.max_bytes * EVICT_TO_SHARE:
+                    break
+                path.unlink(missing_ok=True)
+                total_bytes -= size
+        with self._lock:
+            self._total_bytes = total_bytes
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
@@ -0,0 +1,54 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from extraction_models import ElectionData
+
+
+# append-only JSONL journal of finished batches, so a crash or API outage part way through a long run
+# doesn't throw away the batches we already paid for. Each line records which PDF (by content hash)
+# and which pages the batch covered, plus the batch's parsed ElectionData.
+
+class ExtractionJournal:
+    "Appends one line per finished batch and fsyncs it, so it survives a crash"
+
+    def __init__(self, journal_path: Path, pdf_hash: str, resume: bool = False):
+        self.journal_path = Path(journal_path)
+        self.pdf_hash = pdf_hash
+        self._lock = threading.Lock()  # batches finish on several threads
+        if not resume:
+            # a fresh run starts a fresh journal
+            self.journal_path.unlink(missing_ok=True)
+
+    def record(self, pages: List[int], data: Optional[ElectionData]):
+        if data is None:
+            return  # nothing to replay, the batch will simply be retried on resume
+        line = json.dumps({"pdf_hash": self.pdf_hash, "pages": pages, "data": data.model_dump()})
+        with self._lock:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def completed_batches(self) -> Dict[Tuple[int, ...], ElectionData]:
+        "The batches already finished for this PDF, keyed by their pages"
+        completed: Dict[Tuple[int, ...], ElectionData] = {}
+        if not self.journal_path.exists():
+            return completed
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    data = ElectionData.model_validate(entry["data"])
+                except (ValueError, KeyError):
+                    # the last line may be half written if we crashed mid-append
+                    print("journal: skipping unreadable entry")
+                    continue
+                if entry.get("pdf_hash") == self.pdf_hash:
+                    completed[tuple(entry["pages"])] = data
+        return completed
+
+    def remove(self):
+        self.journal_path.unlink(missing_ok=True)
@@ -0,0 +1,229 @@
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from extraction_models import ElectionData
+
+try:
+    import resource
+except ImportError:  # not on Windows - memory is then reported as unknown
+    resource = None
+
+
+# structured metrics for a run, one JSON object per line:
+#   {"event": "batch", ...}   - one span per batch: pages, words, tokens, latency, retries, finish reasons, cache hits
+#   {"event": "first_result", ...} - when streaming, how long after the start the first contest/summary was merged
+#   {"event": "memory", ...} - in low-memory mode, resident and peak memory every so many pages
+#   {"event": "backend", ...} - the backend's request and token totals; for a cascade, latency, cost and escalations per tier
+#   {"event": "stage", ...}   - wall time of each pipeline stage (pdf_text, rule_parser, batching, model, merge, ...)
+#                               not counting the stages run inside it, e.g. the model stage leaves out the merges
+#                               that happen while it waits on batches, so the stages add up to the run's wall time
+#   {"event": "summary", ...} - run totals, estimated cost and cost per contest, and the slowest/most expensive batches
+# Every line carries the run id, so one file can collect many runs and still be grouped per run.
+
+# USD per million (prompt, completion) tokens
+PRICES_PER_MILLION = {
+    "gpt-4o-2024-08-06": (2.50, 10.00),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    if model not in PRICES_PER_MILLION:
+        return None
+    prompt_price, completion_price = PRICES_PER_MILLION[model]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def rss_mb() -> Optional[float]:
+    "Current resident memory, where /proc has it (Linux); None elsewhere"
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class BatchSpan:
+    "Everything that happened while extracting one batch, including retries and truncation splits"
+
+    def __init__(self, batch_num: int, pages: List[int], text: str):
+        self.batch_num = batch_num
+        self.pages = pages
+        self.words = len(text.split())
+        self.model: Optional[str] = None
+        self.requests = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self.splits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd: Optional[float] = 0.0
+        self.model_latency = 0.0
+        self.finish_reasons: List[str] = []
+        self.errors: List[str] = []
+        self.streamed_items = 0
+        self.first_item_latency: Optional[float] = None
+        self._start = time.perf_counter()
+        self.latency = 0.0
+
+    def request(self, model: str, response=None, cache_hit: bool = False):
+        "Records one call to the backend (a BackendResponse) or one cache hit"
+        self.model = model
+        if cache_hit:
+            self.cache_hits += 1
+            return
+        self.requests += 1
+        if response is not None:
+            # a cascade answers with whichever model passed, and its cost covers every model it asked
+            self.model = response.model or model
+            cost = response.cost_usd
+            if cost is None:
+                cost = estimate_cost(self.model, response.prompt_tokens, response.completion_tokens)
+            self.cost_usd = self.cost_usd + cost if self.cost_usd is not None and cost is not None else None
+            self.prompt_tokens += response.prompt_tokens
+            self.completion_tokens += response.completion_tokens
+            self.model_latency += response.latency
+            self.finish_reasons.append(response.finish_reason)
+
+    def item(self):
+        "Records one streamed contest or summary"
+        self.streamed_items += 1
+        if self.first_item_latency is None:
+            self.first_item_latency = time.perf_counter() - self._start
+
+    def retry(self, err: Exception):
+        self.retries += 1
+        self.errors.append(type(err).__name__)
+
+    def finish(self, result: Optional[ElectionData], error: Optional[Exception] = None) -> dict:
+        self.latency = time.perf_counter() - self._start
+        if error is not None:
+            self.errors.append(type(error).__name__)
+        return {
+            "event": "batch",
+            "batch_num": self.batch_num,
+            "pages": [page_num + 1 for page_num in self.pages],
+            "words": self.words,
+            "model": self.model,
+            "requests": self.requests,
+            "cache_hits": self.cache_hits,
+            "retries": self.retries,
+            "splits": self.splits,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": self.cost_usd if self.requests else estimate_cost(self.model, 0, 0),
+            "latency": round(self.latency, 4),
+            "model_latency": round(self.model_latency, 4),
+            "streamed_items": self.streamed_items,
+            "first_item_latency": round(self.first_item_latency, 4) if self.first_item_latency is not None else None,
+            "finish_reasons": self.finish_reasons,
+            "errors": self.errors,
+            "contests": len(result.contests) if result is not None else 0,
+            "choices": sum(len(contest.choices) for contest in result.contests) if result is not None else 0,
+        }
+
+
+class ExtractionMetrics:
+    "Collects batch spans and stage timings; with a path, also appends them to a JSON-lines file as they happen"
+
+    def __init__(self, path: Optional[Path] = None, run_id: Optional[str] = None):
+        self.path = Path(path) if path is not None else None
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.batches: List[dict] = []
+        self.stages: Dict[str, float] = {}
+        self._open_stages: Dict[int, List[float]] = {}  # id of each running stage -> [start, time in stages nested in it]
+        self.first_result: Optional[float] = None  # seconds from the start of the run to the first streamed result
+        self._lock = threading.Lock()  # batches finish on several threads
+
+    def emit(self, event: dict):
+        event = {"run_id": self.run_id, "time": time.time(), **event}
+        if self.path is None:
+            return
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(event) + "\n")
+
+    def batch(self, batch_num: int, pages: List[int], text: str) -> BatchSpan:
+        return BatchSpan(batch_num, pages, text)
+
+    def finish_batch(self, span: BatchSpan, result: Optional[ElectionData], error: Optional[Exception] = None):
+        event = span.finish(result, error)
+        with self._lock:
+            self.batches.append(event)
+        self.emit(event)
+
+    @contextmanager
+    def stage(self, name: str):
+        # nested is any stage that starts while this one runs, on any thread - merges run on the batch threads
+        token = object()
+        start = time.perf_counter()
+        with self._lock:
+            self._open_stages[id(token)] = [start, 0.0]
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                duration = elapsed - self._open_stages.pop(id(token))[1]
+                for outer in self._open_stages.values():
+                    if outer[0] <= start:
+                        outer[1] += duration
+                # a stage can run more than once (e.g. model calls again for re-extraction), so durations add up
+                self.stages[name] = self.stages.get(name, 0.0) + duration
+            self.emit({"event": "stage", "stage": name, "duration": round(duration, 4)})
+
+    def summary(self, election_data: Optional[ElectionData] = None, top: int = 5) -> dict:
+        "Emits and returns the run totals"
+        prompt_tokens = sum(batch["prompt_tokens"] for batch in self.batches)
+        completion_tokens = sum(batch["completion_tokens"] for batch in self.batches)
+        costs = [batch["cost_usd"] for batch in self.batches if batch["cost_usd"] is not None]
+        cost = sum(costs) if costs else None
+        contests = len(election_data.contests) if election_data is not None else 0
+
+        def brief(batch: dict) -> dict:
+            return {key: batch[key] for key in ("batch_num", "pages", "latency", "prompt_tokens", "completion_tokens", "cost_usd")}
+
+        summary = {
+            "event": "summary",
+            "batches": len(self.batches),
+            "requests": sum(batch["requests"] for batch in self.batches),
+            "cache_hits": sum(batch["cache_hits"] for batch in self.batches),
+            "retries": sum(batch["retries"] for batch in self.batches),
+            "splits": sum(batch["splits"] for batch in self.batches),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost_usd": cost,
+            "contests": contests,
+            "cost_per_contest_usd": cost / contests if cost is not None and contests else None,
+            "first_result_seconds": round(self.first_result, 4) if self.first_result is not None else None,
+            "stages": {name: round(duration, 4) for name, duration in self.stages.items()},
+            "slowest_batches": [brief(batch) for batch in sorted(self.batches, key=lambda batch: -batch["latency"])[:top]],
+            "most_expensive_batches": [brief(batch) for batch in
+                                       sorted(self.batches, key=lambda batch: -(batch["cost_usd"] or 0))[:top]],
+        }
+        self.emit(summary)
+        return summary
+
+    @staticmethod
+    def describe(summary: dict) -> str:
+        cost = f"${summary['cost_usd']:.4f}" if summary["cost_usd"] is not None else "unknown cost"
+        per_contest = f" (${summary['cost_per_contest_usd']:.5f}/contest)" if summary["cost_per_contest_usd"] is not None else ""
+        return (f"{summary['batches']} batches, {summary['requests']} requests, {summary['cache_hits']} cache hits, "
+                f"{summary['retries']} retries, {summary['prompt_tokens']} prompt + {summary['completion_tokens']} completion tokens, "
+                f"{cost}{per_contest}")
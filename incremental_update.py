@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from extraction_models import ElectionData
+from extraction_cache import ExtractionCache
+from extraction_backends import ExtractionBackend
+from extraction_metrics import ExtractionMetrics
+from rule_parser import continues_previous_page, page_body_lines
+from election_store import ElectionStore, normalize_contest_name
+from results_db import store_results
+from scrape_election_pdf_structured import extract_batches_concurrently, get_page_texts
+from token_budget import DEFAULT_MAX_INPUT_TOKENS, DEFAULT_MAX_OUTPUT_TOKENS, pack_pages
+
+
+# counties re-post the same report several times on election night, and usually only a few contests move
+# between posts. We remember a fingerprint of every page's text and only re-send the pages that changed,
+# then patch the affected contests and summaries into the existing cumulative result.
+# The state also remembers which contests each page produced, so a contest that is gone from the new version -
+# its pages were dropped, or re-extracted without it - is dropped from the cumulative result too.
+#   {"fingerprints": {"0": "<sha256>", ...}, "contests": {"0": ["president democratic", ...], ...}}
+
+
+# the report header at the top of every page changes on every post, so it is left out of the fingerprint
+def page_fingerprint(text: str) -> str:
+    return hashlib.sha256("\n".join(page_body_lines(text)).encode("utf-8")).hexdigest()
+
+
+def load_page_state(state_path: Path) -> Dict[str, dict]:
+    if not state_path.exists():
+        return {}
+    with open(state_path) as f:
+        state = json.load(f)
+    if "fingerprints" not in state:
+        # written before contests were tracked, so removed contests can't be found - start over with a full run
+        print(f"{state_path} has no page contests, re-extracting every page")
+        return {}
+    return state
+
+
+def save_page_state(state_path: Path, fingerprints: List[str], page_contests: Dict[int, Set[str]]):
+    tmp_path = state_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"fingerprints": {str(page_num): fp for page_num, fp in enumerate(fingerprints)},
+                   "contests": {str(page_num): sorted(page_contests.get(page_num, ()))
+                                for page_num in range(len(fingerprints))}}, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+# find the pages that need to be re-sent, grouped into runs of consecutive pages
+# a contest can be split across pages, so a changed page drags in its neighbors whenever
+# the contest on the page boundary continues from one page to the next
+def changed_page_groups(old_state: Dict[str, str], page_texts: List[str]) -> List[List[int]]:
+    fingerprints = [page_fingerprint(text) for text in page_texts]
+    changed = {page_num for page_num, fp in enumerate(fingerprints) if old_state.get(str(page_num)) != fp}
+
+    expanded = set(changed)
+    for page_num in sorted(changed):
+        # walk back while this page continues a contest from the previous page
+        prev = page_num
+        while prev > 0 and continues_previous_page(page_texts[prev]):
+            prev -= 1
+            expanded.add(prev)
+        # walk forward while the next page continues a contest from this one
+        nxt = page_num + 1
+        while nxt < len(page_texts) and continues_previous_page(page_texts[nxt]):
+            expanded.add(nxt)
+            nxt += 1
+
+    groups: List[List[int]] = []
+    for page_num in sorted(expanded):
+        if groups and groups[-1][-1] == page_num - 1:
+            groups[-1].append(page_num)
+        else:
+            groups.append([page_num])
+    return groups
+
+
+# replace whole contests and summaries by (normalized) name - the re-extracted pages always cover the complete contest
+def patch_election_data(master: ElectionData, update: ElectionData) -> ElectionData:
+    ElectionStore.from_election_data(master).patch(update)
+    return master
+
+
+# the contests of the pages that weren't re-extracted (or whose batch failed) are what they were; a re-extracted
+# batch's contests are credited to all of its pages, since the model doesn't say which page a contest was on
+def current_page_contests(old_contests: Dict[str, List[str]], page_count: int, batch_pages: List[List[int]],
+                          batch_results: List[Optional[ElectionData]]) -> Dict[int, Set[str]]:
+    page_contests = {page_num: set(old_contests.get(str(page_num), ())) for page_num in range(page_count)}
+    for pages, result in zip(batch_pages, batch_results):
+        if result is not None:
+            for page_num in pages:
+                page_contests[page_num] = {normalize_contest_name(contest.name) for contest in result.contests}
+    return page_contests
+
+
+# contests the old version had on pages that were re-extracted or removed, and that no page has any more
+def removed_contests(old_contests: Dict[str, List[str]], page_contests: Dict[int, Set[str]],
+                     rechecked_pages: Set[int]) -> Set[str]:
+    before = {key for page_num in rechecked_pages for key in old_contests.get(str(page_num), ())}
+    return before - {key for keys in page_contests.values() for key in keys}
+
+
+def drop_contests(master: ElectionData, keys: Set[str]) -> ElectionData:
+    master.contests = [contest for contest in master.contests if normalize_contest_name(contest.name) not in keys]
+    master.summary = [summary for summary in master.summary if normalize_contest_name(summary.contest) not in keys]
+    return master
+
+
+def main(pdf_path: Path, api_key: str, cumulative_path: Path = Path("election_data_cumulative.json"),
+         state_path: Optional[Path] = None, max_concurrency: int = 1,
+         base_url: Optional[str] = None, cache: Optional[ExtractionCache] = None,
+         max_input_tokens: int = DEFAULT_MAX_INPUT_TOKENS, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+         backend: Optional[ExtractionBackend] = None, metrics: Optional[ExtractionMetrics] = None,
+         results_db_path: Optional[Path] = None):
+
+    # the page fingerprints live next to the cumulative result they describe
+    state_path = state_path or cumulative_path.with_suffix(".pages.json")
+    old_state = load_page_state(state_path)
+    if old_state and cumulative_path.exists():
+        master_election_data = ElectionData.model_validate_json(cumulative_path.read_text())
+    else:
+        # nothing to patch, so every page counts as changed and this is a full run
+        old_state = {}
+        master_election_data = ElectionData(contests=[], summary=[])
+
+    old_contests = old_state.get("contests", {})
+    page_texts = get_page_texts(pdf_path)
+    groups = changed_page_groups(old_state.get("fingerprints", {}), page_texts)
+    changed_pages = sum(len(group) for group in groups)
+    print(f"{changed_pages} of {len(page_texts)} pages changed since the last version")
+    old_page_count = len(old_state.get("fingerprints", {}))
+    if old_page_count > len(page_texts):
+        print(f"{old_page_count - len(page_texts)} pages are gone since the last version, dropping their contests")
+
+    # batch each run of changed pages separately so a batch never spans unrelated contests
+    batch_pages = pack_pages([page_num for group in groups for page_num in group], page_texts, max_input_tokens, max_output_tokens)
+    print(f"Re-extracting {len(batch_pages)} batches")
+
+    batch_results = extract_batches_concurrently(batch_pages, page_texts, api_key, max_concurrency, base_url, cache,
+                                                 max_output_tokens, backend=backend, metrics=metrics)
+
+    # merge the new batches among themselves first (a contest may still be split across two of them),
+    # then swap the finished contests into the cumulative result
+    update = ElectionStore()
+    for batch_num, batch_election_data in enumerate(batch_results):
+        if batch_election_data is not None:
+            update.merge(batch_election_data)
+        else:
+            print(f"UNEXPECTED - Batch number: {batch_num} returned No Data!")
+    patch_election_data(master_election_data, update.to_election_data())
+    page_contests = current_page_contests(old_contests, len(page_texts), batch_pages, batch_results)
+    rechecked_pages = {int(page_num) for page_num in old_contests if int(page_num) >= len(page_texts)}
+    rechecked_pages.update(page_num for pages, result in zip(batch_pages, batch_results) if result is not None
+                           for page_num in pages)
+    gone = removed_contests(old_contests, page_contests, rechecked_pages)
+    if gone:
+        print(f"Dropping {len(gone)} contests that are no longer in the report: {', '.join(sorted(gone))}")
+        drop_contests(master_election_data, gone)
+
+    with open(cumulative_path, "w") as f:
+        f.write(master_election_data.model_dump_json())
+    # only record the new fingerprints once the patched result is safely on disk
+    save_page_state(state_path, [page_fingerprint(text) for text in page_texts], page_contests)
+    # every re-posted version is kept in the results database, so updates can be compared later
+    if results_db_path is not None:
+        store_results(results_db_path, pdf_path, page_texts[0] if page_texts else "", master_election_data)
+    if metrics is not None:
+        print("run summary:", ExtractionMetrics.describe(metrics.summary(master_election_data)))
+    return master_election_data
+
+
+if __name__ == "__main__":
+
+    import sys
+    from dotenv import load_dotenv
+    load_dotenv() # make sure our environment variables are loaded
+
+    pdf_path = Path(sys.argv[1] if len(sys.argv) > 1 else "./First Post Election Update Report-3-7-2024 09-43-19 AM.pdf")
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("API key not found")
+    max_concurrency = int(os.getenv("MAX_CONCURRENCY", "4"))
+    main(pdf_path, api_key, max_concurrency=max_concurrency, base_url=os.getenv("OPENAI_BASE_URL"), cache=ExtractionCache(),
+         metrics=ExtractionMetrics(Path("election_data_cumulative.metrics.jsonl")))
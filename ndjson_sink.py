@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional, Set
+
+from extraction_models import ElectionData
+from election_store import ElectionStore, normalize_contest_name
+
+
+# results as newline-delimited JSON, written while the run is still going, so a reader (the results website)
+# can tail the file instead of waiting for the final election_data_cumulative.json. One record per line:
+#   {"type": "contest", "data": {...Contest...}}
+#   {"type": "summary", "data": {...Summary...}}
+#   {"type": "end", "contests": n, "summaries": m}  - only in the final snapshot
+# A contest can continue on the next batch's pages, so it is written once a batch that doesn't touch it has been
+# merged, i.e. when it can't grow any more. A contest written again later (e.g. re-extracted after validation)
+# replaces the earlier record - readers keep the last record per contest name.
+# At the end the file is atomically replaced by a compacted snapshot: one record per contest and summary, then "end".
+
+class NdjsonSink:
+    "Appends finalized contests and summaries as batches are merged; close() swaps in the compacted snapshot"
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._open: Set[str] = set()  # contests the last merged batch touched, which the next one may continue
+        self._lock = threading.Lock()
+        # a new run starts a new file
+        self.path.write_text("", encoding="utf-8")
+
+    def _append(self, records: List[dict]):
+        if not records:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+            f.flush()
+
+    def _records(self, store: ElectionStore, keys: Set[str]) -> List[dict]:
+        # in the order the contests appear in the PDF, summaries without a contest last
+        ordered = [key for key in (normalize_contest_name(contest.name) for contest in store.contests) if key in keys]
+        ordered += sorted(keys - set(ordered))
+        records = []
+        for key in ordered:
+            contest = store.contest(key)
+            summary = store.summary(key)
+            if contest is not None:
+                records.append({"type": "contest", "data": contest.model_dump()})
+            if summary is not None:
+                records.append({"type": "summary", "data": summary.model_dump()})
+        return records
+
+    def batch_merged(self, store: ElectionStore, batch: Optional[ElectionData]):
+        "Call after each batch is merged into store, in page order"
+        touched = set()
+        if batch is not None:
+            touched = {normalize_contest_name(contest.name) for contest in batch.contests}
+            touched |= {normalize_contest_name(summary.contest) for summary in batch.summary}
+        with self._lock:
+            finished = self._open - touched
+            self._append(self._records(store, finished))
+            self._open = (self._open - finished) | touched
+
+    def update(self, store: ElectionStore, contest_names: Iterable[str]):
+        "Writes these contests again, e.g. after they were patched"
+        with self._lock:
+            self._append(self._records(store, {normalize_contest_name(name) for name in contest_names} - self._open))
+
+    def close(self, store: ElectionStore):
+        "Writes the contests still open, then atomically replaces the file with the compacted snapshot"
+        with self._lock:
+            self._append(self._records(store, self._open))
+            self._open = set()
+            data = store.to_election_data()
+            records = [{"type": "contest", "data": contest.model_dump()} for contest in data.contests]
+            records += [{"type": "summary", "data": summary.model_dump()} for summary in data.summary]
+            records.append({"type": "end", "contests": len(data.contests), "summaries": len(data.summary)})
+            tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write("".join(json.dumps(record) + "\n" for record in records))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+
+def read_ndjson(path: Path) -> ElectionData:
+    "The current results in an ndjson file, complete or not - the last record for each contest/summary wins"
+    contests, summaries = {}, {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # a line still being written
+            if record["type"] == "contest":
+                contests[normalize_contest_name(record["data"]["name"])] = record["data"]
+            elif record["type"] == "summary":
+                summaries[normalize_contest_name(record["data"]["contest"])] = record["data"]
+    return ElectionData.model_validate({"contests": list(contests.values()), "summary": list(summaries.values())})
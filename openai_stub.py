@@ -0,0 +1,212 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional, Sequence
+
+from extraction_models import Choice, Contest, Summary, ElectionData
+from wire_format import encode
+
+
+# a local stand-in for OpenAI's chat completions endpoint, so retries, backoff, concurrency, streaming and hedging
+# can be tested without an API key or the network. It speaks just enough of the API for the backends:
+# plain and streamed (server-sent events) completions, structured outputs in both wire formats, usage, finish reasons.
+# Every page in the prompt ("Run Date ... Page N") is answered with one contest, "STUB CONTEST PAGE N", so the
+# merged results show which pages were extracted and in what order. What it can be told to do:
+#   fail_statuses  the first requests for each prompt fail with these statuses, e.g. (429, 500), then it answers
+#   fail_prompt    only prompts this function of the prompt is true for fail, e.g. to fail one batch of a run
+#   retry_after    sent as the Retry-After header with every failure
+#   delay          seconds before answering, or a function of (prompt, attempt) - attempt 0 is the first request
+#                  for a prompt, so a hedge or retry can be made faster or slower than the request it repeats
+#   slow_share     this share of requests (chosen at random) takes slow_delay seconds instead
+#   max_pages      prompts with more pages than this are cut off with finish_reason "length"
+# and like the API, an answer longer than the request's max_tokens (at 4 characters a token) is cut off there.
+# Every request is logged in .requests, and a streamed answer the client stops reading counts in .cancelled.
+#   python openai_stub.py --port 8089 --slow-share 0.1 --slow-delay 5
+#   OPENAI_API_KEY=stub OPENAI_BASE_URL=http://127.0.0.1:8089/v1 python scrape_election_pdf_structured.py --hedge
+
+STUB_PAGE = re.compile(r"\bPage (\d+)\s*$", re.MULTILINE)
+# characters of answer per streamed chunk
+STREAM_CHUNK = 40
+
+
+def stub_answer(prompt: str) -> ElectionData:
+    "One contest (and its summary) for every page in the prompt, in prompt order"
+    contests, summaries = [], []
+    for page in STUB_PAGE.findall(prompt):
+        name = f"STUB CONTEST PAGE {page}"
+        contests.append(Contest(name=name, choices=[
+            Choice(name="YES", writein=False, vote_in_center=int(page), vote_by_mail=1, vote_total=int(page) + 1)]))
+        summaries.append(Summary(contest=name, **{field: 0 for field in Summary.model_fields if field != "contest"}))
+    return ElectionData(contests=contests, summary=summaries)
+
+
+class OpenAIStub:
+    "Serves on 127.0.0.1 in a background thread; use as a context manager and point base_url at .base_url"
+
+    def __init__(self, port: int = 0, fail_statuses: Sequence[int] = (), retry_after: Optional[float] = None,
+                 delay=0.0, slow_share: float = 0.0, slow_delay: float = 0.0, max_pages: Optional[int] = None,
+                 answer: Callable[[str], ElectionData] = stub_answer, seed: Optional[int] = None,
+                 fail_prompt: Optional[Callable[[str], bool]] = None):
+        self.fail_statuses = list(fail_statuses)
+        self.fail_prompt = fail_prompt
+        self.retry_after = retry_after
+        self.delay = delay if callable(delay) else (lambda prompt, attempt: delay)
+        self.slow_share = slow_share
+        self.slow_delay = slow_delay
+        self.max_pages = max_pages
+        self.answer = answer
+        self.random = random.Random(seed)
+        self.requests: List[dict] = []  # {"prompt", "attempt", "max_tokens", "status", "stream", "start", "end"}
+        self.cancelled = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def start(self) -> "OpenAIStub":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "OpenAIStub":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def attempts(self, prompt_contains: str = "") -> List[dict]:
+        "The logged requests whose prompt contains this text"
+        with self._lock:
+            return [request for request in self.requests if prompt_contains in request["prompt"]]
+
+    def _completion(self, body: dict, prompt: str) -> dict:
+        data = self.answer(prompt)
+        response_format = (body.get("response_format") or {}).get("json_schema") or {}
+        content = (encode(data) if response_format.get("name") == "CompactElectionData" else data).model_dump_json()
+        finish_reason = "stop"
+        if self.max_pages is not None and len(STUB_PAGE.findall(prompt)) > self.max_pages:
+            content, finish_reason = content[:len(content) // 2], "length"
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+        if max_tokens is not None and len(content) > 4 * max_tokens:
+            content, finish_reason = content[:4 * max_tokens], "length"
+        return {"id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": body.get("model"),
+                "choices": [{"index": 0, "finish_reason": finish_reason, "logprobs": None,
+                             "message": {"role": "assistant", "content": content, "refusal": None}}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                          "total_tokens": (len(prompt) + len(content)) // 4}}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status: int, payload: dict, headers: Optional[dict] = None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                if not self.path.endswith("/chat/completions"):
+                    self.send_json(404, {"error": {"message": f"no such endpoint {self.path}", "type": "invalid_request_error"}})
+                    return
+                body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+                prompt = body["messages"][-1]["content"]
+                with stub._lock:
+                    attempt = stub._attempts.get(prompt, 0)
+                    stub._attempts[prompt] = attempt + 1
+                    request = {"prompt": prompt, "attempt": attempt, "max_tokens": body.get("max_tokens"), "status": 200,
+                               "stream": bool(body.get("stream")), "start": time.perf_counter(), "end": None}
+                    stub.requests.append(request)
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                    slow = stub.random.random() < stub.slow_share
+                try:
+                    if attempt < len(stub.fail_statuses) and (stub.fail_prompt is None or stub.fail_prompt(prompt)):
+                        request["status"] = stub.fail_statuses[attempt]
+                        headers = {"retry-after": str(stub.retry_after)} if stub.retry_after is not None else None
+                        self.send_json(request["status"], {"error": {"message": "stub failure", "type": "server_error"}}, headers)
+                        return
+                    time.sleep(stub.slow_delay if slow else stub.delay(prompt, attempt))
+                    completion = stub._completion(body, prompt)
+                    if body.get("stream"):
+                        self.stream(completion)
+                    else:
+                        self.send_json(200, completion)
+                finally:
+                    with stub._lock:
+                        request["end"] = time.perf_counter()
+                        stub.in_flight -= 1
+
+            def stream(self, completion: dict):
+                self.send_response(200)
+                self.send_header("content-type", "text/event-stream")
+                self.end_headers()
+                choice = completion["choices"][0]
+                content = choice["message"]["content"]
+
+                def send(choices: list, usage: Optional[dict] = None):
+                    chunk = {"id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"],
+                             "model": completion["model"], "choices": choices}
+                    if usage is not None:
+                        chunk["usage"] = usage
+                    self.wfile.write(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+                    self.wfile.flush()
+
+                try:
+                    send([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+                    for start in range(0, len(content), STREAM_CHUNK):
+                        send([{"index": 0, "delta": {"content": content[start:start + STREAM_CHUNK]}, "finish_reason": None}])
+                    send([{"index": 0, "delta": {}, "finish_reason": choice["finish_reason"]}])
+                    send([], completion["usage"])
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client stopped reading, e.g. the losing request of a hedge
+                    with stub._lock:
+                        stub.cancelled += 1
+
+        return Handler
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the OpenAI chat completions endpoint")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--fail", type=int, nargs="*", default=[], metavar="STATUS",
+                        help="fail the first requests for each prompt with these statuses, e.g. --fail 429 500")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds sent with failures")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before every answer")
+    parser.add_argument("--slow-share", type=float, default=0.0, help="share of requests that are slow")
+    parser.add_argument("--slow-delay", type=float, default=0.0, help="seconds a slow request takes")
+    parser.add_argument("--max-pages", type=int, default=None, help="truncate answers to prompts with more pages than this")
+    args = parser.parse_args()
+
+    stub = OpenAIStub(args.port, args.fail, args.retry_after, args.delay, args.slow_share, args.slow_delay, args.max_pages)
+    print(f"Serving a stub OpenAI endpoint at {stub.base_url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,115 @@
+import json
+import re
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from rule_parser import ANY_CAPTION, page_body_lines
+
+
+# a cheap local check that keeps pages with no results (cover pages, turnout/statistics pages, blank continuation
+# pages, certification and signature pages) away from the model - they come back with no Contest or Summary but
+# still cost a request's worth of tokens and latency.
+# Each page is scored on its text with the report header stripped:
+#   + an upper-case "... - Vote for One" contest header, the "Choice Party ..." column caption,
+#     the Cast Votes/Undervotes/Overvotes block, and the share of lines that are a name followed by numeric columns
+#   - keywords of pages that are about the election rather than its results (turnout, certification, ...)
+# and is only skipped when it scores below MIN_RESULT_SCORE, so a page with any sign of a contest on it is kept.
+# The rule parser's pages are results by definition, so only the pages bound for the model are classified.
+# A PDF the classifier gets wrong can be corrected in page_overrides.json, by file name, with 1-based page numbers:
+#   {"report.pdf": {"keep": [12], "skip": [1, 2]}, "odd-layout.pdf": {"classify": false}}
+
+PAGE_OVERRIDES = Path("page_overrides.json")
+MIN_RESULT_SCORE = 1.0
+
+VOTE_FOR_HEADER = re.compile(r"^[^a-z]*\bVote for\b", re.IGNORECASE)
+SUMMARY_LINE = re.compile(r"^(Cast Votes|Undervotes|Overvotes|Unresolved write-ins|Unqualified write-ins):", re.IGNORECASE)
+# a name (or label) followed by at least two numeric columns, with or without percentages
+NUMERIC_ROW = re.compile(r"^[^\d\s].*?(\s+[\d,]+(\.\d+)?%?){2,}\s*$")
+NON_RESULT_KEYWORDS = re.compile(
+    r"\b(voter turnout|turnout|statistics|table of contents|certificat(e|ion)|hereby certify|signature|"
+    r"intentionally left blank|ballots cast by precinct)\b", re.IGNORECASE)
+
+HEADER_WEIGHT = 3.0
+CAPTION_WEIGHT = 2.0
+SUMMARY_WEIGHT = 3.0
+ROW_DENSITY_WEIGHT = 4.0
+NON_RESULT_WEIGHT = 4.0
+
+
+class PageOverrides(BaseModel):
+    "Corrections for one PDF, with 1-based page numbers as in the logs"
+    keep: List[int] = []
+    skip: List[int] = []
+    classify: bool = True  # False sends every page to the model
+
+
+def load_page_overrides(pdf_path: Path, overrides_path: Optional[Path] = PAGE_OVERRIDES) -> Optional[PageOverrides]:
+    if overrides_path is None or not Path(overrides_path).exists():
+        return None
+    with open(overrides_path) as f:
+        overrides = json.load(f)
+    entry = overrides.get(Path(pdf_path).name)
+    return PageOverrides.model_validate(entry) if entry is not None else None
+
+
+def score_page(text: str) -> Tuple[float, List[str]]:
+    "(score, the features behind it) - pages scoring below MIN_RESULT_SCORE have no results on them"
+    lines = page_body_lines(text)
+    if not lines:
+        return 0.0, ["blank"]
+    score, features = 0.0, []
+    if any(VOTE_FOR_HEADER.match(line) for line in lines):
+        score += HEADER_WEIGHT
+        features.append("vote for header")
+    if any(ANY_CAPTION.match(line) for line in lines):
+        score += CAPTION_WEIGHT
+        features.append("column caption")
+    if any(SUMMARY_LINE.match(line) for line in lines):
+        score += SUMMARY_WEIGHT
+        features.append("summary rows")
+    numeric_rows = sum(1 for line in lines if NUMERIC_ROW.match(line))
+    score += ROW_DENSITY_WEIGHT * numeric_rows / len(lines)
+    features.append(f"{numeric_rows}/{len(lines)} numeric rows")
+    keyword = NON_RESULT_KEYWORDS.search("\n".join(lines))
+    if keyword is not None:
+        score -= NON_RESULT_WEIGHT
+        features.append(f"'{keyword.group(0)}'")
+    return score, features
+
+
+def skip_reason(page_num: int, text: str, overrides: Optional[PageOverrides] = None) -> Optional[str]:
+    "Why the page shouldn't go to the model, or None if it should"
+    if overrides is not None:
+        if page_num + 1 in overrides.keep or not overrides.classify:
+            return None
+        if page_num + 1 in overrides.skip:
+            return "skipped in page overrides"
+    score, features = score_page(text)
+    if score >= MIN_RESULT_SCORE:
+        return None
+    return f"score {score:.1f}: {', '.join(features)}"
+
+
+def iter_result_pages(pages: Iterable[Tuple[int, str]], overrides: Optional[PageOverrides] = None,
+                      on_skip: Optional[Callable[[int, str, str], None]] = None) -> Iterator[Tuple[int, str]]:
+    "The (page number, text) pairs worth sending to the model; on_skip gets (page number, text, reason) for the rest"
+    for page_num, text in pages:
+        reason = skip_reason(page_num, text, overrides)
+        if reason is None:
+            yield page_num, text
+        elif on_skip is not None:
+            on_skip(page_num, text, reason)
+
+
+def filter_result_pages(page_nums: List[int], page_texts: List[str],
+                        overrides: Optional[PageOverrides] = None) -> Tuple[List[int], Dict[int, str]]:
+    "(the pages worth sending to the model, {skipped page: reason})"
+    skipped: Dict[int, str] = {}
+
+    def skip(page_num: int, text: str, reason: str):
+        skipped[page_num] = reason
+
+    pages = ((page_num, page_texts[page_num]) for page_num in page_nums)
+    return [page_num for page_num, _ in iter_result_pages(pages, overrides, skip)], skipped
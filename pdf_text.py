@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pdfplumber
+
+
+# pdfplumber's layout analysis is CPU bound, so pages are spread across worker processes,
+# and the text is saved keyed by the PDF's content hash so a re-run never parses the same PDF twice
+
+PAGE_TEXT_CACHE = Path(".page_text_cache")
+
+# below this many pages the process pool costs more to start than it saves
+MIN_PAGES_FOR_POOL = 4
+# iter_page_texts reopens the PDF every this many pages, which also drops pdfminer's own object cache
+PAGES_PER_OPEN = 100
+
+
+def pdf_hash(pdf_path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+# worker: each process opens the PDF once and extracts a run of pages
+def extract_pages(pdf_path: Path, page_nums: List[int]) -> Dict[int, str]:
+    texts = {}
+    with pdfplumber.open(pdf_path) as pdf:
+        for page_num in page_nums:
+            page = pdf.pages[page_num]
+            texts[page_num] = page.extract_text() or ""
+            # pdfplumber keeps every page's chars and layout objects around until the page is closed
+            page.close()
+    return texts
+
+
+def page_count(pdf_path: Path) -> int:
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+
+def iter_page_texts(pdf_path: Path, pages_per_open: int = PAGES_PER_OPEN) -> Iterator[Tuple[int, str]]:
+    "(page number, text) one page at a time, for PDFs too big to hold - no process pool and no cache"
+    total = page_count(pdf_path)
+    for start in range(0, total, pages_per_open):
+        with pdfplumber.open(pdf_path, pages=range(start + 1, min(start + pages_per_open, total) + 1)) as pdf:
+            for page in pdf.pages:
+                text = page.extract_text() or ""
+                page.close()
+                yield page.page_number - 1, text
+
+
+def load_cached_pages(cache_path: Path) -> Dict[int, str]:
+    if not cache_path.exists():
+        return {}
+    with open(cache_path, encoding="utf-8") as f:
+        return {int(page_num): text for page_num, text in json.load(f).items()}
+
+
+def save_cached_pages(cache_path: Path, texts: Dict[int, str]):
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({str(page_num): text for page_num, text in sorted(texts.items())}, f)
+    os.replace(tmp_path, cache_path)
+
+
+def extract_page_texts(pdf_path: Path, max_workers: Optional[int] = None,
+                       cache_dir: Optional[Path] = PAGE_TEXT_CACHE) -> List[str]:
+    "Returns the text of every page in page order, using cached text where we have it"
+    total = page_count(pdf_path)
+
+    cache_path = cache_dir / f"{pdf_hash(pdf_path)}.json" if cache_dir is not None else None
+    texts = load_cached_pages(cache_path) if cache_path is not None else {}
+    missing = [page_num for page_num in range(total) if page_num not in texts]
+
+    if missing:
+        workers = min(max_workers or os.cpu_count() or 1, len(missing))
+        if workers <= 1 or len(missing) < MIN_PAGES_FOR_POOL:
+            texts.update(extract_pages(pdf_path, missing))
+        else:
+            # one contiguous run of pages per worker, so each worker opens the PDF only once
+            chunk_size = -(-len(missing) // workers)
+            chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for chunk_texts in executor.map(extract_pages, [pdf_path] * len(chunks), chunks):
+                    texts.update(chunk_texts)
+        print(f"Extracted text from {len(missing)} of {total} pages ({total - len(missing)} cached)")
+        if cache_path is not None:
+            save_cached_pages(cache_path, texts)
+
+    return [texts[page_num] for page_num in range(total)]
@@ -0,0 +1,84 @@
+import re
+from collections import Counter
+from typing import List, Tuple
+
+from token_budget import count_tokens
+
+
+# every page of a results report starts with the same header block (report title, registered voters, election name,
+# precincts reporting, run date/time, page number) - about a fifth of a page's tokens, none of it results.
+# The header (and a footer, if the layout has one) is found by position: line i is boilerplate if the same line,
+# with its digits ignored, is line i on most pages. It is kept on the first page only.
+# Everything in the body stays, including the "Choice Party ..." captions - they tell the model which column is
+# which, and that differs between layouts. Runs of spaces and tabs (table padding) collapse to one space.
+
+DIGITS = re.compile(r"\d+")
+PADDING = re.compile(r"[ \t ]+")
+# never treat a result line as boilerplate, however often its shape repeats
+RESULT_LINE = re.compile(r"vote for|^(cast votes|undervotes|overvotes|unqualified write-ins|unresolved write-ins):|(%.*){3}",
+                         re.IGNORECASE)
+
+# share of pages a line has to be repeated on (at the same position) to count as boilerplate
+MIN_SHARE = 0.6
+# a header or footer block longer than this is more likely a run of similar result rows
+MAX_BLOCK_LINES = 15
+
+
+def clean_lines(text: str) -> List[str]:
+    lines = (PADDING.sub(" ", line).strip() for line in (text or "").splitlines())
+    return [line for line in lines if line]
+
+
+def line_shape(line: str) -> str:
+    # "Run Date 11/08/2024 Page 2" and "Run Date 11/08/2024 Page 3" are the same line
+    return DIGITS.sub("#", line)
+
+
+def repeated_block(pages_lines: List[List[str]], from_end: bool, min_share: float) -> List[str]:
+    "The shapes of the lines that start (or end) most pages"
+    shapes = []
+    needed = max(2, min_share * len(pages_lines))
+    for i in range(MAX_BLOCK_LINES):
+        position = -1 - i if from_end else i
+        counts = Counter(line_shape(lines[position]) for lines in pages_lines if len(lines) > i)
+        if not counts:
+            break
+        shape, count = counts.most_common(1)[0]
+        if count < needed or RESULT_LINE.search(shape):
+            break
+        shapes.append(shape)
+    return shapes
+
+
+def _strip_block(lines: List[str], shapes: List[str], from_end: bool) -> List[str]:
+    n = 0
+    while n < len(shapes) and n < len(lines) and line_shape(lines[-1 - n if from_end else n]) == shapes[n]:
+        n += 1
+    if n == len(lines):
+        return lines  # the whole page looks like boilerplate - leave it alone rather than send nothing
+    return lines[:len(lines) - n] if from_end else lines[n:]
+
+
+def compact_pages(page_texts: List[str], min_share: float = MIN_SHARE) -> List[str]:
+    "Page texts without the repeated header/footer blocks (except on the first page) and without table padding"
+    pages_lines = [clean_lines(text) for text in page_texts]
+    header: List[str] = []
+    footer: List[str] = []
+    if len(pages_lines) > 1:
+        header = repeated_block(pages_lines, False, min_share)
+        footer = repeated_block(pages_lines, True, min_share)
+
+    compacted = []
+    for page_num, lines in enumerate(pages_lines):
+        if page_num > 0:
+            lines = _strip_block(_strip_block(lines, header, False), footer, True)
+        # a trailing newline, so pages joined into a batch don't run their last and first lines together
+        compacted.append("\n".join(lines) + "\n" if lines else "")
+    return compacted
+
+
+def batch_token_reduction(pages: List[int], page_texts: List[str], compacted_texts: List[str]) -> Tuple[int, int]:
+    "(tokens before, tokens after) compaction for one batch of pages"
+    before = count_tokens("".join(page_texts[page_num] for page_num in pages))
+    after = count_tokens("".join(compacted_texts[page_num] for page_num in pages))
+    return before, after
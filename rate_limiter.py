@@ -0,0 +1,61 @@
+import multiprocessing
+import time
+from typing import Optional
+
+
+# one requests-per-minute and tokens-per-minute budget shared by every worker process (and every thread in them),
+# so running several PDFs at once can't add up to more than the account's quota.
+# Two token buckets that refill continuously; their state lives in shared memory guarded by one lock.
+
+class RateLimiter:
+    "Token buckets for RPM/TPM that can be handed to worker processes (pass it in the pool's initargs)"
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._lock = multiprocessing.Lock()
+        # start full, like the API does
+        self._requests = multiprocessing.Value("d", float(requests_per_minute), lock=False)
+        self._tokens = multiprocessing.Value("d", float(tokens_per_minute), lock=False)
+        self._updated = multiprocessing.Value("d", time.monotonic(), lock=False)
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated.value
+        self._updated.value = now
+        self._requests.value = min(self.requests_per_minute, self._requests.value + elapsed * self.requests_per_minute / 60)
+        self._tokens.value = min(self.tokens_per_minute, self._tokens.value + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens: int) -> float:
+        "Blocks until one request and `tokens` tokens fit in the budget, returns how long we waited"
+        # a request bigger than the whole per-minute budget would never fit, let it through once the bucket is full
+        tokens = min(tokens, self.tokens_per_minute)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._requests.value >= 1 and self._tokens.value >= tokens:
+                    self._requests.value -= 1
+                    self._tokens.value -= tokens
+                    return waited
+                wait = max((1 - self._requests.value) * 60 / self.requests_per_minute,
+                           (tokens - self._tokens.value) * 60 / self.tokens_per_minute)
+            # sleep outside the lock so other workers can check the buckets too
+            time.sleep(wait)
+            waited += wait
+
+
+# the limiter for this process - None means no limit (a single script run relies on the retry backoff instead)
+_limiter: Optional[RateLimiter] = None
+
+
+def install(limiter: Optional[RateLimiter]):
+    "Sets this process's limiter; use as a ProcessPoolExecutor initializer"
+    global _limiter
+    _limiter = limiter
+
+
+def acquire(tokens: int) -> float:
+    if _limiter is None:
+        return 0.0
+    return _limiter.acquire(tokens)
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from pdf_text import pdf_hash
+
+
+# on election night the county re-posts its result PDFs every few minutes, most of the time unchanged.
+# The watcher polls local directories/files and HTTP(S) URLs, and runs the pipeline only for reports whose
+# content actually changed:
+#   - files are only hashed when their size or mtime changed, so an idle directory costs a stat() per file
+#   - URLs are fetched with If-None-Match/If-Modified-Since, so an unchanged report is a 304 with no body;
+#     when the server doesn't send validators (or re-posts the same bytes) the content hash decides
+# What was last processed is kept in a state file, and only updated once the pipeline succeeded, so a failed
+# run is retried on the next poll and a restarted watcher doesn't redo everything.
+# Each source keeps its results (and incremental state) in its own directory, <name>-<hash of the source>,
+# so two URLs that both end in "results.pdf" never share one.
+# To try it against a local stand-in, serve the bundled PDFs with `python -m http.server 8000` (it answers
+# If-Modified-Since with 304) and watch http://127.0.0.1:8000/Fall-2024-first-post-report.pdf
+# (tests/test_report_watcher.py does the same with two versions of a report and the stub model, see openai_stub)
+
+DEFAULT_INTERVAL = 120.0  # seconds between polls
+WATCH_STATE = Path(".watch_state.json")
+DOWNLOAD_DIR = Path("watched_reports")
+FETCH_TIMEOUT = 60.0
+
+
+def is_url(source: str) -> bool:
+    return urllib.parse.urlparse(source).scheme in ("http", "https")
+
+
+def load_watch_state(state_path: Path) -> Dict[str, dict]:
+    if not state_path.exists():
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def save_watch_state(state_path: Path, state: Dict[str, dict]):
+    tmp_path = state_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def expand_sources(sources: Sequence[str]) -> List[str]:
+    "URLs as they are, directories as the PDFs in them right now - so a newly posted report is picked up"
+    expanded = []
+    for source in sources:
+        if not is_url(source) and Path(source).is_dir():
+            expanded.extend(str(path.resolve()) for path in sorted(Path(source).glob("*.pdf")))
+        else:
+            expanded.append(source if is_url(source) else str(Path(source).resolve()))
+    return list(dict.fromkeys(expanded))
+
+
+def check_file(path: Path, entry: dict) -> Tuple[Optional[Path], dict]:
+    "(the file if its content changed, else None; the updated state entry)"
+    stat = path.stat()
+    if entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+        return None, entry
+    entry = {**entry, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    digest = pdf_hash(path)
+    if entry.get("sha256") == digest:
+        return None, entry  # touched or copied over, but the same bytes
+    return path, {**entry, "sha256": digest}
+
+
+def source_key(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+
+
+def download_path(url: str, download_dir: Path) -> Path:
+    # the file keeps its posted name, in a directory per URL so two counties' "results.pdf" don't collide
+    name = Path(urllib.parse.unquote(urllib.parse.urlparse(url).path)).name or "report.pdf"
+    return download_dir / source_key(url) / name
+
+
+def report_dir(output_dir: Path, source: str, pdf_path: Path) -> Path:
+    return output_dir / f"{pdf_path.stem}-{source_key(source)}"
+
+
+def check_url(url: str, entry: dict, download_dir: Path = DOWNLOAD_DIR,
+              timeout: float = FETCH_TIMEOUT) -> Tuple[Optional[Path], dict]:
+    "(the downloaded report if its content changed, else None; the updated state entry)"
+    request = urllib.request.Request(url)
+    if entry.get("etag"):
+        request.add_header("If-None-Match", entry["etag"])
+    if entry.get("last_modified"):
+        request.add_header("If-Modified-Since", entry["last_modified"])
+
+    path = download_path(url, download_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    hasher = hashlib.sha256()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response, open(tmp_path, "wb") as f:
+            for block in iter(lambda: response.read(1024 * 1024), b""):
+                hasher.update(block)
+                f.write(block)
+            etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+    except urllib.error.HTTPError as err:
+        tmp_path.unlink(missing_ok=True)
+        if err.code == 304:
+            return None, entry
+        raise
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    entry = {**entry, "etag": etag, "last_modified": last_modified}
+    digest = hasher.hexdigest()
+    if entry.get("sha256") == digest and path.exists():
+        tmp_path.unlink()
+        return None, entry
+    os.replace(tmp_path, path)
+    return path, {**entry, "sha256": digest}
+
+
+def poll(sources: Sequence[str], state: Dict[str, dict], on_change: Callable[[str, Path], None],
+         download_dir: Path = DOWNLOAD_DIR, state_path: Optional[Path] = WATCH_STATE) -> List[Path]:
+    "Checks every source once and runs on_change(source, report) for each changed report; returns the reports it ran"
+    processed = []
+    for source in expand_sources(sources):
+        entry = state.get(source, {})
+        try:
+            if is_url(source):
+                changed, entry = check_url(source, entry, download_dir)
+            else:
+                changed, entry = check_file(Path(source), entry)
+        except (OSError, urllib.error.URLError) as err:
+            # the county site being down for a minute is normal on election night
+            print(f"watch: could not check {source}: {err}")
+            continue
+
+        if changed is not None:
+            print(f"watch: {source} changed, running the pipeline")
+            try:
+                on_change(source, changed)
+            except Exception as err:
+                # keep the old state, so the next poll tries this report again
+                print(f"watch: pipeline failed for {source} with {type(err).__name__}: {err}")
+                continue
+            processed.append(changed)
+        # validators for a 304, or a new mtime for a touched file, are worth keeping even when nothing ran
+        state[source] = entry
+        if state_path is not None:
+            save_watch_state(state_path, state)
+    return processed
+
+
+def watch(sources: Sequence[str], on_change: Callable[[str, Path], None], interval: float = DEFAULT_INTERVAL,
+          state_path: Optional[Path] = WATCH_STATE, download_dir: Path = DOWNLOAD_DIR,
+          max_polls: Optional[int] = None):
+    "Polls until interrupted (or for max_polls polls)"
+    state = load_watch_state(state_path) if state_path is not None else {}
+    polls = 0
+    while True:
+        start = time.monotonic()
+        processed = poll(sources, state, on_change, download_dir, state_path)
+        polls += 1
+        print(f"watch: poll {polls} took {time.monotonic() - start:.1f}s, {len(processed)} reports changed")
+        if max_polls is not None and polls >= max_polls:
+            return
+        time.sleep(interval)
+
+
+def incremental_updater(output_dir: Path, api_key: str, results_db_path: Optional[Path] = None,
+                        **options) -> Callable[[str, Path], None]:
+    "An on_change that runs incremental_update for the report; options go to incremental_update.main"
+    import incremental_update
+    from extraction_metrics import ExtractionMetrics
+
+    # each report keeps its own cumulative result and page fingerprints, so a re-post only re-extracts changed pages
+    def update_results(source: str, pdf_path: Path):
+        results_dir = report_dir(output_dir, source, pdf_path)
+        results_dir.mkdir(parents=True, exist_ok=True)
+        incremental_update.main(pdf_path, api_key, results_dir / "election_data_cumulative.json",
+                                metrics=ExtractionMetrics(results_dir / "metrics.jsonl"), results_db_path=results_db_path,
+                                **options)
+
+    return update_results
+
+
+if __name__ == "__main__":
+
+    import argparse
+    from dotenv import load_dotenv
+    load_dotenv() # make sure our environment variables are loaded
+
+    from extraction_backends import BACKENDS, get_backend
+    from extraction_cache import ExtractionCache
+
+    parser = argparse.ArgumentParser(description="Watch for new versions of result PDFs and extract the ones that changed")
+    parser.add_argument("sources", nargs="+", help="PDF files, directories of PDFs, or http(s) URLs of PDFs")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="seconds between polls")
+    parser.add_argument("--output-dir", type=Path, default=Path("results"))
+    parser.add_argument("--state", type=Path, default=WATCH_STATE, help="where to remember what was already processed")
+    parser.add_argument("--once", action="store_true", help="poll once and exit")
+    parser.add_argument("--backend", choices=list(BACKENDS), default="structured")
+    parser.add_argument("--db", type=Path, default=None, metavar="PATH",
+                        help="store every changed version in this results database, to compare updates (see results_db)")
+    args = parser.parse_args()
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("API key not found")
+    base_url = os.getenv("OPENAI_BASE_URL")
+    max_concurrency = int(os.getenv("MAX_CONCURRENCY", "4"))
+    update_results = incremental_updater(args.output_dir, api_key, args.db, max_concurrency=max_concurrency,
+                                         base_url=base_url, cache=ExtractionCache(),
+                                         backend=get_backend(args.backend, api_key, base_url))
+
+    try:
+        watch(args.sources, update_results, args.interval, args.state, max_polls=1 if args.once else None)
+    except KeyboardInterrupt:
+        print("watch: stopped")
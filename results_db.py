@@ -0,0 +1,331 @@
+import csv
+import re
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from pydantic import BaseModel
+
+from extraction_models import Choice, Contest, Summary, ElectionData
+from election_store import SUMMARY_VOTE_FIELDS, normalize_choice_name, normalize_contest_name
+from pdf_text import pdf_hash
+
+
+# every report ever extracted, in one SQLite file, instead of loose JSON/CSV files that each run overwrites.
+# A report is one posted version of one jurisdiction's results for one election, e.g. Humboldt County's
+# first post for the 2024-03-05 primary, run at 2024-03-07T09:52. Contests and choices are stored under their
+# normalized names, so the same contest lines up across updates and elections however the model spelled it.
+#   reports    (election, jurisdiction, version) -> id       unique, one row per posted version
+#   contests   (report, contest key) -> name, position
+#   choices    (report, contest key, choice key) -> votes     indexed by (contest key, choice key) for cross-report queries
+#   summaries  (report, contest key) -> under/overvotes, write-ins
+# Loading a report is one transaction of executemany upserts, and loading many is still one transaction.
+# Versions are ISO timestamps, so ordering by version is ordering by when the county ran the report.
+#   python results_db.py load results/*/election_data.json --pdf-dir past_elections/   # files from earlier runs
+#   python results_db.py history "PRESIDENT - Democratic" --choice "Joseph R Biden Jr"
+#   python results_db.py deltas 2024-03-05 --output deltas.csv
+
+RESULTS_DB = Path("results.sqlite")
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY,
+    election TEXT NOT NULL,
+    jurisdiction TEXT NOT NULL DEFAULT '',
+    version TEXT NOT NULL,
+    title TEXT,
+    source TEXT,
+    loaded_at TEXT NOT NULL,
+    UNIQUE (election, jurisdiction, version)
+);
+CREATE TABLE IF NOT EXISTS contests (
+    report_id INTEGER NOT NULL REFERENCES reports (id) ON DELETE CASCADE,
+    contest_key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (report_id, contest_key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS choices (
+    report_id INTEGER NOT NULL REFERENCES reports (id) ON DELETE CASCADE,
+    contest_key TEXT NOT NULL,
+    choice_key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    party TEXT,
+    writein INTEGER NOT NULL,
+    vote_in_center INTEGER NOT NULL,
+    vote_by_mail INTEGER NOT NULL,
+    vote_total INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (report_id, contest_key, choice_key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS summaries (
+    report_id INTEGER NOT NULL REFERENCES reports (id) ON DELETE CASCADE,
+    contest_key TEXT NOT NULL,
+    contest TEXT NOT NULL,
+    {", ".join(f"{field} INTEGER NOT NULL" for field in SUMMARY_VOTE_FIELDS)},
+    position INTEGER NOT NULL,
+    PRIMARY KEY (report_id, contest_key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS choices_by_contest ON choices (contest_key, choice_key, report_id);
+CREATE INDEX IF NOT EXISTS contests_by_key ON contests (contest_key, report_id);
+CREATE INDEX IF NOT EXISTS summaries_by_contest ON summaries (contest_key, report_id);
+"""
+
+# the report header every page starts with, e.g.
+#   First Post Election Update Humboldt County Unofficial Results ... 3/5/2024 / Run Time 9:52 AM / Run Date 03/07/2024 Page 1
+# the title ends in one of these words, or else the jurisdiction is taken to be one word before "County"
+REPORT_TITLES = [re.compile(r"^(?P<title>.*\b(?:Report|Update|Cumulative|Canvass))\s+(?P<jurisdiction>.+? County)\b", re.MULTILINE),
+                 re.compile(r"^(?P<title>.+?)\s+(?P<jurisdiction>\w+ County)\b", re.MULTILINE)]
+ELECTION_DATE = re.compile(r"^(?P<date>\d{1,2}/\d{1,2}/\d{4})\s*$", re.MULTILINE)
+RUN_TIME = re.compile(r"^Run Time (?P<time>\d{1,2}:\d{2} [AP]M)\s*$", re.MULTILINE)
+RUN_DATE = re.compile(r"^Run Date (?P<date>\d{1,2}/\d{1,2}/\d{4})\b", re.MULTILINE)
+
+
+class ReportIdentity(BaseModel):
+    "Which report a result is: election (ISO date), jurisdiction, and version (ISO time the report was run)"
+    election: str
+    jurisdiction: str = ""
+    version: str
+    title: Optional[str] = None
+
+
+def report_identity(first_page_text: str) -> Optional[ReportIdentity]:
+    "Read from the report header, None if the header isn't in the layout we know"
+    election_date = ELECTION_DATE.search(first_page_text)
+    run_date = RUN_DATE.search(first_page_text)
+    if election_date is None or run_date is None:
+        return None
+    run_time = RUN_TIME.search(first_page_text)
+    run = datetime.strptime(f"{run_date['date']} {run_time['time'] if run_time else '12:00 AM'}", "%m/%d/%Y %I:%M %p")
+    title = next(filter(None, (pattern.search(first_page_text) for pattern in REPORT_TITLES)), None)
+    return ReportIdentity(election=datetime.strptime(election_date["date"], "%m/%d/%Y").date().isoformat(),
+                          jurisdiction=title["jurisdiction"] if title else "", version=run.isoformat(timespec="minutes"),
+                          title=title["title"] if title else None)
+
+
+def identify_report(pdf_path: Path, first_page_text: str) -> ReportIdentity:
+    # a PDF without the usual header is still one report: its name is the election and its content the version
+    identity = report_identity(first_page_text)
+    if identity is None:
+        identity = ReportIdentity(election=Path(pdf_path).stem, version=pdf_hash(pdf_path)[:12])
+    return identity
+
+
+class ResultsDatabase:
+    "Historical results; load reports with upsert/upsert_many, query them across updates and elections"
+
+    def __init__(self, path: Path = RESULTS_DB, timeout: float = 30.0):
+        self.path = Path(path)
+        # batch_runner's workers can all write to the same file; WAL lets readers go on while one of them writes
+        self.connection = sqlite3.connect(self.path, timeout=timeout)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self) -> "ResultsDatabase":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _upsert(self, identity: ReportIdentity, data: ElectionData, source: Optional[str], replace: bool) -> int:
+        report_id = self.connection.execute(
+            "INSERT INTO reports (election, jurisdiction, version, title, source, loaded_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (election, jurisdiction, version) DO UPDATE SET "
+            "title = coalesce(excluded.title, title), source = coalesce(excluded.source, source), loaded_at = excluded.loaded_at "
+            "RETURNING id",
+            (identity.election, identity.jurisdiction, identity.version, identity.title, source,
+             datetime.now().isoformat(timespec="seconds"))).fetchone()[0]
+        if replace:
+            # the report is exactly this data now, contests that are gone from it go from the database too
+            for table in ("choices", "contests", "summaries"):
+                self.connection.execute(f"DELETE FROM {table} WHERE report_id = ?", (report_id,))
+
+        self.connection.executemany(
+            "INSERT INTO contests (report_id, contest_key, name, position) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (report_id, contest_key) DO UPDATE SET name = excluded.name",
+            [(report_id, normalize_contest_name(contest.name), contest.name, position)
+             for position, contest in enumerate(data.contests)])
+        self.connection.executemany(
+            "INSERT INTO choices (report_id, contest_key, choice_key, name, party, writein, vote_in_center, vote_by_mail, "
+            "vote_total, position) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (report_id, contest_key, choice_key) DO UPDATE SET name = excluded.name, party = excluded.party, "
+            "writein = excluded.writein, vote_in_center = excluded.vote_in_center, vote_by_mail = excluded.vote_by_mail, "
+            "vote_total = excluded.vote_total",
+            [(report_id, normalize_contest_name(contest.name), normalize_choice_name(choice.name), choice.name, choice.party,
+              choice.writein, choice.vote_in_center, choice.vote_by_mail, choice.vote_total, position)
+             for contest in data.contests for position, choice in enumerate(contest.choices)])
+        self.connection.executemany(
+            f"INSERT INTO summaries (report_id, contest_key, contest, {', '.join(SUMMARY_VOTE_FIELDS)}, position) "
+            f"VALUES (?, ?, ?, {', '.join('?' for _ in SUMMARY_VOTE_FIELDS)}, ?) "
+            f"ON CONFLICT (report_id, contest_key) DO UPDATE SET contest = excluded.contest, "
+            + ", ".join(f"{field} = excluded.{field}" for field in SUMMARY_VOTE_FIELDS),
+            [(report_id, normalize_contest_name(summary.contest), summary.contest,
+              *(getattr(summary, field) for field in SUMMARY_VOTE_FIELDS), position)
+             for position, summary in enumerate(data.summary)])
+        return report_id
+
+    def upsert(self, identity: ReportIdentity, data: ElectionData, source: Optional[str] = None,
+               replace: bool = True) -> int:
+        """Stores a report, returning its id. With replace (the default) the report ends up holding exactly data;
+        without it, data's contests/choices/summaries are added to or update the stored ones, e.g. for a patch"""
+        with self.connection:
+            return self._upsert(identity, data, source, replace)
+
+    def upsert_many(self, reports: Iterable[Tuple[ReportIdentity, ElectionData, Optional[str]]],
+                    replace: bool = True) -> List[int]:
+        "Stores (identity, data, source) reports in a single transaction"
+        with self.connection:
+            return [self._upsert(identity, data, source, replace) for identity, data, source in reports]
+
+    def reports(self, election: Optional[str] = None) -> List[dict]:
+        rows = self.connection.execute(
+            "SELECT r.*, (SELECT count(*) FROM contests c WHERE c.report_id = r.id) AS contests FROM reports r "
+            "WHERE ? IS NULL OR r.election = ? ORDER BY r.election, r.jurisdiction, r.version", (election, election))
+        return [dict(row) for row in rows]
+
+    def report_data(self, report_id: int) -> ElectionData:
+        "A stored report as ElectionData again"
+        contests = {row["contest_key"]: Contest(name=row["name"], choices=[]) for row in self.connection.execute(
+            "SELECT contest_key, name FROM contests WHERE report_id = ? ORDER BY position", (report_id,))}
+        for row in self.connection.execute(
+                "SELECT * FROM choices WHERE report_id = ? ORDER BY contest_key, position", (report_id,)):
+            if row["contest_key"] in contests:
+                contests[row["contest_key"]].choices.append(Choice(
+                    name=row["name"], party=row["party"], writein=bool(row["writein"]), vote_in_center=row["vote_in_center"],
+                    vote_by_mail=row["vote_by_mail"], vote_total=row["vote_total"]))
+        summaries = [Summary(contest=row["contest"], **{field: row[field] for field in SUMMARY_VOTE_FIELDS})
+                     for row in self.connection.execute("SELECT * FROM summaries WHERE report_id = ? ORDER BY position", (report_id,))]
+        return ElectionData(contests=list(contests.values()), summary=summaries)
+
+    def choice_history(self, contest: str, choice: Optional[str] = None, election: Optional[str] = None,
+                       jurisdiction: Optional[str] = None) -> List[dict]:
+        "Votes for every choice (or one) in a contest, in every stored report, oldest first"
+        choice_key = normalize_choice_name(choice) if choice is not None else None
+        rows = self.connection.execute(
+            "SELECT r.election, r.jurisdiction, r.version, ct.name AS contest, c.name AS choice, c.party, "
+            "c.vote_in_center, c.vote_by_mail, c.vote_total "
+            "FROM choices c JOIN reports r ON r.id = c.report_id "
+            "JOIN contests ct ON ct.report_id = c.report_id AND ct.contest_key = c.contest_key "
+            "WHERE c.contest_key = ? AND (? IS NULL OR c.choice_key = ?) "
+            "AND (? IS NULL OR r.election = ?) AND (? IS NULL OR r.jurisdiction = ?) "
+            "ORDER BY r.election, r.jurisdiction, r.version, c.position",
+            (normalize_contest_name(contest), choice_key, choice_key, election, election, jurisdiction, jurisdiction))
+        return [dict(row) for row in rows]
+
+    def deltas(self, election: str, jurisdiction: Optional[str] = None, version: Optional[str] = None) -> List[dict]:
+        """How every choice's votes changed from each report to the next one of the same election and jurisdiction -
+        or only into the given version. previous_version is None for a choice's first report"""
+        rows = self.connection.execute(
+            "SELECT * FROM ("
+            " SELECT r.election, r.jurisdiction, lag(r.version) OVER w AS previous_version, r.version, "
+            " ct.name AS contest, c.name AS choice, c.party, c.vote_in_center, c.vote_by_mail, c.vote_total, "
+            " c.vote_in_center - lag(c.vote_in_center) OVER w AS vote_in_center_delta, "
+            " c.vote_by_mail - lag(c.vote_by_mail) OVER w AS vote_by_mail_delta, "
+            " c.vote_total - lag(c.vote_total) OVER w AS vote_total_delta, ct.position AS contest_position, c.position "
+            " FROM choices c JOIN reports r ON r.id = c.report_id "
+            " JOIN contests ct ON ct.report_id = c.report_id AND ct.contest_key = c.contest_key "
+            " WHERE r.election = ? AND (? IS NULL OR r.jurisdiction = ?) "
+            " WINDOW w AS (PARTITION BY r.jurisdiction, c.contest_key, c.choice_key ORDER BY r.version)"
+            ") WHERE ? IS NULL OR version = ? "
+            "ORDER BY jurisdiction, version, contest_position, position",
+            (election, jurisdiction, jurisdiction, version, version))
+        return [{key: row[key] for key in row.keys() if key not in ("contest_position", "position")} for row in rows]
+
+    def export_deltas(self, path: Path, election: str, jurisdiction: Optional[str] = None,
+                      version: Optional[str] = None) -> int:
+        "Writes deltas() to a CSV file, returning the number of rows"
+        rows = self.deltas(election, jurisdiction, version)
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            if rows:
+                writer.writerow(rows[0].keys())
+            writer.writerows(row.values() for row in rows)
+        return len(rows)
+
+
+def store_results(db_path: Path, pdf_path: Path, first_page_text: str, data: ElectionData) -> ReportIdentity:
+    "What the pipelines call once a PDF's results are final"
+    identity = identify_report(pdf_path, first_page_text)
+    with ResultsDatabase(db_path) as db:
+        db.upsert(identity, data, str(pdf_path))
+    print(f"Stored {len(data.contests)} contests as {identity.jurisdiction or identity.election} "
+          f"{identity.election} version {identity.version} in {db_path}")
+    return identity
+
+
+def print_rows(rows: Sequence[dict]):
+    if not rows:
+        print("no results")
+        return
+    columns = list(rows[0])
+    widths = [max(len(str(column)), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  ".join(str(column).ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+if __name__ == "__main__":
+
+    import argparse
+    from pdf_text import extract_page_texts
+
+    parser = argparse.ArgumentParser(description="Historical results database: load extracted results, query them across reports")
+    parser.add_argument("--db", type=Path, default=RESULTS_DB)
+    commands = parser.add_subparsers(dest="command", required=True)
+    load_parser = commands.add_parser("load", help="load ElectionData JSON files from earlier runs")
+    load_parser.add_argument("results", nargs="+", type=Path, help="ElectionData JSON files")
+    load_parser.add_argument("--pdf", type=Path, help="the PDF the results came from, to read which report they are")
+    load_parser.add_argument("--pdf-dir", type=Path,
+                             help="for results/<name>/election_data.json files, the directory with <name>.pdf")
+    load_parser.add_argument("--election", help="instead of reading it from the PDF")
+    load_parser.add_argument("--jurisdiction", default="")
+    load_parser.add_argument("--version", help="instead of reading it from the PDF")
+    commands.add_parser("reports", help="list the stored reports")
+    history_parser = commands.add_parser("history", help="votes for a contest's choices across every stored report")
+    history_parser.add_argument("contest")
+    history_parser.add_argument("--choice")
+    history_parser.add_argument("--election")
+    deltas_parser = commands.add_parser("deltas", help="vote changes between consecutive reports of an election")
+    deltas_parser.add_argument("election", help="the election date, e.g. 2024-03-05")
+    deltas_parser.add_argument("--jurisdiction")
+    deltas_parser.add_argument("--version", help="only the changes into this version")
+    deltas_parser.add_argument("--output", type=Path, help="write CSV here instead of printing")
+    args = parser.parse_args()
+
+    with ResultsDatabase(args.db) as db:
+        start = time.perf_counter()
+        if args.command == "load":
+            def identity_for(results_path: Path) -> Tuple[ReportIdentity, Optional[Path]]:
+                if args.election and args.version:
+                    return ReportIdentity(election=args.election, jurisdiction=args.jurisdiction, version=args.version), args.pdf
+                pdf_path = args.pdf or (args.pdf_dir / f"{results_path.parent.name}.pdf" if args.pdf_dir else None)
+                if pdf_path is None:
+                    raise ValueError(f"{results_path}: give --pdf/--pdf-dir, or --election and --version")
+                # the page text cache makes this a read of one small file for a PDF that was extracted before
+                return identify_report(pdf_path, extract_page_texts(pdf_path)[0]), pdf_path
+
+            reports = []
+            for results_path in args.results:
+                identity, pdf_path = identity_for(results_path)
+                data = ElectionData.model_validate_json(results_path.read_text())
+                reports.append((identity, data, str(pdf_path or results_path)))
+                print(f"{results_path}: {identity.jurisdiction} {identity.election} version {identity.version}, "
+                      f"{len(data.contests)} contests")
+            db.upsert_many(reports)
+        elif args.command == "reports":
+            print_rows(db.reports())
+        elif args.command == "history":
+            print_rows(db.choice_history(args.contest, args.choice, args.election))
+        elif args.output:
+            print(f"{db.export_deltas(args.output, args.election, args.jurisdiction, args.version)} rows written to {args.output}")
+        else:
+            print_rows(db.deltas(args.election, args.jurisdiction, args.version))
+        print(f"{args.command} took {(time.perf_counter() - start) * 1000:.1f}ms")
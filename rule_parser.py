@@ -0,0 +1,213 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+from extraction_models import Choice, Contest, Summary, ElectionData
+
+
+# deterministic fast path for the regular county report layout:
+#
+#   PRESIDENT - Democratic - Vote for One                 <- upper case contest header (may wrap onto 2 lines)
+#   Precincts Voters / Counted Total ... / 107 107 ...    <- optional turnout block (Fall 2024 layout)
+#   Choice Party Vote Center Vote-by-Mail Total           <- column caption
+#   Joseph R Biden Jr DEM 1,185 79.74% 16,063 88.51% 17,248 87.84%
+#   James Mark Merts (W) 0 0.00% 0 0.00% 0 0.00%
+#   Cast Votes: 1,486 100.00% 18,149 100.00% 19,635 100.00%
+#   Undervotes: 78 1,022 1,100
+#   Overvotes: 0 1 1
+#   Unqualified write-ins: 151 1,122 1,273
+#
+# a page is only accepted if every contest on it is complete and its arithmetic checks out,
+# anything else (other column layouts, contests split across pages, odd rows) goes to the LLM
+
+# every page starts with a report header (run time, turnout, "Run Date ... Page N", sometimes a paper sheet count)
+HEADER_END = re.compile(r"^Run Date .*Page \d+\s*$")
+LONE_NUMBER = re.compile(r"^[\d,]+$")
+CAPTION = re.compile(r"^Choice Party Vote Center Vote[- ]by[- ]Mail Total$", re.IGNORECASE)
+ANY_CAPTION = re.compile(r"^Choice Party\b", re.IGNORECASE)
+CHOICE_ROW = re.compile(
+    r"^(?P<name>.+?)\s+(?P<center>[\d,]+)\s+[\d.]+%\s+(?P<mail>[\d,]+)\s+[\d.]+%\s+(?P<total>[\d,]+)\s+[\d.]+%$")
+CAST_VOTES = re.compile(r"^Cast Votes:\s+(?P<center>[\d,]+)\s+[\d.]+%\s+(?P<mail>[\d,]+)\s+[\d.]+%\s+(?P<total>[\d,]+)\s+[\d.]+%$")
+SUMMARY_ROW = re.compile(
+    r"^(?P<label>Undervotes|Overvotes|Unresolved write-ins|Unqualified write-ins):\s+(?P<center>[\d,]+)\s+(?P<mail>[\d,]+)\s+(?P<total>[\d,]+)$",
+    re.IGNORECASE)
+TURNOUT_BLOCK = re.compile(r"^(Precincts Voters|Counted Total Percent Ballots Registered Percent|[\d,.%\s]+)$")
+VOTE_FOR = re.compile(r"\s*[-.,]?\s*Vote for\b.*$", re.IGNORECASE)
+END_OF_REPORT = re.compile(r"^\*+ End of report \*+$", re.IGNORECASE)
+# a page that opens with a choice row (votes and percentages) or the undervote/overvote block is
+# the tail of a contest that started on the previous page
+CONTINUATION = re.compile(r"\d+\.\d+%|^(Cast Votes|Undervotes|Overvotes|Unqualified|Unresolved)", re.IGNORECASE)
+
+KNOWN_PARTIES = {"DEM", "REP", "AIP", "GRN", "LIB", "PF", "PAF", "NPP"}
+SUMMARY_FIELDS = {
+    "undervotes": "undervotes",
+    "overvotes": "overvotes",
+    "unresolved write-ins": "unresolved_write_ins",
+    "unqualified write-ins": "unqualified_write_ins",
+}
+
+
+class UnparseableContest(Exception):
+    "Raised when the text does not look exactly like the layout this parser understands"
+
+
+# the lines of a page with the report header stripped off
+def page_body_lines(text: str) -> List[str]:
+    lines = [line.strip() for line in (text or "").splitlines() if line.strip()]
+    for i, line in enumerate(lines[:20]):
+        if HEADER_END.match(line):
+            body = lines[i + 1:]
+            while body and LONE_NUMBER.match(body[0]):
+                body = body[1:]
+            return body
+    return lines
+
+
+def continues_previous_page(text: str) -> bool:
+    body = page_body_lines(text)
+    return bool(body) and CONTINUATION.search(body[0]) is not None
+
+
+def to_int(value: str) -> int:
+    return int(value.replace(",", ""))
+
+
+def contest_name(header_lines: List[str]) -> str:
+    name = ""
+    for line in header_lines:
+        # "... - Non-" + "Partisan" is a hyphenated word, "... DIVISION 5 -" + "Vote for One" is not
+        if name.endswith("-") and not name.endswith(" -"):
+            name += line
+        else:
+            name = f"{name} {line}".strip()
+    return VOTE_FOR.sub("", name).strip()
+
+
+def parse_choice(line: str) -> Optional[Choice]:
+    match = CHOICE_ROW.match(line)
+    if match is None:
+        return None
+    name = match["name"]
+    party = None
+    *rest, last = name.split(" ")
+    if rest and last in KNOWN_PARTIES:
+        name, party = " ".join(rest), last
+    elif rest and re.fullmatch(r"[A-Z]{2,4}", last) and not name.isupper():
+        # looks like a party code we have never seen, don't guess
+        raise UnparseableContest(f"unknown party code in: {line}")
+    return Choice(name=name, party=party, writein="(W)" in name,
+                  vote_in_center=to_int(match["center"]), vote_by_mail=to_int(match["mail"]), vote_total=to_int(match["total"]))
+
+
+def build_contest(name: str, choices: List[Choice], cast_votes: Optional[Tuple[int, int, int]],
+                  summary_rows: Dict[str, Tuple[int, int, int]]) -> Tuple[Contest, Summary]:
+    if not name or not choices:
+        raise UnparseableContest(f"contest '{name}' has no header or no choices")
+    if "undervotes" not in summary_rows or "overvotes" not in summary_rows:
+        raise UnparseableContest(f"contest '{name}' has no undervote/overvote block")
+    for choice in choices:
+        if choice.vote_in_center + choice.vote_by_mail != choice.vote_total:
+            raise UnparseableContest(f"choice '{choice.name}' in '{name}' does not add up")
+    if cast_votes is not None:
+        column_sums = (sum(c.vote_in_center for c in choices), sum(c.vote_by_mail for c in choices), sum(c.vote_total for c in choices))
+        if column_sums != cast_votes:
+            raise UnparseableContest(f"choices in '{name}' do not add up to Cast Votes")
+
+    # rows the report leaves out (older reports have no "Unresolved write-ins" line, for example) are zero
+    summary_values = {}
+    for label, prefix in SUMMARY_FIELDS.items():
+        center, mail, total = summary_rows.get(label, (0, 0, 0))
+        if center + mail != total:
+            raise UnparseableContest(f"{label} in '{name}' do not add up")
+        summary_values.update({f"{prefix}_in_center": center, f"{prefix}_by_mail": mail, f"{prefix}_total": total})
+
+    return Contest(name=name, choices=choices), Summary(contest=name, **summary_values)
+
+
+def parse_page(text: str) -> Optional[ElectionData]:
+    "Parse one page, returning None if any part of it can't be parsed confidently"
+    try:
+        return _parse_lines(page_body_lines(text))
+    except UnparseableContest as err:
+        print(f"rule parser: {err}")
+        return None
+
+
+def _parse_lines(lines: List[str]) -> ElectionData:
+    data = ElectionData(contests=[], summary=[])
+    header_lines: List[str] = []
+    name = None
+    choices: List[Choice] = []
+    cast_votes = None
+    summary_rows: Dict[str, Tuple[int, int, int]] = {}
+
+    def finish_contest():
+        contest, summary = build_contest(name, choices, cast_votes, summary_rows)
+        data.contests.append(contest)
+        data.summary.append(summary)
+
+    for line in lines:
+        if END_OF_REPORT.match(line):
+            continue
+
+        summary_match = SUMMARY_ROW.match(line)
+        if name is not None and summary_match:
+            summary_rows[summary_match["label"].lower()] = (
+                to_int(summary_match["center"]), to_int(summary_match["mail"]), to_int(summary_match["total"]))
+            continue
+
+        if name is not None and summary_rows:
+            # first line after the undervote/overvote block starts the next contest
+            finish_contest()
+            name, choices, cast_votes, summary_rows = None, [], None, {}
+
+        if name is None:
+            if ANY_CAPTION.match(line):
+                if not CAPTION.match(line):
+                    raise UnparseableContest(f"unsupported column layout: {line}")
+                if not header_lines:
+                    raise UnparseableContest("page starts in the middle of a contest")
+                name, header_lines = contest_name(header_lines), []
+            elif header_lines and TURNOUT_BLOCK.match(line):
+                continue
+            elif CHOICE_ROW.match(line) or CAST_VOTES.match(line) or SUMMARY_ROW.match(line):
+                raise UnparseableContest("page starts in the middle of a contest")
+            else:
+                header_lines.append(line)
+            continue
+
+        cast_match = CAST_VOTES.match(line)
+        if cast_match:
+            cast_votes = (to_int(cast_match["center"]), to_int(cast_match["mail"]), to_int(cast_match["total"]))
+            continue
+
+        choice = parse_choice(line)
+        if choice is not None:
+            choices.append(choice)
+        elif choices and cast_votes is None and not any(ch.isdigit() for ch in line):
+            # a long name wrapped onto a second line, e.g. "Kamala D. Harris" / "and Tim Walz" - the "(W)" may be on either
+            choices[-1].name = f"{choices[-1].name} {line}"
+            choices[-1].writein = "(W)" in choices[-1].name
+        else:
+            raise UnparseableContest(f"unexpected line in '{name}': {line}")
+
+    if name is not None:
+        if not summary_rows:
+            raise UnparseableContest(f"contest '{name}' continues on the next page")
+        finish_contest()
+    elif header_lines:
+        raise UnparseableContest(f"header with no table: {' '.join(header_lines)}")
+    return data
+
+
+def parse_pages(page_texts: List[str]) -> Tuple[Dict[int, ElectionData], List[int]]:
+    "Returns the pages parsed locally (by 0-based page number) and the page numbers that still need the LLM"
+    parsed: Dict[int, ElectionData] = {}
+    fallback: List[int] = []
+    for page_num, text in enumerate(page_texts):
+        page_data = parse_page(text)
+        if page_data is None:
+            fallback.append(page_num)
+        else:
+            parsed[page_num] = page_data
+    print(f"rule parser: parsed {len(parsed)} of {len(page_texts)} pages locally, {len(fallback)} need the LLM")
+    return parsed, fallback
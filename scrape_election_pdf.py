@@ -1,15 +1,17 @@
 import os
 from pathlib import Path
-from openai import OpenAI
 
 
 import pdfplumber
-import pandas as pd
-import json
+from typing import Optional
 
-from extraction_models import Contest, Summary
+from extraction_models import ElectionData
+from extraction_cache import ExtractionCache, cache_key
+from extraction_backends import ExtractionBackend, JsonChatBackend
+import columnar_export
 
-def extract_election_data(pdf_path: Path, api_key: str):
+def extract_election_data(pdf_path: Path, api_key: str, cache: Optional[ExtractionCache] = None,
+                          backend: Optional[ExtractionBackend] = None):
 
     with pdfplumber.open(pdf_path) as pdf:
         text = ""
@@ -43,86 +45,39 @@ def extract_election_data(pdf_path: Path, api_key: str):
         Return the answer as structured JSON.
         """
     )
-    client = OpenAI(api_key=api_key)
 
-    # response = client.chat.completions.create(
-    #     model="gpt-4o-mini",
-    #     messages=prompt,
-    #     max_tokens=8000)
-    
-    response = client.chat.completions.create(
-        model="gpt-4o",  # or use "gpt-4" if you have access
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant for extracting structured data from a PDF."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=4000,  # adjust if needed
-        temperature=0.2  # adjust to control creativity
-    )
+    # the json backend asks for plain JSON (gpt-4o, or use "gpt-4" if you have access), strips the ```json fence
+    # and validates it against ElectionData
+    if backend is None:
+        backend = JsonChatBackend(api_key)
 
-    #return response.choices[0].text
-    res = response.choices[0].message.content
-    
-    # Clean the content by removing unwanted characters and formatting
-    if res is not None and "```json" in res:
-        cleaned_res = res.strip().strip("```json").strip("```").strip("'").strip("\n")
+    key = cache_key(text, backend.model, prompt)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached.model_dump()
+
+    election_data = backend.extract("You are a helpful assistant for extracting structured data from a PDF.", prompt,
+                                    max_tokens=4000).data  # adjust if needed
     
     # dump the cleaned response to a json file
     with open("cleaned_res.json", "w") as f:
-        f.write(cleaned_res)
-
-    json_data = json.loads(cleaned_res)
-    return json_data
-
-
-def save_results(json_data: str):
-    contests = []
-    summaries = []
-
-    # Process and save the results using pydantic models
-    # json_data = json.loads(json_data)
-
-    for contest_data in json_data["contests"]:
-        contest = Contest(**contest_data)
-        contests.append(contest)
-
-    for contest_data in json_data["summary"]:
-
-        summary = Summary(
-            contest=contest.name,
-            undervotes_in_center=contest_data["undervotes_in_center"],
-            undervotes_by_mail=contest_data["undervotes_by_mail"],
-            undervotes_total=contest_data["undervotes_total"],
-            overvotes_in_center=contest_data["overvotes_in_center"],
-            overvotes_by_mail=contest_data["overvotes_by_mail"],
-            overvotes_total=contest_data["overvotes_total"],
-            unqualified_write_ins_in_center=contest_data["unqualified_write_ins_in_center"],
-            unqualified_write_ins_by_mail=contest_data["unqualified_write_ins_by_mail"],
-            unqualified_write_ins_total=contest_data["unqualified_write_ins_total"],
-        )
-        summaries.append(summary)
-
-    # I couldn't get this to work with panda extracting the model names and values automatically
-    #  so I am listing the fields manually
-    data = []
-    for contest in contests: # list
-        for choice in contest.choices:
-            print(contest.name, choice.name, choice.party, choice.vote_in_center, choice.vote_by_mail, choice.vote_total)
-            data.append([contest.name, choice.name, choice.party, choice.vote_in_center, choice.vote_by_mail, choice.vote_total])
-    
-    contests_df = pd.DataFrame(data, columns=["contest", "name", "party", "vote_in_center", "vote_by_mail", "vote_total"])
+        f.write(election_data.model_dump_json())
 
+    if cache is not None:
+        cache.put(key, election_data)
+    return election_data.model_dump()
 
-    # Convert to DataFrame and save to CSV
-    # contests_df = pd.DataFrame([contest.model_dump() for contest in contests]) # this doesn't work right
-    summaries_df = pd.DataFrame([summary.model_dump() for summary in summaries])
 
-    contests_df.to_csv("contests.csv", index=False)
-    summaries_df.to_csv("summaries.csv", index=False)
+def save_results(json_data: dict):
+    # validate the model's JSON once, then export it column-wise (the CSVs are still written alongside the Parquet files)
+    election_data = ElectionData.model_validate(json_data)
+    columnar_export.save_results(election_data, formats=("parquet", "csv"))
 
 
-def main(pdf_path: Path, api_key: str):
-    json_data = extract_election_data(pdf_path, api_key)
+def main(pdf_path: Path, api_key: str, cache: Optional[ExtractionCache] = None,
+         backend: Optional[ExtractionBackend] = None):
+    json_data = extract_election_data(pdf_path, api_key, cache, backend)
     save_results(json_data)
 
 
@@ -131,4 +86,4 @@ if __name__ == "__main__":
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise ValueError("API key not found")
-    main(pdf_path, api_key)
\ No newline at end of file
+    main(pdf_path, api_key, ExtractionCache())
\ No newline at end of file
@@ -1,27 +1,20 @@
 import os
 from pathlib import Path
-from openai import OpenAI
+from itertools import islice
+from typing import Optional
 
+from extraction_models import ElectionData
+from extraction_cache import ExtractionCache, cache_key
+from extraction_backends import ExtractionBackend, LlamaIndexBackend
+from pdf_text import iter_page_texts
+import columnar_export
 
-import pdfplumber
-import pandas as pd
-import json
+def extract_election_data(pdf_path: Path, api_key: str, cache: Optional[ExtractionCache] = None,
+                          backend: Optional[ExtractionBackend] = None):
 
-from extraction_models import Contest, Summary, ElectionData
-from llama_index.program.openai import OpenAIPydanticProgram
-
-def extract_election_data(pdf_path: Path, api_key: str):
-
-    with pdfplumber.open(pdf_path) as pdf:
-        text = ""
-        # for page in pdf.pages:
-        #     text += page.extract_text()
-        text = pdf.pages[0].extract_text() # 
-        text += pdf.pages[1].extract_text() # 
-        text += pdf.pages[2].extract_text() # 
-        text += pdf.pages[3].extract_text()
-        text += pdf.pages[4].extract_text()
-        # text += pdf.pages[5].extract_text() # failed to extract due to length at 6 pages
+    # the first five pages (six failed to extract due to length), read one at a time so each page's
+    # layout objects are released as soon as its text is taken
+    text = "".join(page_text for _, page_text in islice(iter_page_texts(pdf_path), 5))
 
     # Use the OpenAI API to parse the PDF text
     # prompt = (
@@ -52,11 +45,17 @@ def extract_election_data(pdf_path: Path, api_key: str):
         """
     )
 
-    program = OpenAIPydanticProgram.from_defaults(
-                output_cls=ElectionData, prompt_template_str=prompt_template_str, verbose=True, model="gpt-4o-2024-08-06")
-    
-    
-    output = program(text=text, api_key=os.getenv("OPENAI_API_KEY"), model="gpt-4o-2024-08-06")
+    # the llamaindex backend wraps OpenAIPydanticProgram with output_cls=ElectionData
+    if backend is None:
+        backend = LlamaIndexBackend(api_key, model="gpt-4o-2024-08-06")
+
+    key = cache_key(text, backend.model, prompt_template_str)
+    output = cache.get(key) if cache is not None else None
+
+    if output is None:
+        output = backend.extract("", prompt_template_str, max_tokens=4000).data
+        if cache is not None and output is not None:
+            cache.put(key, output)
 
     print(output)
     # return output
@@ -93,53 +92,14 @@ def extract_election_data(pdf_path: Path, api_key: str):
 
 
 def save_results(json_data: str):
-    contests = []
-    summaries = []
-
-    # Process and save the results using pydantic models
-    # json_data = json.loads(json_data)
-
-    for contest_data in json_data["contests"]:
-        contest = Contest(**contest_data)
-        contests.append(contest)
-
-    for contest_data in json_data["summary"]:
-
-        summary = Summary(
-            contest=contest.name,
-            undervotes_in_center=contest_data["undervotes_in_center"],
-            undervotes_by_mail=contest_data["undervotes_by_mail"],
-            undervotes_total=contest_data["undervotes_total"],
-            overvotes_in_center=contest_data["overvotes_in_center"],
-            overvotes_by_mail=contest_data["overvotes_by_mail"],
-            overvotes_total=contest_data["overvotes_total"],
-            unqualified_write_ins_in_center=contest_data["unqualified_write_ins_in_center"],
-            unqualified_write_ins_by_mail=contest_data["unqualified_write_ins_by_mail"],
-            unqualified_write_ins_total=contest_data["unqualified_write_ins_total"],
-        )
-        summaries.append(summary)
-
-    # I couldn't get this to work with panda extracting the model names and values automatically
-    #  so I am listing the fields manually
-    data = []
-    for contest in contests: # list
-        for choice in contest.choices:
-            print(contest.name, choice.name, choice.party, choice.vote_in_center, choice.vote_by_mail, choice.vote_total)
-            data.append([contest.name, choice.name, choice.party, choice.vote_in_center, choice.vote_by_mail, choice.vote_total])
-    
-    contests_df = pd.DataFrame(data, columns=["contest", "name", "party", "vote_in_center", "vote_by_mail", "vote_total"])
-
-
-    # Convert to DataFrame and save to CSV
-    # contests_df = pd.DataFrame([contest.model_dump() for contest in contests]) # this doesn't work right
-    summaries_df = pd.DataFrame([summary.model_dump() for summary in summaries])
-
-    contests_df.to_csv("contests.csv", index=False)
-    summaries_df.to_csv("summaries.csv", index=False)
+    # validate the model's JSON once, then export it column-wise (the CSVs are still written alongside the Parquet files)
+    election_data = ElectionData.model_validate_json(json_data)
+    columnar_export.save_results(election_data, formats=("parquet", "csv"))
 
 
-def main(pdf_path: Path, api_key: str):
-    json_data = extract_election_data(pdf_path, api_key)
+def main(pdf_path: Path, api_key: str, cache: Optional[ExtractionCache] = None,
+         backend: Optional[ExtractionBackend] = None):
+    json_data = extract_election_data(pdf_path, api_key, cache, backend)
     # save_results(json_data)
 
 
@@ -148,4 +108,4 @@ if __name__ == "__main__":
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise ValueError("API key not found")
-    main(pdf_path, api_key)
\ No newline at end of file
+    main(pdf_path, api_key, ExtractionCache())
\ No newline at end of file
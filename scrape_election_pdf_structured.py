@@ -1,44 +1,105 @@
 import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional
-from openai import OpenAI
+from typing import Callable, Dict, List, Optional, Sequence, Set
+from openai import APIConnectionError, APIStatusError, RateLimitError
 
 
-import pdfplumber
 import pandas as pd
 import json
 
 from extraction_models import Contest, Choice, Summary, ElectionData
-
-def extract_election_data(batch_num:int,  text:str, api_key: str) -> Optional[ElectionData]:
-
+from extraction_cache import ExtractionCache, cache_key
+from extraction_metrics import BatchSpan, ExtractionMetrics, peak_rss_mb, rss_mb
+from extraction_backends import (BACKENDS, RECORDINGS_DIR, ExtractionBackend, HedgedBackend, RecordingBackend,
+                                 StructuredOutputBackend, TruncatedResponseError, get_backend)
+from rule_parser import parse_pages
+from streaming_parser import StreamItem, election_items
+from prompt_compaction import batch_token_reduction, compact_pages
+from pdf_text import extract_page_texts, iter_page_texts, pdf_hash
+from extraction_journal import ExtractionJournal
+from election_store import DuplicatePolicy, ElectionStore, PageOrderedMerge, normalize_contest_name
+from ndjson_sink import NdjsonSink
+from page_classifier import PAGE_OVERRIDES, filter_result_pages, iter_result_pages, load_page_overrides
+from results_db import store_results
+import columnar_export
+from vote_validation import ValidationReport, pages_for_contests, validate_election_data
+from token_budget import DEFAULT_MAX_INPUT_TOKENS, DEFAULT_MAX_OUTPUT_TOKENS, count_tokens, iter_batches, pack_pages
+import rate_limiter
+
+MODEL = "gpt-4o-2024-08-06"
+SYSTEM_PROMPT = "You are a helpful assistant for extracting structured data from a PDF."
+# a single page that still overflows DEFAULT_MAX_OUTPUT_TOKENS gets one more try with this much room
+MAX_SINGLE_PAGE_OUTPUT_TOKENS = 16000
+# in low-memory mode, report resident memory every this many pages
+MEMORY_REPORT_PAGES = 100
+
+def extraction_prompt(text: str) -> str:
     prompt = (
         f"""
         Extract all the ElectionData information from the following text:
         Text:\n{text}\n\n
         """
     )    
-    client = OpenAI(api_key=api_key)
+    return prompt
+
+
+def extract_election_data(batch_num:int,  text:str, api_key: str, base_url: Optional[str] = None,
+                          cache: Optional[ExtractionCache] = None,
+                          max_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+                          backend: Optional[ExtractionBackend] = None,
+                          span: Optional[BatchSpan] = None,
+                          on_item: Optional[Callable[[StreamItem], None]] = None) -> Optional[ElectionData]:
+
+    prompt = extraction_prompt(text)
+
+    # base_url lets us point at a local stub of the OpenAI endpoint for testing (see openai_stub and tests/)
+    # the backend reuses one pooled client per api_key/base_url, so this is cheap
+    if backend is None:
+        backend = StructuredOutputBackend(api_key, base_url, MODEL)
+
+    # a byte-identical batch has already been paid for, so skip the network entirely
+    key = cache_key(text, backend.cache_id, SYSTEM_PROMPT + prompt)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            print(f"batch number: {batch_num} cache hit")
+            if span is not None:
+                span.request(backend.model, cache_hit=True)
+            if on_item is not None:
+                for item in election_items(cached):
+                    on_item(item)
+            return cached
+
+    # when several PDFs run at once they share one RPM/TPM budget (see batch_runner)
+    # the API counts max_tokens against TPM up front, so reserve that much for the answer
+    waited = rate_limiter.acquire(count_tokens(SYSTEM_PROMPT + prompt) + max_tokens)
+    if waited:
+        print(f"batch number: {batch_num} waited {waited:.1f}s for the rate limiter")
 
     # response = client.chat.completions.create(
     #     model="gpt-4o-mini",
     #     messages=prompt,
     #     max_tokens=8000)
     
-    response = client.beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06", 
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant for extracting structured data from a PDF."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=4000,  # adjust if needed
-        temperature=0.2,  # adjust to control creativity
-        response_format=ElectionData
-    )
+    # a "length" finish raises TruncatedResponseError, see extract_pages_adaptive
+    # with on_item the answer is streamed, and each contest/summary handed over as soon as the model has finished it
+    try:
+        response = backend.extract(SYSTEM_PROMPT, prompt, max_tokens, on_item)
+    except TruncatedResponseError as err:
+        if span is not None:
+            span.request(backend.model, err.response)
+        raise
+    if span is not None:
+        span.request(backend.model, response)
 
     # res will be a pydantic ElectionData object    
-    res = response.choices[0].message.parsed
-    print(f"batch number: {batch_num} finish reason:", response.choices[0].finish_reason)
+    res = response.data
+    print(f"batch number: {batch_num} finish reason:", response.finish_reason)
     
     # Clean the content by removing unwanted characters and formatting
     # if res is not None and "```json" in res:
@@ -50,75 +111,154 @@ def extract_election_data(batch_num:int,  text:str, api_key: str) -> Optional[El
         #     f.write(res.model_dump_json())
 
         # json_data = res.model_dump_json() # json.loads(cleaned_res)
+        # only cache complete answers - a truncated response should be retried next time
+        if cache is not None and response.finish_reason == "stop":
+            cache.put(key, res)
         return res
     
     return None
 
 
+# 429s and 5xx responses are worth retrying, as are dropped connections - anything else (bad key, bad request) is not
+def is_retryable(err: Exception) -> bool:
+    if isinstance(err, (RateLimitError, APIConnectionError)):
+        return True
+    return isinstance(err, APIStatusError) and err.status_code >= 500
+
+
+def retry_delay(attempt: int, err: Exception, base_delay: float, max_delay: float) -> float:
+    # honor the server's Retry-After if it sent one, otherwise use "full jitter" exponential backoff
+    # so that a burst of concurrent batches doesn't retry in lock step
+    response = getattr(err, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after is not None:
+            try:
+                return min(max_delay, float(retry_after))
+            except ValueError:
+                pass
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def extract_with_retry(batch_num: int, text: str, api_key: str, base_url: Optional[str] = None,
+                       cache: Optional[ExtractionCache] = None, max_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+                       max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 30.0,
+                       backend: Optional[ExtractionBackend] = None,
+                       span: Optional[BatchSpan] = None,
+                       on_item: Optional[Callable[[StreamItem], None]] = None) -> Optional[ElectionData]:
+    for attempt in range(max_retries + 1):
+        try:
+            return extract_election_data(batch_num, text, api_key, base_url=base_url, cache=cache, max_tokens=max_tokens,
+                                         backend=backend, span=span, on_item=on_item)
+        except Exception as err:
+            if attempt == max_retries or not is_retryable(err):
+                raise
+            if span is not None:
+                span.retry(err)
+            delay = retry_delay(attempt, err, base_delay, max_delay)
+            print(f"batch number: {batch_num} attempt {attempt + 1} failed with {type(err).__name__}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+    return None
+
+
+# if the model runs out of output tokens the batch is cut in half and each half is extracted on its own,
+# so we never lose the contests at the end of a truncated response
+# page_texts only has to have the batch's pages, e.g. a {page_num: text} dict in low-memory mode
+def extract_pages_adaptive(batch_num: int, pages: List[int], page_texts: List[str], api_key: str,
+                           base_url: Optional[str] = None, cache: Optional[ExtractionCache] = None,
+                           max_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+                           backend: Optional[ExtractionBackend] = None,
+                           span: Optional[BatchSpan] = None,
+                           on_item: Optional[Callable[[StreamItem], None]] = None) -> Optional[ElectionData]:
+    text = "".join(page_texts[page_num] for page_num in pages)
+    try:
+        return extract_with_retry(batch_num, text, api_key, base_url, cache, max_tokens, backend=backend, span=span,
+                                  on_item=on_item)
+    except TruncatedResponseError:
+        if len(pages) == 1:
+            if max_tokens >= MAX_SINGLE_PAGE_OUTPUT_TOKENS:
+                print(f"batch number: {batch_num} page {pages[0] + 1} is truncated even on its own, skipping it")
+                return None
+            print(f"batch number: {batch_num} page {pages[0] + 1} truncated, retrying with max_tokens={MAX_SINGLE_PAGE_OUTPUT_TOKENS}")
+            return extract_pages_adaptive(batch_num, pages, page_texts, api_key, base_url, cache, MAX_SINGLE_PAGE_OUTPUT_TOKENS,
+                                          backend, span, on_item)
+
+    middle = len(pages) // 2
+    if span is not None:
+        span.splits += 1
+    print(f"batch number: {batch_num} truncated, splitting pages {pages[0] + 1}-{pages[-1] + 1} at page {pages[middle] + 1}")
+    combined = ElectionStore()
+    for half in (pages[:middle], pages[middle:]):
+        half_data = extract_pages_adaptive(batch_num, half, page_texts, api_key, base_url, cache, max_tokens, backend, span,
+                                           on_item)
+        if half_data is not None:
+            combined.merge(half_data)
+    return combined.to_election_data()
+
+
+# send all the batches at once, with at most max_concurrency requests in flight
+# results come back in batch (page) order, so merging them gives the same output as a sequential run
+# on_result is called with (pages, result) as soon as each batch finishes, e.g. to journal it
+# on_item streams the answers: it is called with (pages, contest or summary) as soon as the model has finished each one.
+# A retried or split batch hands some items over again, so whatever consumes them has to tolerate repeats
+def extract_batches_concurrently(batch_pages: List[List[int]], page_texts: List[str], api_key: str,
+                                 max_concurrency: int = 4, base_url: Optional[str] = None,
+                                 cache: Optional[ExtractionCache] = None,
+                                 max_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+                                 on_result: Optional[Callable[[List[int], Optional[ElectionData]], None]] = None,
+                                 backend: Optional[ExtractionBackend] = None,
+                                 metrics: Optional[ExtractionMetrics] = None,
+                                 on_item: Optional[Callable[[List[int], StreamItem], None]] = None) -> List[Optional[ElectionData]]:
+
+    def extract_batch(batch_num: int, pages: List[int]) -> Optional[ElectionData]:
+        span = None
+        if metrics is not None:
+            span = metrics.batch(batch_num, pages, "".join(page_texts[page_num] for page_num in pages))
+
+        batch_on_item = None
+        if on_item is not None:
+            def batch_on_item(item: StreamItem):
+                if span is not None:
+                    span.item()
+                on_item(pages, item)
+
+        try:
+            result = extract_pages_adaptive(batch_num, pages, page_texts, api_key, base_url, cache, max_tokens, backend, span,
+                                            batch_on_item)
+        except Exception as err:
+            if metrics is not None:
+                metrics.finish_batch(span, None, err)
+            raise
+        if metrics is not None:
+            metrics.finish_batch(span, result)
+        if on_result is not None:
+            on_result(pages, result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        futures = [executor.submit(extract_batch, batch_num, pages) for batch_num, pages in enumerate(batch_pages)]
+        return [future.result() for future in futures]
+
+
 # when processing batches, a Contest may get split across two batches, so we need to merge them
 # in theory, no Choices will ever be split across batches, but we can test before merging them too
+# the real work is done by ElectionStore, which keeps a normalized-name index - these wrappers are for callers
+# holding plain lists, and build a throwaway index on every call, so use an ElectionStore for repeated merges
 
 def merge_contests(master_contests: List[Contest], new_contests: List[Contest]) -> List[Contest]:
-    # Create a dictionary for easy lookup of contests by their name in the master list
-    master_dict = {contest.name: contest for contest in master_contests}
-
-    for new_contest in new_contests:
-        if new_contest.name in master_dict:
-            # Contest already exists, merge the choices
-            master_contest = master_dict[new_contest.name]
-            merge_choices(master_contest, new_contest.choices)
-        else:
-            # New contest, add it to the master list
-            master_contests.append(new_contest)
-    
+    ElectionStore(contests=master_contests).merge_contests(new_contests)
     return master_contests
 
 
 # make sure we don't duplicate a choice - should never happen?
 
 def merge_choices(master_contest: Contest, new_choices: List[Choice]):
-    master_choices:List[Choice] = master_contest.choices
-    # Create a dictionary for easy lookup of choices by their name in the master list
-    master_choice_dict = {choice.name: choice for choice in master_choices}
-
-    for new_choice in new_choices:
-        if new_choice.name in master_choice_dict:
-            # Choice already exists, you can choose how to handle duplicates, for example:
-            # sum the votes or ignore the new choice
-            # master_choice = master_choice_dict[new_choice.name]
-            # master_choice.vote_in_center += new_choice.vote_in_center
-            # master_choice.vote_by_mail += new_choice.vote_by_mail
-            # master_choice.vote_total += new_choice.vote_total
-            print(f"OOPS - duplicate choice name found in Contest:{master_contest.name} Choice: {new_choice.name}")
-        else:
-            # New choice, add it to the master list of choices
-            print(f"Merging in new choice: {new_choice.name} to Contest: {master_contest.name}")
-            master_choices.append(new_choice)
+    ElectionStore(contests=[master_contest]).merge_choices(master_contest, new_choices)
+
 
 def merge_summary(master_summaries: List[Summary], new_summaries: List[Summary]) -> List[Summary]:
-    # Create a dictionary for easy lookup of summaries by their contest name in the master list
-    master_dict = {summary.contest: summary for summary in master_summaries}
-
-    for new_summary in new_summaries:
-        if new_summary.contest in master_dict:
-            print("OOPS - duplicate summary found for contest:", new_summary.contest)
-            # Summary already exists, add in the new data
-            # this shouldn't happen, but if it does, we can sum the values
-            master_summary = master_dict[new_summary.contest]
-            master_summary.undervotes_in_center += new_summary.undervotes_in_center
-            master_summary.undervotes_by_mail += new_summary.undervotes_by_mail
-            master_summary.undervotes_total += new_summary.undervotes_total
-            master_summary.overvotes_in_center += new_summary.overvotes_in_center
-            master_summary.overvotes_by_mail += new_summary.overvotes_by_mail
-            master_summary.overvotes_total += new_summary.overvotes_total
-            master_summary.unresolved_write_ins_in_center += new_summary.unresolved_write_ins_in_center
-            master_summary.unresolved_write_ins_by_mail += new_summary.unresolved_write_ins_by_mail
-            master_summary.unresolved_write_ins_total += new_summary.unresolved_write_ins_total
-        else:
-            # New summary, add it to the master list
-            # print(f"Merging in new summary: {new_summary.contest}")
-            master_summaries.append(new_summary)
-    
+    # a duplicate summary shouldn't happen, but if it does the values are summed
+    ElectionStore(summaries=master_summaries).merge_summaries(new_summaries)
     return master_summaries
 
 
@@ -168,53 +308,369 @@ def merge_summary(master_summaries: List[Summary], new_summaries: List[Summary])
     # summaries_df.to_csv("summaries.csv", index=False)
 
 
-# define a generator to get the next batch of pages from the PDF
-def get_next_batch(pdf_path: Path, pages_per_batch: int):
-    with pdfplumber.open(pdf_path) as pdf:
-        for i in range(0, len(pdf.pages), pages_per_batch):
-            text = ""
-            for page in pdf.pages[i:i + pages_per_batch]:
-                print(f"Processing page {page.page_number}")
-                text += page.extract_text()
-            yield text
-
-
-def main(pdf_path: Path, api_key: str):
+# the text of every page, in page order - pages are extracted in parallel and cached by PDF hash
+def get_page_texts(pdf_path: Path) -> List[str]:
+    return extract_page_texts(pdf_path)
+
+
+# re-query only the pages behind contests whose vote arithmetic doesn't add up,
+# and swap in a re-extracted contest only if it passes the checks this time
+def reextract_inconsistent(store: ElectionStore, report: ValidationReport, contest_pages: Dict[str, Set[int]],
+                           page_texts: List[str], api_key: str, max_concurrency: int = 1, base_url: Optional[str] = None,
+                           max_input_tokens: int = DEFAULT_MAX_INPUT_TOKENS,
+                           max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+                           backend: Optional[ExtractionBackend] = None,
+                           metrics: Optional[ExtractionMetrics] = None) -> ValidationReport:
+    pages = pages_for_contests(report.flagged_contests, contest_pages, page_texts)
+    retry_pages = pack_pages(sorted(pages), page_texts, max_input_tokens, max_output_tokens)
+    print(f"Re-extracting {len(pages)} pages for {len(report.flagged_contests)} inconsistent contests")
+
+    # no cache here - the cached answer is the one that didn't add up
+    retry_results = extract_batches_concurrently(retry_pages, page_texts, api_key, max_concurrency, base_url, None,
+                                                 max_output_tokens, backend=backend, metrics=metrics)
+    retry_store = ElectionStore()
+    for retry_result in retry_results:
+        if retry_result is not None:
+            retry_store.merge(retry_result)
+    retry_data = retry_store.to_election_data()
+
+    flagged = {normalize_contest_name(name) for name in report.flagged_contests}
+    fixed = flagged - {normalize_contest_name(name) for name in validate_election_data(retry_data).flagged_contests}
+    store.patch(ElectionData(
+        contests=[contest for contest in retry_data.contests if normalize_contest_name(contest.name) in fixed],
+        summary=[summary for summary in retry_data.summary if normalize_contest_name(summary.contest) in fixed]))
+    return validate_election_data(store.to_election_data())
+
+
+def report_skipped_pages(skipped_pages: Dict[int, str], tokens: int, metrics: Optional[ExtractionMetrics] = None):
+    "tokens is the prompt tokens the skipped pages would have cost"
+    for page_num, reason in sorted(skipped_pages.items()):
+        print(f"Skipping page {page_num + 1}, not a results page ({reason})")
+    if skipped_pages:
+        print(f"Skipped {len(skipped_pages)} pages without results, about {tokens} prompt tokens")
+        if metrics is not None:
+            metrics.emit({"event": "skipped_pages", "pages": [page_num + 1 for page_num in sorted(skipped_pages)],
+                          "tokens": tokens})
+
+
+def main(pdf_path: Path, api_key: str, max_concurrency: int = 1, base_url: Optional[str] = None,
+         cache: Optional[ExtractionCache] = None, use_rule_parser: bool = False,
+         max_input_tokens: int = DEFAULT_MAX_INPUT_TOKENS, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+         journal_path: Optional[Path] = Path("election_data_cumulative.journal.jsonl"), resume: bool = False,
+         choice_policy: DuplicatePolicy = DuplicatePolicy.KEEP, summary_policy: DuplicatePolicy = DuplicatePolicy.SUM,
+         export_formats: Sequence[str] = (), validate: bool = False,
+         output_path: Path = Path("election_data_cumulative.json"), backend: Optional[ExtractionBackend] = None,
+         metrics: Optional[ExtractionMetrics] = None, compact_prompts: bool = False,
+         stream: bool = False, on_item: Optional[Callable[[StreamItem], None]] = None,
+         ndjson_path: Optional[Path] = None, skip_non_result_pages: bool = False,
+         page_overrides_path: Optional[Path] = PAGE_OVERRIDES, results_db_path: Optional[Path] = None):
 
     # batch process the PDF and merge the new batch into master results
     # assumes that contests are always presented in a labelled table, even if the Choices are split across pages!!
-
-    pages_per_batch = 8
-    master_election_data: ElectionData = ElectionData(contests=[], summary=[])
-    master_summaries = []
-
-    for batch_num, next_batch in enumerate(get_next_batch(pdf_path, pages_per_batch)):
-
-        words = len(next_batch.split())
-        print(f"\nStart processing batch number: {batch_num} with length {words} words") # with text = {next_batch}")
-        batch_election_data = extract_election_data(batch_num, next_batch, api_key)
-        print("batch election data:", batch_election_data)
-        if batch_election_data is not None:
-            _ = merge_contests(master_election_data.contests, batch_election_data.contests)
-            _ = merge_summary(master_election_data.summary, batch_election_data.summary)
+    # with max_concurrency > 1 the batches are sent to the model in parallel, but still merged in page order
+    # with use_rule_parser, pages in the standard layout are parsed locally and only the rest go to the model
+    # batches are packed to fit the input and (estimated) output token budgets, and split if the model still runs out
+    # every finished batch is journaled, and with resume=True the journal is replayed so only missing batches are sent
+    # duplicate choices/summaries (same normalized name) are handled according to choice_policy/summary_policy
+    # with validate, contests whose votes don't add up are re-extracted from just their own pages
+    # the merged results go to output_path, and any export_formats tables next to it
+    # backend picks how the model is called (see extraction_backends), the default is structured outputs
+    # metrics collects per-batch spans and stage timings (see extraction_metrics), give it a path to write them out
+    # with compact_prompts, the header repeated on every page is dropped before the text goes to the model
+    # with stream, each contest/summary is merged into a live store the moment the model has finished it,
+    # and on_item (if given) gets the merged contest/summary so far - e.g. to publish early results
+    # with ndjson_path, every contest is appended there as soon as it is merged and complete (see ndjson_sink)
+    # with skip_non_result_pages, cover/turnout/blank/signature pages never go to the model (see page_classifier),
+    # corrected per PDF by page_overrides_path
+    # with results_db_path, the final results are also stored as this report's version in the results database
+
+    run_start = time.perf_counter()
+    metrics = metrics if metrics is not None else ExtractionMetrics()
+    master_store = ElectionStore(choice_policy=choice_policy, summary_policy=summary_policy)
+
+    # the live merge takes items in whatever order the batches produce them, and a retried or split batch repeats
+    # items, so the newest copy wins. The page-ordered merge below is still what gets written out,
+    # so streaming changes how early results show up, never what they are
+    live_store = ElectionStore(choice_policy=DuplicatePolicy.REPLACE, summary_policy=DuplicatePolicy.REPLACE)
+    live_lock = threading.Lock()
+
+    def merge_item(pages: List[int], item: StreamItem):
+        with live_lock:
+            # copies, so the live store never shares (and mutates) objects with the batch results
+            if isinstance(item, Contest):
+                live_store.merge_contests([item.model_copy(deep=True)])
+                merged = live_store.contest(item.name).model_copy(deep=True)
+            else:
+                live_store.merge_summaries([item.model_copy(deep=True)])
+                merged = live_store.summary(item.contest).model_copy(deep=True)
+            if metrics.first_result is None:
+                metrics.first_result = time.perf_counter() - run_start
+                print(f"First result after {metrics.first_result:.1f}s, from pages {pages[0] + 1}-{pages[-1] + 1}")
+                metrics.emit({"event": "first_result", "seconds": round(metrics.first_result, 4),
+                              "pages": [page_num + 1 for page_num in pages]})
+        if on_item is not None:
+            on_item(merged)
+
+    with metrics.stage("pdf_text"):
+        page_texts = get_page_texts(pdf_path)
+    with metrics.stage("rule_parser"):
+        if use_rule_parser:
+            parsed_pages, llm_pages = parse_pages(page_texts)
         else:
-            print(f"UNEXPECTED - Batch number: {batch_num} returned No Data!")
+            parsed_pages, llm_pages = {}, list(range(len(page_texts)))
+
+    journal = ExtractionJournal(journal_path, pdf_hash(pdf_path), resume) if journal_path is not None else None
+    journaled = journal.completed_batches() if journal is not None else {}
+    if journaled:
+        done_pages = {page_num for pages in journaled for page_num in pages}
+        llm_pages = [page_num for page_num in llm_pages if page_num not in done_pages]
+        print(f"Resuming: {len(journaled)} batches ({len(done_pages)} pages) already in the journal")
+    if stream:
+        # pages that never go to the model are results already
+        for pages, result in [([page_num], result) for page_num, result in parsed_pages.items()] + list(journaled.items()):
+            for item in election_items(result):
+                merge_item(list(pages), item)
+
+    with metrics.stage("batching"):
+        if skip_non_result_pages:
+            llm_pages, skipped_pages = filter_result_pages(llm_pages, page_texts,
+                                                           load_page_overrides(pdf_path, page_overrides_path))
+            report_skipped_pages(skipped_pages, sum(count_tokens(page_texts[page_num]) for page_num in skipped_pages), metrics)
+        # the rule parser and incremental fingerprints work on the full page text, only the model sees the compacted text
+        llm_texts = compact_pages(page_texts) if compact_prompts else page_texts
+        batch_pages = pack_pages(llm_pages, llm_texts, max_input_tokens, max_output_tokens)
+        batches = ["".join(llm_texts[page_num] for page_num in pages) for pages in batch_pages]
+    for batch_num, next_batch in enumerate(batches):
+        words = len(next_batch.split())
+        print(f"\nQueued batch number: {batch_num} pages {batch_pages[batch_num][0] + 1}-{batch_pages[batch_num][-1] + 1} with length {words} words") # with text = {next_batch}")
+        if compact_prompts:
+            tokens_before, tokens_after = batch_token_reduction(batch_pages[batch_num], page_texts, llm_texts)
+            print(f"batch number: {batch_num} compacted from {tokens_before} to {tokens_after} tokens "
+                  f"({1 - tokens_after / max(tokens_before, 1):.1%} less)")
+            metrics.emit({"event": "compaction", "batch_num": batch_num, "tokens_before": tokens_before, "tokens_after": tokens_after})
+
+    # merge locally parsed pages, replayed journal batches and new model batches together, in page order,
+    # each batch as soon as the ones before it are in, and remember which pages each contest came from
+    contest_pages: Dict[str, Set[int]] = {}
+    sink = NdjsonSink(ndjson_path) if ndjson_path is not None else None
+
+    def merge_batch(pages: List[int], batch_election_data: Optional[ElectionData]):
+        with metrics.stage("merge"):
+            print("batch election data:", batch_election_data)
+            if batch_election_data is not None:
+                master_store.merge(batch_election_data)
+                for contest in batch_election_data.contests:
+                    contest_pages.setdefault(normalize_contest_name(contest.name), set()).update(pages)
+            else:
+                print(f"UNEXPECTED - Batch starting at page: {pages[0] + 1} returned No Data!")
+            if sink is not None:
+                sink.batch_merged(master_store, batch_election_data)
+
+        print(f"Finished batch starting at page: {pages[0] + 1}") # returns with electionData: {batch_election_data}")
+
+    merger = PageOrderedMerge([[page_num] for page_num in parsed_pages] + [list(pages) for pages in journaled] + batch_pages,
+                              merge_batch)
+    for page_num, result in parsed_pages.items():
+        merger.add([page_num], result)
+    for pages, result in journaled.items():
+        merger.add(list(pages), result)
+
+    def on_result(pages: List[int], result: Optional[ElectionData]):
+        if journal is not None:
+            journal.record(pages, result)
+        merger.add(pages, result)
+
+    with metrics.stage("model"):
+        extract_batches_concurrently(batch_pages, llm_texts, api_key, max_concurrency, base_url, cache, max_output_tokens,
+                                     on_result, backend, metrics, merge_item if stream else None)
 
-        print(f"Finished batch number: {batch_num}") # returns with electionData: {batch_election_data}")
+    print("Finished processing all batches")
+    if validate:
+        with metrics.stage("validation"):
+            report = validate_election_data(master_store.to_election_data())
+            print("vote arithmetic:", report.describe())
+            if report.flagged_contests:
+                flagged_contests = report.flagged_contests
+                report = reextract_inconsistent(master_store, report, contest_pages, llm_texts, api_key, max_concurrency,
+                                                base_url, max_input_tokens, max_output_tokens, backend, metrics)
+                if sink is not None:
+                    sink.update(master_store, flagged_contests)
+                print("vote arithmetic after re-extraction:", report.describe())
+    if cache is not None:
+        print("extraction cache:", cache.stats())
+    if backend is not None:
+        print(f"{backend.name} backend usage:", backend.usage())
+        metrics.emit({"event": "backend", "backend": backend.name, **backend.usage()})
+    master_election_data = master_store.to_election_data()
+    with metrics.stage("serialization"):
+        if master_election_data is not None:
+            with open(output_path, "w") as f:
+                f.write(master_election_data.model_dump_json())
+        # contests/summaries tables for analysis, e.g. ("parquet",) or ("parquet", "csv")
+        if export_formats:
+            columnar_export.save_results(master_election_data, Path(output_path).parent, export_formats)
+        if sink is not None:
+            sink.close(master_store)
+        if results_db_path is not None:
+            store_results(results_db_path, pdf_path, page_texts[0] if page_texts else "", master_election_data)
+    print("run summary:", ExtractionMetrics.describe(metrics.summary(master_election_data)))
+    # the cumulative file now holds everything the journal did
+    if journal is not None:
+        journal.remove()
+    return master_election_data
+
+
+
+def main_low_memory(pdf_path: Path, api_key: str, max_concurrency: int = 4, base_url: Optional[str] = None,
+                    cache: Optional[ExtractionCache] = None,
+                    max_input_tokens: int = DEFAULT_MAX_INPUT_TOKENS, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+                    choice_policy: DuplicatePolicy = DuplicatePolicy.KEEP, summary_policy: DuplicatePolicy = DuplicatePolicy.SUM,
+                    output_path: Path = Path("election_data_cumulative.json"), backend: Optional[ExtractionBackend] = None,
+                    metrics: Optional[ExtractionMetrics] = None, ndjson_path: Optional[Path] = None,
+                    max_rss_mb: Optional[float] = None, skip_non_result_pages: bool = False,
+                    page_overrides_path: Optional[Path] = PAGE_OVERRIDES, results_db_path: Optional[Path] = None):
+
+    # for statewide reports with thousands of pages: pages are read one at a time and packed into batches as they
+    # come, and at most 2 * max_concurrency batches are read ahead of the model, so memory stays flat however
+    # many pages there are - only the merged results grow. With max_rss_mb, reading ahead also stops while
+    # resident memory is above that, until the batches in flight have been merged.
+    # No rule parser, journal, validation or prompt compaction here: they all need every page at once
+
+    metrics = metrics if metrics is not None else ExtractionMetrics()
+    master_store = ElectionStore(choice_policy=choice_policy, summary_policy=summary_policy)
+    sink = NdjsonSink(ndjson_path) if ndjson_path is not None else None
+    pending = deque()  # (pages, future) of the batches in flight, in page order
+
+    def extract_batch(batch_num: int, pages: List[int], texts: List[str]) -> Optional[ElectionData]:
+        span = metrics.batch(batch_num, pages, "".join(texts))
+        try:
+            result = extract_pages_adaptive(batch_num, pages, dict(zip(pages, texts)), api_key, base_url, cache,
+                                            max_output_tokens, backend, span)
+        except Exception as err:
+            metrics.finish_batch(span, None, err)
+            raise
+        metrics.finish_batch(span, result)
+        return result
+
+    def merge_next():
+        pages, future = pending.popleft()
+        batch_election_data = future.result()
+        with metrics.stage("merge"):
+            if batch_election_data is not None:
+                master_store.merge(batch_election_data)
+            else:
+                print(f"UNEXPECTED - Batch starting at page: {pages[0] + 1} returned No Data!")
+            if sink is not None:
+                sink.batch_merged(master_store, batch_election_data)
+
+    def report_memory(pages_read: int):
+        memory = {"pages": pages_read, "rss_mb": rss_mb(), "peak_rss_mb": peak_rss_mb()}
+        print(f"Memory after {pages_read} pages: {memory['rss_mb'] or 0:.1f} MB resident, {memory['peak_rss_mb'] or 0:.1f} MB peak")
+        metrics.emit({"event": "memory", **memory})
+
+    # pages are classified as they are read, so only what the skipped ones would have cost is kept for the report
+    skipped_pages, skipped_tokens = {}, 0
+
+    def skip_page(page_num: int, text: str, reason: str):
+        nonlocal skipped_tokens
+        skipped_pages[page_num] = reason
+        skipped_tokens += count_tokens(text)
+
+    pages_read, next_report = 0, MEMORY_REPORT_PAGES
+    with metrics.stage("pipeline"), ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        page_stream = iter_page_texts(pdf_path)
+        if skip_non_result_pages:
+            page_stream = iter_result_pages(page_stream, load_page_overrides(pdf_path, page_overrides_path), skip_page)
+        batches = iter_batches(page_stream, max_input_tokens, max_output_tokens)
+        for batch_num, (pages, texts) in enumerate(batches):
+            print(f"\nQueued batch number: {batch_num} pages {pages[0] + 1}-{pages[-1] + 1}")
+            pending.append((pages, executor.submit(extract_batch, batch_num, pages, texts)))
+            # merge what's finished, in page order, and don't read further ahead than the model can keep up with
+            while pending and (pending[0][1].done() or len(pending) >= 2 * max(1, max_concurrency)
+                               or (max_rss_mb is not None and (rss_mb() or 0) > max_rss_mb)):
+                merge_next()
+            pages_read = pages[-1] + 1
+            if pages_read >= next_report:
+                report_memory(pages_read)
+                next_report += MEMORY_REPORT_PAGES
+        while pending:
+            merge_next()
+    if pages_read != next_report - MEMORY_REPORT_PAGES:
+        report_memory(pages_read)
+    report_skipped_pages(skipped_pages, skipped_tokens, metrics)
 
     print("Finished processing all batches")
-    if master_election_data is not None:
-        with open(f"election_data_cumulative.json", "w") as f:
+    if backend is not None:
+        print(f"{backend.name} backend usage:", backend.usage())
+        metrics.emit({"event": "backend", "backend": backend.name, **backend.usage()})
+    master_election_data = master_store.to_election_data()
+    with metrics.stage("serialization"):
+        with open(output_path, "w") as f:
             f.write(master_election_data.model_dump_json())
-
+        if sink is not None:
+            sink.close(master_store)
+        if results_db_path is not None:
+            first_page = next(iter_page_texts(pdf_path, 1), (0, ""))[1]
+            store_results(results_db_path, pdf_path, first_page, master_election_data)
+    print("run summary:", ExtractionMetrics.describe(metrics.summary(master_election_data)))
+    return master_election_data
 
 if __name__ == "__main__":
     
+    import argparse
     from dotenv import load_dotenv
     load_dotenv() # make sure our environment variables are loaded
 
-    pdf_path = Path("./Fall-2024-first-post-report.pdf")
+    parser = argparse.ArgumentParser(description="Extract election results from a county results PDF")
+    parser.add_argument("pdf_path", nargs="?", type=Path, default=Path("./Fall-2024-first-post-report.pdf"))
+    parser.add_argument("--resume", action="store_true", help="replay the batch journal from an interrupted run and only extract the missing batches")
+    parser.add_argument("--backend", choices=[*BACKENDS, "replay"], default="structured",
+                        help="how to call the model; replay answers from recorded responses without the network")
+    parser.add_argument("--hedge", action="store_true",
+                        help="send a request again when it is slower than recent requests, and keep the first answer")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream the model's answers and merge each contest as soon as it is complete")
+    parser.add_argument("--low-memory", action="store_true",
+                        help="read and extract the PDF a batch at a time, for reports with thousands of pages")
+    parser.add_argument("--max-rss-mb", type=float, default=None,
+                        help="with --low-memory, stop reading ahead while resident memory is above this")
+    parser.add_argument("--all-pages", action="store_true",
+                        help="send every page to the model, including the ones without results (cover, turnout, ...)")
+    parser.add_argument("--page-overrides", type=Path, default=PAGE_OVERRIDES,
+                        help="per-PDF pages to always keep or skip, see page_classifier")
+    parser.add_argument("--db", type=Path, default=None, metavar="PATH",
+                        help="also store the results in this results database (see results_db)")
+    parser.add_argument("--recordings", type=Path, default=None, metavar="DIR",
+                        help=f"where replay reads responses from (default {RECORDINGS_DIR}); with any other backend, record every response there")
+    args = parser.parse_args()
+
     api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
+    if not api_key and args.backend != "replay":
         raise ValueError("API key not found")
-    main(pdf_path, api_key)
\ No newline at end of file
+    base_url = os.getenv("OPENAI_BASE_URL")
+    if args.backend == "replay":
+        backend = get_backend("replay", recordings_dir=args.recordings or RECORDINGS_DIR)
+    else:
+        backend = get_backend(args.backend, api_key, base_url)
+        if args.recordings is not None:
+            backend = RecordingBackend(backend, args.recordings)
+        if args.hedge:
+            backend = HedgedBackend(backend)
+    max_concurrency = int(os.getenv("MAX_CONCURRENCY", "4"))
+    # replaying through the cache would only measure the cache
+    cache = ExtractionCache() if args.backend != "replay" else None
+    # a hedged backend's thread pool is shut down, and the spend of its abandoned requests counted, at the end
+    with backend:
+        if args.low_memory:
+            main_low_memory(args.pdf_path, api_key, max_concurrency, base_url, cache, backend=backend,
+                            metrics=ExtractionMetrics(Path("election_data_cumulative.metrics.jsonl")),
+                            ndjson_path=Path("election_data_cumulative.ndjson"), max_rss_mb=args.max_rss_mb,
+                            skip_non_result_pages=not args.all_pages, page_overrides_path=args.page_overrides,
+                            results_db_path=args.db)
+        else:
+            main(args.pdf_path, api_key, max_concurrency, base_url, cache, use_rule_parser=True,
+                 resume=args.resume, export_formats=("parquet",), validate=True, backend=backend,
+                 metrics=ExtractionMetrics(Path("election_data_cumulative.metrics.jsonl")), compact_prompts=True,
+                 stream=args.stream, ndjson_path=Path("election_data_cumulative.ndjson"),
+                 skip_non_result_pages=not args.all_pages, page_overrides_path=args.page_overrides,
+                 results_db_path=args.db)
\ No newline at end of file
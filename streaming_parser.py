@@ -0,0 +1,79 @@
+from typing import Iterator, List, Optional, Tuple, Union
+
+from extraction_models import Contest, Summary, ElectionData
+
+
+# the model's answer is one JSON object, {"contests": [...], "summary": [...]}, generated left to right.
+# ItemScanner reads it as it streams in and hands back every object in those top-level arrays as soon as its
+# closing brace arrives, so a contest can be merged while the model is still writing the next one.
+# It only tracks nesting and strings - the JSON of each finished item is parsed (and validated) by pydantic.
+
+StreamItem = Union[Contest, Summary]
+
+
+class ItemScanner:
+    "Feed it the answer a piece at a time; yields (array name, item JSON) for every finished top-level array item"
+
+    def __init__(self):
+        self.text = ""
+        self.position = 0  # how far into text we have scanned
+        self.stack: List[str] = []  # open brackets
+        self.in_string = False
+        self.escaped = False
+        self.string_start = 0
+        self.last_string = ""
+        self.array_name: Optional[str] = None  # the key of the top-level array we're in
+        self.item_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> Iterator[Tuple[str, str]]:
+        self.text += chunk
+        text = self.text
+        for i in range(self.position, len(text)):
+            char = text[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    self.last_string = text[self.string_start + 1:i]
+            elif char == '"':
+                self.in_string = True
+                self.string_start = i
+            elif char == ":" and len(self.stack) == 1:
+                self.array_name = self.last_string
+            elif char in "{[":
+                if char == "{" and self.stack == ["{", "["]:
+                    self.item_start = i
+                self.stack.append(char)
+            elif char in "}]" and self.stack:
+                self.stack.pop()
+                if char == "}" and self.stack == ["{", "["] and self.item_start is not None:
+                    yield self.array_name, text[self.item_start:i + 1]
+                    self.item_start = None
+        self.position = len(text)
+        # nothing before an unfinished item is needed again
+        if self.item_start is None and not self.in_string:
+            self.text, self.position = "", 0
+        elif self.item_start is not None and self.item_start > 0:
+            self.text, self.position = text[self.item_start:], len(text) - self.item_start
+            self.string_start -= self.item_start
+            self.item_start = 0
+
+
+def election_items(data: Optional[ElectionData]) -> Iterator[StreamItem]:
+    "The items of a whole answer, in the order the model writes them"
+    if data is None:
+        return
+    yield from data.contests
+    yield from data.summary
+
+
+def parse_item(array_name: str, item_json: str) -> Optional[StreamItem]:
+    "A finished ElectionData item; None for anything that isn't a contest or summary"
+    if array_name == "contests":
+        return Contest.model_validate_json(item_json)
+    if array_name == "summary":
+        return Summary.model_validate_json(item_json)
+    return None
@@ -0,0 +1,46 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# the modules live in the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from openai_stub import OpenAIStub
+
+
+def stub_pages(count: int) -> list:
+    "Page texts in the report layout, as far as the stub is concerned: a header that ends in the page number"
+    return [f"Final Cumulative Report Humboldt County Official Results\nRun Date 03/07/2024 Page {page_num + 1}\n"
+            f"body of page {page_num + 1}\n" for page_num in range(count)]
+
+
+def write_pdf(path: Path, page_texts: list):
+    "A minimal PDF with one page per text, one line of Helvetica per line of text"
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        lines = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in text.splitlines()]
+        content = "BT /F1 10 Tf 14 TL 40 750 Td " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+                       f"/Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    pdf, offsets = b"%PDF-1.4\n", []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    pdf += "".join(f"{offset:010} 00000 n \n" for offset in offsets).encode("latin-1")
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(pdf)
+
+
+@pytest.fixture
+def stub():
+    "A stub OpenAI endpoint that answers at once; tests change its behaviour through its attributes"
+    with OpenAIStub() as server:
+        yield server
@@ -0,0 +1,37 @@
+from conftest import stub_pages
+from extraction_metrics import ExtractionMetrics
+from extraction_models import Choice, ElectionData
+from openai_stub import STUB_PAGE, stub_answer
+from scrape_election_pdf_structured import MAX_SINGLE_PAGE_OUTPUT_TOKENS, extract_pages_adaptive
+
+MAX_TOKENS = 300  # room for the answer to two stub pages
+
+
+def long_page_3(prompt: str) -> ElectionData:
+    "The stub's answer, with page 3's contest too long to fit MAX_TOKENS even on its own"
+    data = stub_answer(prompt)
+    for contest in data.contests:
+        if contest.name == "STUB CONTEST PAGE 3":
+            contest.choices += [Choice(name=f"CANDIDATE {number}", writein=False, vote_in_center=0, vote_by_mail=0,
+                                       vote_total=0) for number in range(20)]
+    return data
+
+
+def test_truncated_batches_are_split_and_single_pages_retried_with_more_tokens(stub):
+    stub.max_pages = 2
+    stub.answer = long_page_3
+    page_texts = stub_pages(5)
+    metrics = ExtractionMetrics()
+    span = metrics.batch(0, list(range(5)), "".join(page_texts))
+
+    data = extract_pages_adaptive(0, list(range(5)), page_texts, "stub", stub.base_url, max_tokens=MAX_TOKENS, span=span)
+
+    assert [contest.name for contest in data.contests] == [f"STUB CONTEST PAGE {page}" for page in range(1, 6)]
+    assert len(data.contests[2].choices) == 21
+    requests = [([int(page) for page in STUB_PAGE.findall(request["prompt"])], request["max_tokens"])
+                for request in stub.requests]
+    # 1-5 is cut off and split, 1-2 fits, 3-5 is cut off and split again, 3 alone doesn't fit and is retried
+    # with the single page budget, 4-5 fits
+    assert requests == [([1, 2, 3, 4, 5], MAX_TOKENS), ([1, 2], MAX_TOKENS), ([3, 4, 5], MAX_TOKENS), ([3], MAX_TOKENS),
+                        ([3], MAX_SINGLE_PAGE_OUTPUT_TOKENS), ([4, 5], MAX_TOKENS)]
+    assert span.splits == 2
@@ -0,0 +1,44 @@
+import json
+
+from conftest import stub_pages, write_pdf
+from bulk_extraction import ingest, prepare, response_format, run_local
+from extraction_cache import ExtractionCache
+from extraction_models import ElectionData
+
+
+def test_prepare_run_local_ingest_round_trip(stub, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the page text cache
+    write_pdf(tmp_path / "reports" / "humboldt.pdf", stub_pages(3))
+    write_pdf(tmp_path / "reports" / "trinity.pdf", stub_pages(2))
+    requests_path, cache = tmp_path / "batch_requests.jsonl", ExtractionCache(tmp_path / "cache")
+    # the stub reads the page numbers in the report header, which compaction and the classifier would take away
+    options = {"compact_prompts": False, "skip_non_result_pages": False}
+
+    request_files = prepare([str(tmp_path / "reports")], requests_path, cache=cache, **options)
+    requests = [json.loads(line) for path in request_files for line in path.read_text().splitlines()]
+    assert [request["custom_id"] for request in requests] == ["humboldt:1-3", "trinity:1-2"]
+
+    results_path = tmp_path / "batch_output.jsonl"
+    run_local(request_files, results_path, "stub", stub.base_url, max_concurrency=2)
+    assert [json.loads(line)["custom_id"] for line in results_path.read_text().splitlines()] == \
+        [request["custom_id"] for request in requests]
+    assert stub.max_in_flight <= 2
+
+    rollup = ingest([results_path], requests_path, tmp_path / "results", cache)
+    for name, pages in (("humboldt", 3), ("trinity", 2)):
+        data = ElectionData.model_validate_json((tmp_path / "results" / name / "election_data.json").read_text())
+        assert [contest.name for contest in data.contests] == [f"STUB CONTEST PAGE {page}" for page in range(1, pages + 1)]
+    # both reports number their pages from 1, so the roll-up adds their contests up
+    assert len(rollup.contests) == 3
+
+    # every answer went into the extraction cache, so preparing again has nothing left to send
+    assert prepare([str(tmp_path / "reports")], requests_path, cache=cache, **options) == []
+
+
+def test_response_format_is_strict():
+    schema = response_format(ElectionData)["json_schema"]["schema"]
+    objects = [schema, *schema["$defs"].values()]
+    for node in objects:
+        assert node["additionalProperties"] is False
+        assert node["required"] == list(node["properties"])
+        assert all("default" not in field for field in node["properties"].values())
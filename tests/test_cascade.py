@@ -0,0 +1,49 @@
+import rate_limiter
+from conftest import stub_pages
+from extraction_backends import CascadeBackend, StructuredOutputBackend
+from extraction_models import ElectionData
+from openai_stub import OpenAIStub, stub_answer
+from vote_validation import check_batch
+
+
+def cheap_answer(prompt: str) -> ElectionData:
+    "The stub's answer, with the votes of page 2's contest not adding up"
+    data = stub_answer(prompt)
+    for contest in data.contests:
+        if contest.name == "STUB CONTEST PAGE 2":
+            contest.choices[0].vote_total += 100
+    return data
+
+
+def test_check_batch():
+    text = stub_pages(1)[0]
+    assert check_batch(stub_answer(text), text) == []
+    assert check_batch(stub_answer(text), text, "length") == ["truncated"]
+    assert check_batch(None, text) == ["no valid answer"]
+    assert check_batch(cheap_answer(stub_pages(2)[1]), text) == ["vote arithmetic off in 1 contests"]
+
+
+def test_escalates_only_failed_answers_within_the_rate_limit(monkeypatch):
+    acquired = []
+    monkeypatch.setattr(rate_limiter, "acquire", lambda tokens: acquired.append(tokens) or 0.0)
+    page_texts = stub_pages(2)
+    with OpenAIStub(answer=cheap_answer) as cheap, OpenAIStub() as strong:
+        backend = CascadeBackend(tiers=[StructuredOutputBackend("stub", cheap.base_url, "gpt-4o-mini"),
+                                        StructuredOutputBackend("stub", strong.base_url, "gpt-4o-2024-08-06")])
+        first = backend.extract("system", page_texts[0], 1000)
+        second = backend.extract("system", page_texts[1], 1000)
+        strong_prompts = [request["prompt"] for request in strong.requests]
+
+    # page 1's cheap answer passes check_batch; page 2's doesn't, and the strong model answers it
+    assert first.model == "gpt-4o-mini" and first.data.contests[0].choices[0].vote_total == 2
+    assert second.model == "gpt-4o-2024-08-06" and second.data.contests[0].choices[0].vote_total == 3
+    assert strong_prompts == [page_texts[1]]
+    # the escalation was a second request, so it waited for the budget like the first one did before the backend
+    assert len(acquired) == 1 and acquired[0] > 1000
+
+    # the escalated answer carries both tiers' tokens, and each tier's requests are accounted to it
+    assert second.prompt_tokens == 2 * (len(page_texts[1]) // 4)
+    usage = backend.usage()
+    assert [(tier["requests"], tier["accepted"], tier["escalated"]) for tier in usage["tiers"]] == [(2, 1, 1), (1, 1, 0)]
+    assert usage["tiers"][0]["escalation_rate"] == 0.5
+    assert all(tier["cost_usd"] > 0 for tier in usage["tiers"])
@@ -0,0 +1,79 @@
+import pytest
+
+from election_store import (DuplicateEntryError, DuplicatePolicy, ElectionStore, PageOrderedMerge,
+                            normalize_choice_name, normalize_contest_name)
+from extraction_models import Choice, Contest, ElectionData, Summary
+
+
+def choice(name: str, center: int, mail: int) -> Choice:
+    return Choice(name=name, writein="(W)" in name, vote_in_center=center, vote_by_mail=mail, vote_total=center + mail)
+
+
+def summary(contest: str, undervotes: int) -> Summary:
+    return Summary(contest=contest, **{field: undervotes if field.startswith("undervotes") else 0
+                                       for field in Summary.model_fields if field != "contest"})
+
+
+def batch(contest: str, choice_name: str, center: int, undervotes: int) -> ElectionData:
+    return ElectionData(contests=[Contest(name=contest, choices=[choice(choice_name, center, 1)])],
+                        summary=[summary(contest, undervotes)])
+
+
+def test_names_normalize():
+    assert normalize_contest_name("U.S. REPRESENTATIVE DISTRICT 2 - Non-Partisan") == \
+        normalize_contest_name("US Representative District 2")
+    # the party of a primary is part of the contest
+    assert normalize_contest_name("PRESIDENT - Democratic") != normalize_contest_name("PRESIDENT - Republican")
+    assert normalize_choice_name("Chase Oliver (W)") == normalize_choice_name("CHASE OLIVER") == "chase oliver"
+    assert normalize_choice_name("Joseph R Biden Jr DEM") == normalize_choice_name("Joseph R. Biden Jr")
+    assert normalize_choice_name("DEM") == "dem"
+
+
+def merged(choice_policy: DuplicatePolicy, summary_policy: DuplicatePolicy) -> ElectionData:
+    store = ElectionStore(choice_policy=choice_policy, summary_policy=summary_policy)
+    store.merge(batch("MEASURE A - Non-Partisan", "YES", 10, 1))
+    store.merge(batch("Measure A", "Yes (W)", 5, 2))
+    return store.to_election_data()
+
+
+def test_keep_reports_duplicates_and_keeps_the_first(capsys):
+    data = merged(DuplicatePolicy.KEEP, DuplicatePolicy.KEEP)
+    assert len(data.contests) == 1 and data.contests[0].choices[0].vote_in_center == 10
+    assert data.summary[0].undervotes_total == 1
+    output = capsys.readouterr().out
+    assert "duplicate choice" in output and "duplicate summary" in output
+
+
+def test_sum_adds_split_entries_up_quietly(capsys):
+    data = merged(DuplicatePolicy.SUM, DuplicatePolicy.SUM)
+    assert data.contests[0].choices[0].vote_in_center == 15 and data.contests[0].choices[0].vote_total == 17
+    assert data.summary[0].undervotes_total == 3
+    # a summary split across two batches is normal for SUM, not an error
+    assert "OOPS" not in capsys.readouterr().out
+
+
+def test_replace_keeps_the_newest():
+    data = merged(DuplicatePolicy.REPLACE, DuplicatePolicy.REPLACE)
+    assert data.contests[0].choices[0].name == "Yes (W)"
+    assert data.summary[0].undervotes_total == 2
+
+
+def test_reject_raises():
+    store = ElectionStore(choice_policy=DuplicatePolicy.REJECT, summary_policy=DuplicatePolicy.SUM)
+    store.merge(batch("MEASURE A", "YES", 10, 1))
+    with pytest.raises(DuplicateEntryError):
+        store.merge(batch("MEASURE A", "YES", 5, 2))
+    store = ElectionStore(choice_policy=DuplicatePolicy.SUM, summary_policy=DuplicatePolicy.REJECT)
+    store.merge(batch("MEASURE A", "YES", 10, 1))
+    with pytest.raises(DuplicateEntryError):
+        store.merge(batch("MEASURE A", "NO", 5, 2))
+
+
+def test_page_ordered_merge_waits_for_earlier_batches():
+    merged_pages = []
+    merger = PageOrderedMerge([[2, 3], [0], [1]], lambda pages, result: merged_pages.append(pages))
+    merger.add([2, 3], None)
+    merger.add([1], None)
+    assert merged_pages == []
+    merger.add([0], None)
+    assert merged_pages == [[0], [1], [2, 3]]
@@ -0,0 +1,43 @@
+import os
+import time
+
+from extraction_cache import ExtractionCache
+from extraction_models import Choice, Contest, ElectionData
+
+
+def election_data(name: str) -> ElectionData:
+    return ElectionData(contests=[Contest(name=name, choices=[
+        Choice(name="YES", writein=False, vote_in_center=1, vote_by_mail=2, vote_total=3)])], summary=[])
+
+
+def test_hit_survives_eviction_between_read_and_refresh(tmp_path, monkeypatch):
+    cache = ExtractionCache(tmp_path)
+    cache.put("key", election_data("A"))
+
+    def evicted(path, *args, **kwargs):
+        os.remove(path)
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, "utime", evicted)
+    assert cache.get("key").contests[0].name == "A"
+    assert cache.stats()["hits"] == 1
+
+
+def test_put_only_scans_when_over_the_limit(tmp_path, monkeypatch):
+    entry_size = len(election_data("CONTEST 00").model_dump_json())
+    cache = ExtractionCache(tmp_path, max_bytes=10 * entry_size)
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, "evict", lambda: scans.append(1) or evict())
+
+    now = time.time()
+    for number in range(30):
+        cache.put(f"key{number}", election_data(f"CONTEST {number:02}"))
+        os.utime(tmp_path / f"key{number}.json", (now - 100 + number,) * 2)  # put order is recency order
+
+    # the first put learns the size, after that only puts that go over the limit scan
+    assert len(scans) < 30 / 2
+    total = sum(path.stat().st_size for path in tmp_path.glob("*.json"))
+    assert total <= 10 * entry_size
+    # the least recently used entries went first
+    assert cache.get("key29") is not None and cache.get("key0") is None
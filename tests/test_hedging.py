@@ -0,0 +1,62 @@
+from conftest import stub_pages
+from extraction_backends import HedgedBackend, StructuredOutputBackend
+from extraction_metrics import ExtractionMetrics
+from openai_stub import STUB_PAGE, OpenAIStub
+from scrape_election_pdf_structured import extract_batches_concurrently
+
+PAGES = 40
+SLOW_PAGES = {12, 20, 28, 36}
+SLOW_DELAY = 1.5
+
+
+def slow_first_attempt(prompt: str, attempt: int) -> float:
+    # a tenth of the pages is stuck on its first request; repeating the request gets a normal answer
+    pages = {int(page) for page in STUB_PAGE.findall(prompt)}
+    return SLOW_DELAY if attempt == 0 and pages & SLOW_PAGES else 0.05
+
+
+def batch_latencies(backend_factory) -> tuple:
+    "(batch latencies, the backend's usage once it is closed)"
+    page_texts = stub_pages(PAGES)
+    with OpenAIStub(delay=slow_first_attempt) as stub:
+        metrics = ExtractionMetrics()
+        with backend_factory(stub.base_url) as backend:
+            results = extract_batches_concurrently([[page_num] for page_num in range(PAGES)], page_texts, "stub",
+                                                   max_concurrency=4, base_url=stub.base_url, backend=backend,
+                                                   metrics=metrics)
+        assert [result.contests[0].name for result in results] == [f"STUB CONTEST PAGE {page}" for page in range(1, PAGES + 1)]
+        return sorted(span["latency"] for span in metrics.batches), backend.usage()
+
+
+def test_hedging_cuts_the_tail_within_the_spend_cap():
+    plain, plain_usage = batch_latencies(lambda base_url: StructuredOutputBackend("stub", base_url))
+    hedged, usage = batch_latencies(lambda base_url: HedgedBackend(StructuredOutputBackend("stub", base_url),
+                                                                   max_hedge_share=0.2, min_delay=0.2))
+
+    # without hedging the slowest tenth waits out the slow requests, with it they are answered by the hedge
+    assert plain[int(0.95 * (PAGES - 1))] >= SLOW_DELAY
+    assert hedged[int(0.95 * (PAGES - 1))] < SLOW_DELAY / 2
+    assert usage["hedge_wins"] >= len(SLOW_PAGES)
+    assert usage["hedges"] <= 0.2 * usage["calls"]
+
+    # the requests that lost are paid for too: every one of them is in the totals, on top of the winners
+    assert usage["requests"] == usage["calls"] + usage["hedges"]
+    assert usage["cancelled"] >= len(SLOW_PAGES)
+    assert usage["extra_prompt_tokens"] > 0
+    assert usage["prompt_tokens"] > plain_usage["prompt_tokens"]
+    assert usage["prompt_tokens"] - usage["extra_prompt_tokens"] == plain_usage["prompt_tokens"]
+
+
+def test_no_hedge_before_the_share_allows_one(stub):
+    # the first request is slower than min_delay, the second far slower than the first
+    stub.delay = lambda prompt, attempt: 0.0 if attempt else 0.2 * int(STUB_PAGE.findall(prompt)[0]) ** 3
+    page_texts = stub_pages(2)
+    with HedgedBackend(StructuredOutputBackend("stub", stub.base_url), max_hedge_share=0.5,
+                       min_samples=0, min_delay=0.05) as backend:
+        backend.extract("system", page_texts[0], 1000)
+        # one hedge in one request would be all of them, far over half
+        assert backend.usage()["hedges"] == 0
+        backend.extract("system", page_texts[1], 1000)
+        assert backend.usage()["hedges"] == 1
+    assert len(stub.attempts(page_texts[0])) == 1
+    assert len(stub.attempts(page_texts[1])) == 2
@@ -0,0 +1,33 @@
+import incremental_update
+from conftest import stub_pages
+
+
+def run_version(monkeypatch, stub, tmp_path, page_texts):
+    monkeypatch.setattr(incremental_update, "get_page_texts", lambda pdf_path: page_texts)
+    return incremental_update.main(tmp_path / "report.pdf", "stub", tmp_path / "election_data_cumulative.json",
+                                   max_concurrency=2, base_url=stub.base_url, max_input_tokens=40)
+
+
+def contest_names(data):
+    return [contest.name for contest in data.contests]
+
+
+def test_only_changed_pages_are_reextracted(monkeypatch, stub, tmp_path):
+    pages = stub_pages(4)
+    run_version(monkeypatch, stub, tmp_path, pages)
+    stub.requests.clear()
+
+    pages[2] = pages[2].replace("body of page 3", "body of page 3, with more votes counted")
+    data = run_version(monkeypatch, stub, tmp_path, pages)
+    assert [request["prompt"].count("Page 3") for request in stub.requests] == [1]
+    assert contest_names(data) == [f"STUB CONTEST PAGE {page}" for page in range(1, 5)]
+
+
+def test_contests_of_removed_pages_are_dropped(monkeypatch, stub, tmp_path):
+    run_version(monkeypatch, stub, tmp_path, stub_pages(5))
+    stub.requests.clear()
+
+    data = run_version(monkeypatch, stub, tmp_path, stub_pages(3))
+    assert stub.requests == []
+    assert contest_names(data) == [f"STUB CONTEST PAGE {page}" for page in range(1, 4)]
+    assert [summary.contest for summary in data.summary] == contest_names(data)
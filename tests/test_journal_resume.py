@@ -0,0 +1,55 @@
+import pytest
+from openai import BadRequestError
+
+from conftest import stub_pages, write_pdf
+from extraction_journal import ExtractionJournal
+from extraction_models import ElectionData
+from openai_stub import STUB_PAGE
+from pdf_text import pdf_hash
+from scrape_election_pdf_structured import main
+
+
+def stub_page_numbers(prompt: str) -> list:
+    return [int(page) for page in STUB_PAGE.findall(prompt)]
+
+
+def test_resume_only_sends_the_batches_missing_from_the_journal(stub, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the page text cache
+    pdf_path = tmp_path / "report.pdf"
+    write_pdf(pdf_path, stub_pages(5))
+    journal_path, output_path = tmp_path / "report.journal.jsonl", tmp_path / "report.json"
+    # one page per batch, so the journal has one line per page
+    options = {"journal_path": journal_path, "output_path": output_path, "max_input_tokens": 1}
+
+    # the batch of page 3 is refused, which ends the run once the other batches are in
+    stub.fail_statuses = [400]
+    stub.fail_prompt = lambda prompt: stub_page_numbers(prompt) == [3]
+    with pytest.raises(BadRequestError):
+        main(pdf_path, "stub", base_url=stub.base_url, **options)
+    assert sorted(tuple(pages) for pages in ExtractionJournal(journal_path, pdf_hash(pdf_path), resume=True).completed_batches()) \
+        == [(0,), (1,), (3,), (4,)]
+    assert not output_path.exists()
+
+    # the crash tore the journal's last line in half
+    with open(journal_path, "a") as f:
+        f.write('{"pdf_hash": "')
+    stub.requests.clear()
+    stub.fail_prompt = lambda prompt: False
+    data = main(pdf_path, "stub", base_url=stub.base_url, resume=True, **options)
+
+    assert [stub_page_numbers(request["prompt"]) for request in stub.requests] == [[3]]
+    assert [contest.name for contest in data.contests] == [f"STUB CONTEST PAGE {page}" for page in range(1, 6)]
+    assert ElectionData.model_validate_json(output_path.read_text()) == data
+    # everything the journal held is in the output now
+    assert not journal_path.exists()
+
+
+def test_a_fresh_run_starts_a_fresh_journal(tmp_path):
+    journal_path = tmp_path / "journal.jsonl"
+    journal = ExtractionJournal(journal_path, "hash-a")
+    journal.record([0], ElectionData(contests=[], summary=[]))
+    journal.record([1], None)  # a failed batch isn't journaled, so it is retried
+    assert list(ExtractionJournal(journal_path, "hash-a", resume=True).completed_batches()) == [(0,)]
+    # another PDF's journal entries are not this one's
+    assert ExtractionJournal(journal_path, "hash-b", resume=True).completed_batches() == {}
+    assert ExtractionJournal(journal_path, "hash-a").completed_batches() == {}
@@ -0,0 +1,69 @@
+import json
+
+from election_store import ElectionStore
+from extraction_models import Choice, Contest, ElectionData, Summary
+from ndjson_sink import NdjsonSink, read_ndjson
+
+
+def batch(*contests: tuple) -> ElectionData:
+    "(name, votes) contests, each with its summary"
+    return ElectionData(
+        contests=[Contest(name=name, choices=[Choice(name=f"CHOICE {votes}", writein=False, vote_in_center=votes,
+                                                     vote_by_mail=0, vote_total=votes)]) for name, votes in contests],
+        summary=[Summary(contest=name, **{field: 0 for field in Summary.model_fields if field != "contest"})
+                 for name, _ in contests])
+
+
+def records(path) -> list:
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def written(path) -> list:
+    return [record["data"]["name"] for record in records(path) if record["type"] == "contest"]
+
+
+def test_contests_are_written_once_they_can_no_longer_grow(tmp_path):
+    path = tmp_path / "results.ndjson"
+    sink, store = NdjsonSink(path), ElectionStore()
+
+    def merge(data: ElectionData):
+        store.merge(data)
+        sink.batch_merged(store, data)
+
+    # MEASURE B continues from the first batch into the second
+    merge(batch(("MEASURE A", 1), ("MEASURE B", 2)))
+    assert written(path) == []
+    merge(batch(("MEASURE B", 3), ("MEASURE C", 4)))
+    assert written(path) == ["MEASURE A"]
+    merge(batch(("MEASURE D", 5)))
+    assert written(path) == ["MEASURE A", "MEASURE B", "MEASURE C"]
+    # both of B's batches are in its record, and its summary follows it
+    assert [record["type"] for record in records(path)][2:4] == ["contest", "summary"]
+    assert len(records(path)[2]["data"]["choices"]) == 2
+
+    # a patched contest is written again, and readers take the newest record
+    store.contest("MEASURE C").choices[0].vote_total = 40
+    sink.update(store, ["MEASURE C"])
+    assert written(path) == ["MEASURE A", "MEASURE B", "MEASURE C", "MEASURE C"]
+    assert read_ndjson(path).contests[2].choices[0].vote_total == 40
+
+    # a reader can catch a line half written
+    with open(path, "a") as f:
+        f.write('{"type": "contest", "data": {"na')
+    assert [contest.name for contest in read_ndjson(path).contests] == ["MEASURE A", "MEASURE B", "MEASURE C"]
+
+    # close writes what is still open and leaves a compacted snapshot, one record per contest and summary
+    sink.close(store)
+    assert written(path) == ["MEASURE A", "MEASURE B", "MEASURE C", "MEASURE D"]
+    assert records(path)[-1] == {"type": "end", "contests": 4, "summaries": 4}
+    assert read_ndjson(path) == store.to_election_data()
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_failed_batches_finish_the_open_contests(tmp_path):
+    path = tmp_path / "results.ndjson"
+    sink, store = NdjsonSink(path), ElectionStore()
+    store.merge(batch(("MEASURE A", 1)))
+    sink.batch_merged(store, batch(("MEASURE A", 1)))
+    sink.batch_merged(store, None)
+    assert written(path) == ["MEASURE A"]
@@ -0,0 +1,37 @@
+import json
+
+from page_classifier import PageOverrides, filter_result_pages, load_page_overrides
+
+HEADER = "Final Cumulative Report Humboldt County Official Results\nRun Date 03/07/2024 Page {page}\n"
+COVER = HEADER.format(page=1) + "Presidential Primary Election\nMarch 5, 2024\nTable of Contents\nNotes on this report\n"
+RESULTS = HEADER.format(page=2) + "\n".join([
+    "PRESIDENT - Democratic - Vote for One", "Choice Party Vote Center Vote-by-Mail Total",
+    "Joseph R Biden Jr DEM 1,185 79.74% 16,063 88.51% 17,248 87.84%",
+    "Cast Votes: 1,486 100.00% 18,149 100.00% 19,635 100.00%", "Undervotes: 78 1,022 1,100", "Overvotes: 0 1 1"]) + "\n"
+BLANK = HEADER.format(page=3)
+PAGES = [COVER, RESULTS, BLANK]
+
+
+def test_pages_without_results_are_skipped():
+    pages, skipped = filter_result_pages([0, 1, 2], PAGES)
+    assert pages == [1]
+    assert sorted(skipped) == [0, 2]
+    assert "'Table of Contents'" in skipped[0] and "blank" in skipped[2]
+
+
+def test_page_overrides_force_pages_both_ways(tmp_path):
+    overrides_path = tmp_path / "page_overrides.json"
+    overrides_path.write_text(json.dumps({"report.pdf": {"keep": [1], "skip": [2]}, "other.pdf": {"classify": False}}))
+
+    overrides = load_page_overrides(tmp_path / "reports" / "report.pdf", overrides_path)
+    assert overrides == PageOverrides(keep=[1], skip=[2])
+    pages, skipped = filter_result_pages([0, 1, 2], PAGES, overrides)
+    assert pages == [0]
+    assert skipped[1] == "skipped in page overrides" and 2 in skipped
+
+    pages, skipped = filter_result_pages([0, 1, 2], PAGES, load_page_overrides(tmp_path / "other.pdf", overrides_path))
+    assert pages == [0, 1, 2] and skipped == {}
+
+    # no entry, or no file, means the classifier decides alone
+    assert load_page_overrides(tmp_path / "unlisted.pdf", overrides_path) is None
+    assert load_page_overrides(tmp_path / "report.pdf", tmp_path / "missing.json") is None
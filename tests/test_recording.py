@@ -0,0 +1,39 @@
+import pytest
+
+from conftest import stub_pages
+from extraction_backends import (CascadeBackend, MissingRecordingError, RecordingBackend, ReplayBackend,
+                                 StructuredOutputBackend, TruncatedResponseError)
+from openai_stub import OpenAIStub
+
+
+def test_record_then_replay_offline(tmp_path):
+    page_texts = stub_pages(3)
+    with OpenAIStub(max_pages=2) as stub:
+        backend = RecordingBackend(StructuredOutputBackend("stub", stub.base_url), tmp_path)
+        recorded = backend.extract("system", page_texts[0], 1000)
+        with pytest.raises(TruncatedResponseError):
+            backend.extract("system", "".join(page_texts), 1000)
+
+    # the stub is gone, the recordings answer the same prompts the same way - truncation included
+    replay = ReplayBackend(tmp_path)
+    replayed = replay.extract("system", page_texts[0], 1000)
+    assert replayed.data == recorded.data
+    assert (replayed.prompt_tokens, replayed.completion_tokens) == (recorded.prompt_tokens, recorded.completion_tokens)
+    with pytest.raises(TruncatedResponseError):
+        replay.extract("system", "".join(page_texts), 1000)
+    with pytest.raises(MissingRecordingError):
+        replay.extract("system", page_texts[1], 1000)
+
+
+def test_cascade_recordings_are_not_the_last_tiers(tmp_path):
+    page_text = stub_pages(1)[0]
+    with OpenAIStub() as stub:
+        cascade = CascadeBackend(tiers=[StructuredOutputBackend("stub", stub.base_url, "gpt-4o-mini"),
+                                        StructuredOutputBackend("stub", stub.base_url)])
+        backend = RecordingBackend(cascade, tmp_path)
+        assert backend.cache_id == cascade.cache_id
+        backend.extract("system", page_text, 1000)
+
+    # a replay of the plain model must not be served the cascade's answer
+    with pytest.raises(MissingRecordingError):
+        ReplayBackend(tmp_path, model=cascade.model).extract("system", page_text, 1000)
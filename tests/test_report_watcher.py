@@ -0,0 +1,60 @@
+import os
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from conftest import write_pdf
+from report_watcher import incremental_updater, poll, report_dir
+
+
+def report_pages(county: str, changed_page: int = 0) -> list:
+    return [f"Final Cumulative Report {county} County Official Results\nRun Date 03/07/2024 Page {page}\n"
+            f"{county} results on page {page}{' with more ballots counted' if page == changed_page else ''}"
+            for page in range(1, 4)]
+
+
+@pytest.fixture
+def site(tmp_path):
+    "python -m http.server, in a thread, serving tmp_path/site"
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=str(tmp_path / "site")))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield tmp_path / "site", f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_same_file_names_keep_separate_state_and_only_changed_pages_rerun(stub, site, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the page text cache
+    site_dir, site_url = site
+    write_pdf(site_dir / "a" / "results.pdf", report_pages("Humboldt"))
+    write_pdf(site_dir / "b" / "results.pdf", report_pages("Trinity"))
+    sources = [f"{site_url}/a/results.pdf", f"{site_url}/b/results.pdf"]
+    state, output_dir = {}, tmp_path / "results"
+    on_change = incremental_updater(output_dir, "stub", base_url=stub.base_url)
+
+    assert len(poll(sources, state, on_change, tmp_path / "downloads", None)) == 2
+    assert sum(request["prompt"].count("Run Date") for request in stub.requests) == 2 * 3
+    dirs = {report_dir(output_dir, source, tmp_path / "results.pdf") for source in sources}
+    assert len(dirs) == 2 and all((path / "election_data_cumulative.pages.json").exists() for path in dirs)
+
+    # a new version of a's report with one changed page, posted a little later
+    stub.requests.clear()
+    write_pdf(site_dir / "a" / "results.pdf", report_pages("Humboldt", changed_page=2))
+    later = os.stat(site_dir / "a" / "results.pdf").st_mtime + 10
+    os.utime(site_dir / "a" / "results.pdf", (later, later))
+
+    assert len(poll(sources, state, on_change, tmp_path / "downloads", None)) == 1
+    assert len(stub.requests) == 1
+    assert stub.requests[0]["prompt"].count("Run Date") == 1
+    assert "Humboldt results on page 2 with more ballots counted" in stub.requests[0]["prompt"]
+
+    # b was unchanged: a 304, and nothing re-extracted
+    stub.requests.clear()
+    assert poll(sources, state, on_change, tmp_path / "downloads", None) == []
+    assert stub.requests == []
@@ -0,0 +1,60 @@
+from conftest import write_pdf
+from extraction_models import Choice, Contest, ElectionData, Summary
+from pdf_text import pdf_hash
+from results_db import ReportIdentity, ResultsDatabase, identify_report
+
+HEADER = ("First Post Election Update Humboldt County Unofficial Results\n3/5/2024\nRun Time 9:52 AM\n"
+          "Run Date 03/07/2024 Page 1\n")
+
+
+def results(yes: int, no: int) -> ElectionData:
+    return ElectionData(
+        contests=[Contest(name="MEASURE A - Non-Partisan", choices=[
+            Choice(name="YES", writein=False, vote_in_center=yes, vote_by_mail=yes, vote_total=2 * yes),
+            Choice(name="NO", party=None, writein=False, vote_in_center=no, vote_by_mail=0, vote_total=no)])],
+        summary=[Summary(contest="MEASURE A - Non-Partisan", **{field: 1 for field in Summary.model_fields if field != "contest"})])
+
+
+def version(run: str) -> ReportIdentity:
+    return ReportIdentity(election="2024-03-05", jurisdiction="Humboldt County", version=run)
+
+
+def test_identify_report_from_the_header(tmp_path):
+    assert identify_report(tmp_path / "report.pdf", HEADER) == ReportIdentity(
+        election="2024-03-05", jurisdiction="Humboldt County", version="2024-03-07T09:52", title="First Post Election Update")
+    # without the usual header the file is the report
+    write_pdf(tmp_path / "odd.pdf", ["no header here"])
+    assert identify_report(tmp_path / "odd.pdf", "no header here") == ReportIdentity(
+        election="odd", version=pdf_hash(tmp_path / "odd.pdf")[:12])
+
+
+def test_versions_deltas_and_round_trip(tmp_path):
+    with ResultsDatabase(tmp_path / "results.sqlite") as db:
+        first, second = db.upsert_many([(version("2024-03-07T09:52"), results(10, 5), "first.pdf"),
+                                        (version("2024-03-08T17:00"), results(15, 9), "second.pdf")])
+        assert db.report_data(first) == results(10, 5)
+        assert db.report_data(second) == results(15, 9)
+
+        deltas = {(row["version"], row["choice"]): row for row in db.deltas("2024-03-05")}
+        assert deltas[("2024-03-07T09:52", "YES")]["previous_version"] is None
+        assert deltas[("2024-03-07T09:52", "YES")]["vote_total_delta"] is None
+        assert deltas[("2024-03-08T17:00", "YES")]["previous_version"] == "2024-03-07T09:52"
+        assert deltas[("2024-03-08T17:00", "YES")]["vote_total_delta"] == 10
+        assert deltas[("2024-03-08T17:00", "NO")]["vote_total_delta"] == 4
+        assert [row["choice"] for row in db.deltas("2024-03-05", version="2024-03-08T17:00")] == ["YES", "NO"]
+
+
+def test_upserting_a_version_again_is_idempotent(tmp_path):
+    with ResultsDatabase(tmp_path / "results.sqlite") as db:
+        report_id = db.upsert(version("2024-03-07T09:52"), results(10, 5), "first.pdf")
+        before = db.reports()
+        assert db.upsert(version("2024-03-07T09:52"), results(10, 5)) == report_id
+        assert [{**report, "loaded_at": None} for report in db.reports()] == [{**report, "loaded_at": None} for report in before]
+        assert db.report_data(report_id) == results(10, 5)
+        assert len(db.choice_history("Measure A", "yes")) == 1
+
+        # a corrected re-run of the same version replaces what was stored, it doesn't add to it
+        corrected = results(11, 5)
+        corrected.contests[0].choices.pop()
+        db.upsert(version("2024-03-07T09:52"), corrected)
+        assert db.report_data(report_id) == corrected
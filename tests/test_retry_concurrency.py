@@ -0,0 +1,66 @@
+import random
+import time
+
+import pytest
+from openai import BadRequestError, InternalServerError
+
+from conftest import stub_pages
+from scrape_election_pdf_structured import extract_batches_concurrently, extract_with_retry, retry_delay
+
+
+def test_retries_rate_limits_and_server_errors(stub):
+    stub.fail_statuses = [429, 500, 503]
+    text = stub_pages(1)[0]
+    data = extract_with_retry(0, text, "stub", stub.base_url, max_retries=5, base_delay=0.01)
+    assert [contest.name for contest in data.contests] == ["STUB CONTEST PAGE 1"]
+    assert [request["status"] for request in stub.attempts()] == [429, 500, 503, 200]
+
+
+def test_gives_up_after_max_retries(stub):
+    stub.fail_statuses = [500, 500, 500]
+    with pytest.raises(InternalServerError):
+        extract_with_retry(0, stub_pages(1)[0], "stub", stub.base_url, max_retries=2, base_delay=0.01)
+    assert len(stub.attempts()) == 3
+
+
+def test_does_not_retry_client_errors(stub):
+    stub.fail_statuses = [400]
+    with pytest.raises(BadRequestError):
+        extract_with_retry(0, stub_pages(1)[0], "stub", stub.base_url, max_retries=5, base_delay=0.01)
+    assert len(stub.attempts()) == 1
+
+
+def test_waits_for_retry_after(stub):
+    stub.fail_statuses = [429, 429]
+    stub.retry_after = 0.3
+    extract_with_retry(0, stub_pages(1)[0], "stub", stub.base_url, max_retries=5, base_delay=0.01)
+    starts = [request["start"] for request in stub.attempts()]
+    assert all(later - earlier >= 0.3 for earlier, later in zip(starts, starts[1:]))
+
+
+def test_backoff_is_jittered_and_capped():
+    random.seed(1)
+    err = RuntimeError("no response, so no Retry-After")
+    for attempt in range(8):
+        delays = [retry_delay(attempt, err, base_delay=1.0, max_delay=30.0) for _ in range(200)]
+        ceiling = min(30.0, 2 ** attempt)
+        assert all(0 <= delay <= ceiling for delay in delays)
+        # full jitter: spread over the whole range, not bunched at the ceiling
+        assert min(delays) < ceiling / 4 and max(delays) > ceiling * 3 / 4
+
+
+def test_concurrent_results_come_back_in_page_order(stub):
+    page_texts = stub_pages(8)
+    # the earlier the page, the slower its answer, so the batches finish in reverse order
+    stub.delay = lambda prompt, attempt: 0.05 * (9 - int(prompt.split("Page ")[1].split()[0]))
+    finished = []
+    start = time.perf_counter()
+    results = extract_batches_concurrently([[page_num] for page_num in range(8)], page_texts, "stub", max_concurrency=4,
+                                           base_url=stub.base_url, on_result=lambda pages, result: finished.append(pages[0]))
+    elapsed = time.perf_counter() - start
+
+    assert [result.contests[0].name for result in results] == [f"STUB CONTEST PAGE {page}" for page in range(1, 9)]
+    assert finished != sorted(finished)
+    assert stub.max_in_flight == 4
+    # one request at a time would take the sum of the delays, 1.8s
+    assert elapsed < 1.2
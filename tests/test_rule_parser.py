@@ -0,0 +1,56 @@
+from pathlib import Path
+
+import pytest
+
+from election_store import ElectionStore
+from extraction_models import ElectionData
+from rule_parser import parse_page, parse_pages
+from scrape_election_pdf_structured import get_page_texts
+
+REPO = Path(__file__).resolve().parent.parent
+HEADER = "Final Cumulative Report Humboldt County Official Results\nRun Date 03/07/2024 Page 1\n"
+
+
+@pytest.fixture
+def page_texts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the page text cache
+    return lambda name: get_page_texts(REPO / name)
+
+
+def test_fall_2024_report_parses_to_the_committed_results(page_texts):
+    parsed, fallback = parse_pages(page_texts("Fall-2024-first-post-report.pdf"))
+    assert fallback == []
+    store = ElectionStore()
+    for page_num in sorted(parsed):
+        store.merge(parsed[page_num])
+    assert store.to_election_data() == ElectionData.model_validate_json((REPO / "election_data_cumulative.json").read_text())
+
+
+def test_other_column_layouts_go_to_the_model(page_texts):
+    # the 2020 report has Election Day and Early Voting columns, and contests split across pages
+    texts = page_texts("large-pagesplit-election-spring2020.pdf")
+    parsed, fallback = parse_pages(texts)
+    assert parsed == {} and fallback == list(range(len(texts)))
+
+
+def contest_page(*choice_lines: str, cast: str = "Cast Votes: 10 100.00% 20 100.00% 30 100.00%") -> str:
+    return HEADER + "\n".join(["MEASURE A - Vote for One", "Choice Party Vote Center Vote-by-Mail Total", *choice_lines,
+                               cast, "Undervotes: 1 2 3", "Overvotes: 0 0 0"]) + "\n"
+
+
+def test_wrapped_names_and_write_ins():
+    data = parse_page(contest_page("Kamala D. Harris DEM 6 60.00% 10 50.00% 16 53.33%",
+                                   "and Tim Walz",
+                                   "Jane Q Public 4 40.00% 10 50.00% 14 46.67%",
+                                   "(W)"))
+    choices = data.contests[0].choices
+    assert [(choice.name, choice.party, choice.writein) for choice in choices] == [
+        ("Kamala D. Harris and Tim Walz", "DEM", False), ("Jane Q Public (W)", None, True)]
+    assert data.summary[0].undervotes_total == 3
+
+
+def test_pages_it_cant_vouch_for_are_left_to_the_model():
+    # votes that don't add up, and a contest that runs onto the next page
+    assert parse_page(contest_page("YES 6 60.00% 10 50.00% 17 56.67%", "NO 4 40.00% 10 50.00% 14 46.67%")) is None
+    assert parse_page(HEADER + "MEASURE A - Vote for One\nChoice Party Vote Center Vote-by-Mail Total\n"
+                      "YES 6 60.00% 10 50.00% 16 53.33%\n") is None
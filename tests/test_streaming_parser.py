@@ -0,0 +1,44 @@
+import json
+import random
+
+from extraction_models import Choice, Contest, ElectionData, Summary
+from streaming_parser import ItemScanner, election_items, parse_item
+
+# names with the characters the scanner has to see through: braces and brackets in strings, escaped quotes, backslashes
+NAMES = ['MEASURE {A} - "Yes on A"', "PRESIDENT [Democratic] \\ }{", 'JUDGE \\"X\\" }', "PLAIN"]
+
+
+def answer() -> ElectionData:
+    contests = [Contest(name=name, choices=[Choice(name=f"{name} choice", writein=False, vote_in_center=1, vote_by_mail=2,
+                                                   vote_total=3)]) for name in NAMES]
+    summaries = [Summary(contest=name, **{field: 0 for field in Summary.model_fields if field != "contest"}) for name in NAMES]
+    return ElectionData(contests=contests, summary=summaries)
+
+
+def scan(text: str, cuts: list) -> list:
+    scanner, items = ItemScanner(), []
+    for start, end in zip([0] + cuts, cuts + [len(text)]):
+        items.extend(scanner.feed(text[start:end]))
+    return items
+
+
+def test_items_come_out_whole_however_the_answer_is_chunked():
+    data = answer()
+    text = data.model_dump_json(indent=1)
+    expected = [("contests", contest.model_dump_json()) for contest in data.contests] + \
+               [("summary", summary.model_dump_json()) for summary in data.summary]
+    rng = random.Random(7)
+    for trial in range(300):
+        cuts = sorted(rng.sample(range(1, len(text)), rng.randint(1, 60)))
+        items = scan(text, cuts)
+        assert [(name, json.loads(item)) for name, item in items] == [(name, json.loads(item)) for name, item in expected]
+    # one character at a time, every boundary at once
+    assert len(scan(text, list(range(1, len(text))))) == len(expected)
+
+
+def test_parse_item_and_election_items():
+    data = answer()
+    items = [parse_item(name, item) for name, item in scan(data.model_dump_json(), [])]
+    assert items == list(election_items(data))
+    assert parse_item("notes", "{}") is None
+    assert list(election_items(None)) == []
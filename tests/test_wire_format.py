@@ -0,0 +1,35 @@
+import pytest
+
+from extraction_models import Choice, Contest, ElectionData, Summary
+from wire_format import CompactContest, CompactElectionData, decode, encode
+
+
+def summary(contest: str, base: int) -> Summary:
+    return Summary(contest=contest, **{field: base + number
+                                       for number, field in enumerate(name for name in Summary.model_fields if name != "contest")})
+
+
+def test_encode_decode_round_trip():
+    data = ElectionData(
+        contests=[Contest(name="PRESIDENT - Democratic", choices=[
+                      Choice(name="Joseph R Biden Jr", party="DEM", writein=False, vote_in_center=1185, vote_by_mail=16063,
+                             vote_total=17248),
+                      Choice(name="James Mark Merts (W)", party=None, writein=True, vote_in_center=0, vote_by_mail=0,
+                             vote_total=0)]),
+                  Contest(name="MEASURE A", choices=[
+                      Choice(name="YES", writein=False, vote_in_center=3, vote_by_mail=4, vote_total=7)])],
+        # MEASURE A has no summary in this batch, and the last summary's contest has no choices in it
+        summary=[summary("PRESIDENT - Democratic", 0), summary("US SENATOR", 100)])
+    compact = encode(data)
+    assert [contest.name for contest in compact.contests] == ["PRESIDENT - Democratic", "MEASURE A", "US SENATOR"]
+    assert compact.contests[0].choices[1] == ["James Mark Merts (W)", None, 1, 0, 0, 0]
+    assert compact.contests[1].summary is None and compact.contests[2].choices is None
+    # through the JSON the model sends, and back
+    assert decode(CompactElectionData.model_validate_json(compact.model_dump_json())) == data
+
+
+def test_wrong_array_lengths_are_rejected():
+    with pytest.raises(ValueError, match="should have 6 entries"):
+        decode(CompactElectionData(contests=[CompactContest(name="MEASURE A", choices=[["YES", None, 0, 3, 4]], summary=None)]))
+    with pytest.raises(ValueError, match="should have 12 numbers"):
+        decode(CompactElectionData(contests=[CompactContest(name="MEASURE A", choices=None, summary=[0] * 11)]))
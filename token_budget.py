@@ -0,0 +1,92 @@
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # optional - fall back to the usual ~4 characters per token estimate
+    tiktoken = None
+
+
+# batches are packed by how many tokens they will cost, not by page count:
+# a page of turnout statistics is cheap, a page with 40 write-in candidates is not.
+# The output side is usually the limit - every choice row becomes a JSON object with 6 keys,
+# and every contest adds a 13 field Summary.
+
+DEFAULT_MAX_INPUT_TOKENS = 12000
+DEFAULT_MAX_OUTPUT_TOKENS = 4000
+# leave headroom under max_tokens, the output estimate is only an estimate
+OUTPUT_SAFETY_MARGIN = 0.75
+
+# measured on the committed election_data_cumulative.json (Fall 2024 report, compact JSON)
+TOKENS_PER_CHOICE = 32
+TOKENS_PER_CONTEST = 130
+TOKENS_PER_RESPONSE = 20
+
+# choice rows end in a percentage; "Cast Votes:" and the precinct turnout row (starts with a number) don't count
+CHOICE_ROW = re.compile(r"^(?!Cast Votes:)(?!\d).*\d+\.\d+%\s*$", re.MULTILINE)
+SUMMARY_BLOCK = re.compile(r"^Undervotes:", re.MULTILINE | re.IGNORECASE)
+
+_encodings = {}
+
+
+def get_encoding(model: str):
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        try:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            # tiktoken downloads its tables on first use, which fails on an offline machine
+            _encodings[model] = None
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+def estimate_output_tokens(text: str) -> int:
+    choices = len(CHOICE_ROW.findall(text))
+    contests = len(SUMMARY_BLOCK.findall(text))
+    return TOKENS_PER_RESPONSE + TOKENS_PER_CHOICE * choices + TOKENS_PER_CONTEST * contests
+
+
+def iter_batches(pages: Iterable[Tuple[int, str]],
+                 max_input_tokens: int = DEFAULT_MAX_INPUT_TOKENS,
+                 max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS) -> Iterator[Tuple[List[int], List[str]]]:
+    "Packs (page number, text) pairs into batches as they come, holding only the batch being filled; yields (pages, texts)"
+    output_budget = int(max_output_tokens * OUTPUT_SAFETY_MARGIN)
+    batch_pages: List[int] = []
+    batch_texts: List[str] = []
+    input_used = output_used = 0
+    for page_num, text in pages:
+        input_tokens = count_tokens(text)
+        output_tokens = estimate_output_tokens(text)
+        fits = input_used + input_tokens <= max_input_tokens and output_used + output_tokens <= output_budget
+        # never join pages that aren't next to each other, and a page too big for any batch goes on its own
+        if batch_pages and batch_pages[-1] == page_num - 1 and fits:
+            batch_pages.append(page_num)
+            batch_texts.append(text)
+            input_used += input_tokens
+            output_used += output_tokens
+        else:
+            if batch_pages:
+                yield batch_pages, batch_texts
+            batch_pages, batch_texts = [page_num], [text]
+            input_used, output_used = input_tokens, output_tokens
+    if batch_pages:
+        yield batch_pages, batch_texts
+
+
+def pack_pages(page_nums: List[int], page_texts: List[str],
+               max_input_tokens: int = DEFAULT_MAX_INPUT_TOKENS,
+               max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS) -> List[List[int]]:
+    "Greedily packs runs of consecutive pages into the largest batches that fit both token budgets"
+    pages = ((page_num, page_texts[page_num]) for page_num in sorted(page_nums))
+    return [batch_pages for batch_pages, _ in iter_batches(pages, max_input_tokens, max_output_tokens)]
@@ -0,0 +1,118 @@
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+
+from extraction_models import ElectionData
+from columnar_export import election_columns
+from election_store import normalize_contest_name
+from rule_parser import continues_previous_page
+from token_budget import CHOICE_ROW, SUMMARY_BLOCK
+
+
+# arithmetic checks over every Choice and Summary row in one vectorized pass:
+# every choice and every undervote/overvote/write-in group must satisfy center + mail == total.
+# The model occasionally misreads a column, and this is how we find out without checking by eye.
+
+SUMMARY_GROUPS = ["undervotes", "overvotes", "unresolved_write_ins", "unqualified_write_ins"]
+# "November 5, 2024 General Election 33956 of 84741 = 40.07%" in the page header ends in a percentage too
+REPORT_HEADER_ROW = re.compile(r"\d+ of [\d,]+ = [\d.]+%\s*$")
+
+
+class ValidationReport(BaseModel):
+    "Result of checking the vote arithmetic of an ElectionData"
+    choice_rows: int
+    bad_choice_rows: int
+    summary_checks: int
+    bad_summary_checks: int
+    contests: int
+    flagged_contests: List[str]
+
+    @property
+    def accuracy(self) -> float:
+        "Share of all arithmetic checks that pass - 1.0 means every row adds up"
+        checks = self.choice_rows + self.summary_checks
+        return 1.0 if checks == 0 else 1 - (self.bad_choice_rows + self.bad_summary_checks) / checks
+
+    def describe(self) -> str:
+        return (f"accuracy {self.accuracy:.2%}: {self.bad_choice_rows}/{self.choice_rows} choice rows and "
+                f"{self.bad_summary_checks}/{self.summary_checks} summary checks inconsistent, "
+                f"{len(self.flagged_contests)}/{self.contests} contests flagged")
+
+
+def validate_election_data(data: ElectionData) -> ValidationReport:
+    contest_columns, summary_columns = election_columns(data)
+    choices = pd.DataFrame(contest_columns)
+    summaries = pd.DataFrame(summary_columns)
+
+    bad_choices = (choices["vote_in_center"].to_numpy() + choices["vote_by_mail"].to_numpy()
+                   != choices["vote_total"].to_numpy())
+
+    # one column of pass/fail per summary group
+    bad_summary_groups = np.column_stack([
+        summaries[f"{group}_in_center"].to_numpy() + summaries[f"{group}_by_mail"].to_numpy() != summaries[f"{group}_total"].to_numpy()
+        for group in SUMMARY_GROUPS]).astype(bool)
+
+    flagged_choices = choices.loc[bad_choices, "contest"].tolist()
+    flagged_summaries = summaries.loc[bad_summary_groups.any(axis=1), "contest"].tolist()
+    flagged = list(dict.fromkeys(flagged_choices + flagged_summaries))
+    return ValidationReport(
+        choice_rows=len(choices),
+        bad_choice_rows=int(bad_choices.sum()),
+        summary_checks=bad_summary_groups.size,
+        bad_summary_checks=int(bad_summary_groups.sum()),
+        contests=len(data.contests),
+        flagged_contests=flagged,
+    )
+
+
+# contest_pages maps a normalized contest name to every page of the batch(es) it came back from;
+# narrow that down to the page where its header is, plus any pages the contest continues onto
+def pages_for_contests(contest_names: Iterable[str], contest_pages: Dict[str, Set[int]], page_texts: List[str]) -> Set[int]:
+    normalized_pages = {}
+    pages: Set[int] = set()
+    for name in contest_names:
+        header = normalize_contest_name(name)
+        candidates = sorted(contest_pages.get(header, set()))
+        for page_num in candidates:
+            if page_num not in normalized_pages:
+                normalized_pages[page_num] = normalize_contest_name(page_texts[page_num])
+        header_pages = [page_num for page_num in candidates if header and header in normalized_pages[page_num]]
+        if not header_pages:
+            pages.update(candidates)
+            continue
+        for page_num in header_pages:
+            pages.add(page_num)
+            while page_num + 1 < len(page_texts) and continues_previous_page(page_texts[page_num + 1]):
+                page_num += 1
+                pages.add(page_num)
+    return pages
+
+
+def expected_counts(text: str) -> Tuple[int, int]:
+    "(choice rows, summary blocks) in the page text - 0 when the layout has none we recognize"
+    choices = sum(1 for row in CHOICE_ROW.findall(text) if not REPORT_HEADER_ROW.search(row))
+    return choices, len(SUMMARY_BLOCK.findall(text))
+
+
+# whether a model's answer for a batch can be trusted without asking a stronger model:
+# it parsed, it wasn't cut off, its votes add up, and it has as many choices and summaries as the text has rows
+def check_batch(data: Optional[ElectionData], text: str, finish_reason: str = "stop") -> List[str]:
+    "The reasons not to trust this answer - an empty list means it passed every check"
+    problems = []
+    if finish_reason == "length":
+        problems.append("truncated")
+    if data is None:
+        return problems + ["no valid answer"]
+    report = validate_election_data(data)
+    if report.flagged_contests:
+        problems.append(f"vote arithmetic off in {len(report.flagged_contests)} contests")
+    choice_rows, summary_blocks = expected_counts(text)
+    choices = sum(len(contest.choices) for contest in data.contests)
+    if choice_rows and choices != choice_rows:
+        problems.append(f"{choices} choices for {choice_rows} choice rows")
+    if summary_blocks and len(data.summary) != summary_blocks:
+        problems.append(f"{len(data.summary)} summaries for {summary_blocks} summary blocks")
+    return problems
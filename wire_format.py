@@ -0,0 +1,75 @@
+from typing import List, Optional, Union
+
+from pydantic import BaseModel, Field
+
+from extraction_models import Choice, Contest, Summary, ElectionData
+
+
+# compact response format for the model: output tokens dominate latency, and full ElectionData JSON repeats
+# six key names for every choice and thirteen for every summary. Here a choice is one positional array and a
+# contest carries its summary as one array of 12 numbers, in the order the rows appear in the PDF.
+# decode() turns the answer back into the usual Choice/Contest/Summary models, losing nothing.
+
+CHOICE_WIRE_FIELDS = ["name", "party", "writein", "vote_in_center", "vote_by_mail", "vote_total"]
+SUMMARY_WIRE_FIELDS = [
+    "undervotes_in_center", "undervotes_by_mail", "undervotes_total",
+    "overvotes_in_center", "overvotes_by_mail", "overvotes_total",
+    "unqualified_write_ins_in_center", "unqualified_write_ins_by_mail", "unqualified_write_ins_total",
+    "unresolved_write_ins_in_center", "unresolved_write_ins_by_mail", "unresolved_write_ins_total",
+]
+
+
+# same rules as extraction_models: no min/max or length constraints, the descriptions do the guiding
+class CompactContest(BaseModel):
+    "One contest with its choices and its summary"
+    name: str = Field(..., description=Contest.model_fields["name"].description)
+    choices: Optional[List[List[Union[str, int, None]]]] = Field(..., description="""
+        One array per choice: [name, party, writein, Vote Center votes, Vote-by-Mail votes, Total votes].
+        party is null if there is none. writein is 1 only if the name is followed by '(W)', otherwise 0.
+        null only for a summary whose choices are not in the text.
+        """)
+    summary: Optional[List[int]] = Field(..., description="""
+        The 12 numbers under the choices, in this order: Undervotes (Vote Center, Vote-by-Mail, Total),
+        Overvotes (Vote Center, Vote-by-Mail, Total), Unqualified write-ins (Vote Center, Vote-by-Mail, Total),
+        Unresolved write-ins (Vote Center, Vote-by-Mail, Total). null if the contest has no summary rows.
+        """)
+
+
+class CompactElectionData(BaseModel):
+    "Describes the data extracted from an election PDF, in compact form"
+    contests: List[CompactContest]
+
+
+def encode(data: ElectionData) -> CompactElectionData:
+    summaries = {summary.contest: summary for summary in data.summary}
+    contests = []
+    for contest in data.contests:
+        summary = summaries.pop(contest.name, None)
+        contests.append(CompactContest(
+            name=contest.name,
+            choices=[[choice.name, choice.party, int(choice.writein), choice.vote_in_center, choice.vote_by_mail, choice.vote_total]
+                     for choice in contest.choices],
+            summary=[getattr(summary, field) for field in SUMMARY_WIRE_FIELDS] if summary is not None else None))
+    # a summary whose contest has no choices in this batch still has to come through
+    for summary in summaries.values():
+        contests.append(CompactContest(name=summary.contest, choices=None,
+                                       summary=[getattr(summary, field) for field in SUMMARY_WIRE_FIELDS]))
+    return CompactElectionData(contests=contests)
+
+
+def decode(compact: CompactElectionData) -> ElectionData:
+    "Raises ValueError if an array has the wrong number of entries"
+    contests, summaries = [], []
+    for compact_contest in compact.contests:
+        if compact_contest.choices is not None:
+            choices = []
+            for row in compact_contest.choices:
+                if len(row) != len(CHOICE_WIRE_FIELDS):
+                    raise ValueError(f"choice {row!r} in {compact_contest.name!r} should have {len(CHOICE_WIRE_FIELDS)} entries")
+                choices.append(Choice.model_validate(dict(zip(CHOICE_WIRE_FIELDS, row))))
+            contests.append(Contest(name=compact_contest.name, choices=choices))
+        if compact_contest.summary is not None:
+            if len(compact_contest.summary) != len(SUMMARY_WIRE_FIELDS):
+                raise ValueError(f"summary of {compact_contest.name!r} should have {len(SUMMARY_WIRE_FIELDS)} numbers")
+            summaries.append(Summary(contest=compact_contest.name, **dict(zip(SUMMARY_WIRE_FIELDS, compact_contest.summary))))
+    return ElectionData(contests=contests, summary=summaries)